@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+"""Measure the latency of parsing one fingerprint in each representation.
+
+Random fingerprints are formatted in each representation, then parsed
+with fp.scan (error codes) and fp.parse (error messages). Invalid
+inputs are timed as well, since they take the error paths.
+"""
+
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import getopt
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sc import fp
+
+def samples(n):
+   rnd = random.Random(42)
+   fps = [fp.fingerprint(bytearray((rnd.randint(0, 255) for i in range(32)))) for j in range(n)]
+   return [
+      ('compact', [f.compact() for f in fps]),
+      ('long', [f.long() for f in fps]),
+      ('long (no hyphens)', [f.long(split=0) for f in fps]),
+      ('hex', [f.hex() for f in fps]),
+      ('bad checksum', [f.compact()[:-1] + ('B' if f.compact()[-1] != 'B' else 'C') for f in fps]),
+      ('bad length', [f.compact()[:-1] for f in fps]),
+      ('bad format', ['fp:' + f.compact()[3:-1] + '=' for f in fps]),
+   ]
+
+def usage():
+   print("usage: %s [-n COUNT] [-r REPEAT]" % sys.argv[0])
+   print("Parse COUNT (default 1000) fingerprints per representation, REPEAT\n"
+         "(default 5) times, and print the best latency per parse.")
+
+opts, args = getopt.getopt(sys.argv[1:], "hn:r:", ['help'])
+dopts = dict(opts)
+if '-h' in dopts or '--help' in dopts:
+   usage()
+   sys.exit(0)
+
+n = int(dopts.get('-n', 1000))
+repeat = int(dopts.get('-r', 5))
+
+print("%-20s %12s %12s" % ("representation", "scan us", "parse us"))
+for name, strs in samples(n):
+   res = []
+   for f in (fp.scan, fp.parse):
+      t = min(timeit.repeat(lambda: [f(s) for s in strs], number=1, repeat=repeat))
+      res.append(t / n * 1e6)
+   print("%-20s %12.2f %12.2f" % (name, res[0], res[1]))
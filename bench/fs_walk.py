@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+"""Count the metadata system calls issued while fingerprinting a tree.
+
+A synthetic tree of small files is created (if it does not exist yet)
+and fingerprinted twice: once with the former os.listdir/isdir/getsize
+walk, and once with fs.fs_wrap. The calls to os.stat, os.lstat,
+os.listdir, os.scandir and os.DirEntry.stat are counted by wrapping
+them; reads of file contents are not counted.
+"""
+
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import getopt
+import time
+import fnmatch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sc import fp, fs
+
+counts = {}
+
+def _count(name, f):
+   def wrapper(*args, **kwargs):
+      counts[name] = counts.get(name, 0) + 1
+      return f(*args, **kwargs)
+   return wrapper
+
+class _counted_entry(object):
+   """Proxy for os.DirEntry counting the calls that reach the system."""
+   def __init__(self, e):
+      self._e = e
+      self._stated = False
+      self.name = e.name
+      self.path = e.path
+   def stat(self):
+      if not self._stated:
+         counts['DirEntry.stat'] = counts.get('DirEntry.stat', 0) + 1
+         self._stated = True
+      return self._e.stat()
+   def is_dir(self):
+      return self._e.is_dir()
+
+def install_counters():
+   os.stat = _count('stat', os.stat)
+   os.lstat = _count('lstat', os.lstat)
+   os.listdir = _count('listdir', os.listdir)
+   scandir = _count('scandir', fs.scandir)
+   if fs.scandir is getattr(os, 'scandir', None):
+      fs.scandir = lambda d: (_counted_entry(e) for e in scandir(d))
+   else:
+      # the fallback entries already call os.stat
+      fs.scandir = scandir
+
+class legacy_wrap(fp.fingerprintable):
+   """The filesystem walk as it was before fs_wrap used os.scandir."""
+
+   def __init__(self, path, ignorelist = ['.*']):
+      assert os.path.exists(path)
+      self._path = path
+      self._ignorelist = ignorelist
+
+   def visit(self, v):
+      if os.path.isdir(self._path):
+         v.enter_dict()
+         for f in os.listdir(self._path):
+            if any((fnmatch.fnmatch(f, p) for p in self._ignorelist)):
+               continue
+            fpath = os.path.join(self._path, f)
+            if os.path.isdir(fpath):
+               v.visit_entry(fs.unquote(f), 't', legacy_wrap(fpath, self._ignorelist))
+            else:
+               v.visit_entry(fs.unquote(f), 's', legacy_wrap(fpath, self._ignorelist))
+         v.leave_dict()
+      else:
+         v.enter_file(os.path.getsize(self._path))
+         with open(self._path, 'rb') as f:
+            while True:
+               chunk = bytearray(f.read(8192))
+               if len(chunk) == 0: break
+               v.visit_data(chunk)
+         v.leave_file()
+
+def make_tree(root, nfiles, fanout):
+   """Create a tree of nfiles small files, at most fanout per directory."""
+   n = 0
+   stack = [(root, nfiles)]
+   while stack:
+      d, cnt = stack.pop()
+      os.mkdir(d)
+      if cnt <= fanout:
+         for i in range(cnt):
+            with open(os.path.join(d, 'f%d' % i), 'w') as f:
+               f.write('%d\n' % n)
+            n += 1
+      else:
+         per = (cnt + fanout - 1) // fanout
+         for i in range(0, cnt, per):
+            stack.append((os.path.join(d, 'd%d' % (i // per)), min(per, cnt - i)))
+
+def run(label, obj):
+   counts.clear()
+   t0 = time.time()
+   v = fp.compute_visitor()
+   obj.visit(v)
+   t = time.time() - t0
+   total = sum(counts.values())
+   print("%-8s %s  %.2fs  %d calls (%s)" %
+         (label, v.fingerprint().compact(), t, total,
+          ', '.join(('%s %d' % kv for kv in sorted(counts.items())))))
+
+def usage():
+   print("usage: %s [-n NFILES] [-f FANOUT] DIR" % sys.argv[0])
+   print("Create a tree of NFILES small files (default 1000000) in DIR\n"
+         "if it does not exist yet, then count the metadata system calls\n"
+         "issued to fingerprint it.")
+
+opts, args = getopt.getopt(sys.argv[1:], "hn:f:", ['help'])
+dopts = dict(opts)
+if '-h' in dopts or '--help' in dopts or len(args) != 1:
+   usage()
+   sys.exit(0)
+
+root = args[0]
+if not os.path.exists(root):
+   make_tree(root, int(dopts.get('-n', 1000000)), int(dopts.get('-f', 1000)))
+
+install_counters()
+run('legacy', legacy_wrap(root))
+run('scandir', fs.fs_wrap(root))
@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+"""Measure the throughput of the hash functions computing fingerprints.
+
+For each hash function of fp.hashes, the following are timed, keeping
+the best of several runs, and reported in GB/s of file contents:
+
+  memory      the hash function alone, over a buffer in 1 MiB updates
+  file        the fingerprint of a large file, read through fs.fs_wrap
+  file_digest the same with hashlib.file_digest (python 3.11+)
+  small       the fingerprint of a tree of many small files
+  small -jN   the same with par.compute and N worker threads (N > 1)
+
+The files are created in a work directory and read from the page cache
+after a first run, so the file benchmarks measure the fingerprinting
+itself rather than the storage.
+"""
+
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import getopt
+import json
+import hashlib
+import multiprocessing
+import platform
+import shutil
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sc import fp, fs, par, walk
+
+def make_files(work, size, nfiles, fsize):
+   """Create a file of size bytes and a tree of nfiles files of fsize bytes."""
+   big = os.path.join(work, 'big')
+   with open(big, 'wb') as f:
+      for i in range(0, size, 1 << 20):
+         f.write(os.urandom(min(1 << 20, size - i)))
+   small = os.path.join(work, 'small')
+   os.mkdir(small)
+   for i in range(0, nfiles, 1000):
+      d = os.path.join(small, 'd%d' % (i // 1000))
+      os.mkdir(d)
+      for j in range(i, min(i + 1000, nfiles)):
+         with open(os.path.join(d, 'f%d' % j), 'wb') as f:
+            f.write(os.urandom(fsize))
+   return big, small
+
+def bench_memory(name, size, repeat):
+   buf = memoryview(os.urandom(size))
+   def run():
+      h = fp.new_hash(name)
+      for i in range(0, size, 1 << 20):
+         h.update(buf[i:i + (1 << 20)])
+      h.digest()
+   return min(timeit.repeat(run, number=1, repeat=repeat))
+
+def bench_file(name, path, repeat):
+   return min(timeit.repeat(lambda: walk.walk(fs.fs_wrap(path), fp.compute_visitor(hash_name=name)),
+                            number=1, repeat=repeat))
+
+def bench_file_digest(name, path, repeat):
+   sz = os.path.getsize(path)
+   def run():
+      # the hash object is seeded with the header of the file object
+      h = fp.new_hash(name)
+      h.update(b's%d\0' % sz)
+      with open(path, 'rb') as f:
+         hashlib.file_digest(f, lambda: h).digest()
+   return min(timeit.repeat(run, number=1, repeat=repeat))
+
+def bench_tree(name, path, jobs, repeat):
+   return min(timeit.repeat(lambda: par.compute(fs.fs_wrap(path), jobs, hash_name=name),
+                            number=1, repeat=repeat))
+
+def usage():
+   print("usage: %s [-s MIB] [-n NFILES] [-f BYTES] [-j JOBS] [-r REPEAT] [-o FILE] [-w DIR]" % sys.argv[0])
+   print("Measure each hash function over MIB (default 256) MiB of data and\n"
+         "NFILES (default 20000) files of BYTES (default 4096) bytes, with\n"
+         "JOBS (default: the number of CPUs) workers for the parallel run,\n"
+         "keeping the best of REPEAT (default 3) runs. The results are\n"
+         "written to FILE in JSON with -o. The files are created in DIR\n"
+         "(default: a temporary directory, removed afterwards).")
+
+opts, args = getopt.getopt(sys.argv[1:], "hs:n:f:j:r:o:w:", ['help'])
+dopts = dict(opts)
+if '-h' in dopts or '--help' in dopts:
+   usage()
+   sys.exit(0)
+
+size = int(dopts.get('-s', 256)) << 20
+nfiles = int(dopts.get('-n', 20000))
+fsize = int(dopts.get('-f', 4096))
+jobs = int(dopts.get('-j', multiprocessing.cpu_count()))
+repeat = int(dopts.get('-r', 3))
+work = dopts.get('-w') or tempfile.mkdtemp(prefix='sc-bench-')
+if not os.path.exists(work):
+   os.makedirs(work)
+
+results = {}
+try:
+   big, small = make_files(work, size, nfiles, fsize)
+   print("%-24s %9s %8s" % ("benchmark", "time", "GB/s"))
+   for name in sorted(fp.hashes):
+      runs = [('memory', size, lambda: bench_memory(name, size, repeat)),
+              ('file', size, lambda: bench_file(name, big, repeat))]
+      if hasattr(hashlib, 'file_digest'):
+         runs.append(('file_digest', size, lambda: bench_file_digest(name, big, repeat)))
+      runs.append(('small', nfiles * fsize, lambda: bench_tree(name, small, 1, repeat)))
+      if jobs > 1:
+         runs.append(('small -j%d' % jobs, nfiles * fsize, lambda: bench_tree(name, small, jobs, repeat)))
+      for kind, sz, run in runs:
+         key = '%s %s' % (name, kind)
+         t = run()
+         results[key] = {'seconds': t, 'gb_s': sz / 1e9 / t}
+         print("%-24s %8.3fs %8.3f" % (key, t, results[key]['gb_s']))
+finally:
+   if '-w' not in dopts:
+      shutil.rmtree(work)
+
+if '-o' in dopts:
+   with open(dopts['-o'], 'w') as f:
+      json.dump({'python': platform.python_version(), 'cpus': multiprocessing.cpu_count(),
+                 'results': results}, f, indent=1, sort_keys=True)
@@ -0,0 +1,92 @@
+#! /usr/bin/env python
+"""Measure the throughput of the conversions between bytes and strings.
+
+Each conversion used by the JSON and UTF-8 representations is timed
+on the same random data with the former per-byte implementation
+("before") and the current codec-based one ("after").
+"""
+
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import getopt
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sc import py, js
+
+try:
+   unichr(0)
+except:
+   unichr = chr
+
+def old_bytes_to_str(data):
+   value = u''
+   for c in data:
+      value += unichr(c)
+   return value
+
+def old_str_to_bytes(s):
+   return bytearray((ord(c) for c in s))
+
+def new_bytes_to_str(data):
+   v = js.pyjson_visitor(False)
+   py.pyrepr_wrap(data).visit(v)
+   return v.value()
+
+def new_str_to_bytes(s):
+   return js.pyjson_wrap(s)._obj
+
+def old_force_bytes(data):
+   if isinstance(data, str) or isinstance(data, type(u'')):
+      data = old_str_to_bytes(data)
+   return data
+
+def old_utf8_encode(data):
+   return bytearray(old_force_bytes(u''.join((unichr(x) for x in data)).encode('utf-8')))
+
+def new_utf8_encode(data):
+   return bytearray(data.decode('latin-1').encode('utf-8'))
+
+def old_utf8_decode(data):
+   return old_str_to_bytes(data.decode('utf-8'))
+
+def new_utf8_decode(data):
+   return bytearray(data.decode('utf-8'), 'latin-1')
+
+def measure(f, arg, size):
+   t0 = time.time()
+   result = f(arg)
+   t = time.time() - t0
+   return result, size / (1024. * 1024.) / max(t, 1e-9)
+
+def usage():
+   print("usage: %s [-s MBYTES]" % sys.argv[0])
+   print("Time the byte/string conversions on MBYTES (default 0.25) of random data.\n"
+         "The former conversions take quadratic time on large sizes.")
+
+opts, args = getopt.getopt(sys.argv[1:], "hs:", ['help'])
+dopts = dict(opts)
+if '-h' in dopts or '--help' in dopts:
+   usage()
+   sys.exit(0)
+
+size = int(float(dopts.get('-s', 0.25)) * 1024 * 1024)
+rnd = random.Random(42)
+data = bytearray((rnd.randint(0, 255) for i in range(size)))
+text = data.decode('latin-1')
+utf8 = bytearray(text.encode('utf-8'))
+
+print("%-24s %12s %12s" % ("conversion", "before MB/s", "after MB/s"))
+for name, old, new, arg in [
+      ('pyjson_visitor (b->s)', old_bytes_to_str, new_bytes_to_str, data),
+      ('pyjson_wrap (s->b)', old_str_to_bytes, new_str_to_bytes, text),
+      ('utf8 output', old_utf8_encode, new_utf8_encode, data),
+      ('utf8 input', old_utf8_decode, new_utf8_decode, utf8)]:
+   r1, before = measure(old, arg, size)
+   r2, after = measure(new, arg, size)
+   assert r1 == r2
+   print("%-24s %12.1f %12.1f" % (name, before, after))
@@ -0,0 +1,258 @@
+#! /usr/bin/env python
+"""Measure the throughput of objtool.py conversions and fingerprint parsing.
+
+Synthetic trees of several shapes are generated in a work directory:
+
+  wide   one directory of many small files
+  deep   a chain of nested directories, one file each
+  tiny   a balanced tree of many tiny files
+  huge   a few large files
+  blob   a single file (simple object)
+
+Each tree is first converted to every source representation, then
+objtool.py is run for every source/destination pair that applies to
+it (raw:, utf8: and str: only hold simple objects), with --no-cache.
+The best time of several runs is reported in MB/s of file contents
+and in entries/s, where entries are files and dictionaries; the time
+includes the startup of the interpreter, measured separately. The
+parsing and formatting of fingerprints are timed in process, in
+ops/s.
+
+The results can be written to a JSON file, and compared against the
+results of a previous run: benchmarks slower than the baseline by
+more than the given threshold are reported, and the exit status is 1
+if there are any.
+"""
+
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import getopt
+import json
+import binascii
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import timeit
+import fnmatch
+import platform
+
+top = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, top)
+from sc import fp
+
+objtool = os.path.join(top, 'objtool.py')
+
+sources = ['fs', 'json', 'raw', 'utf8', 'str', 'pickle', 'store']
+destinations = ['fp', 'fs', 'json', 'raw', 'utf8', 'pickle', 'store']
+simple_only = ['raw', 'utf8', 'str']
+
+# the command line length limits the size of str: sources, which hold
+# the start of the blob in hexadecimal
+str_max = 100000
+
+def _data(rnd, size):
+   return bytearray((rnd.randint(32, 126) for i in range(size)))
+
+def shapes(scale):
+   """Return the tree shapes as (name, tree) pairs, where dictionaries
+   are Python dicts and files are bytearrays."""
+   rnd = random.Random(42)
+   s = lambda n: max(1, int(n * scale))
+   wide = dict((('f%d' % i, _data(rnd, 1024)) for i in range(s(2000))))
+   deep = {}
+   cur = deep
+   for i in range(s(200)):
+      cur['f'] = _data(rnd, 1024)
+      cur['d'] = {}
+      cur = cur['d']
+   tiny = {}
+   n = s(5000)
+   for i in range(n):
+      d = tiny.setdefault('d%d' % (i % 50), {})
+      d = d.setdefault('d%d' % (i // 50 % 50), {})
+      d['f%d' % i] = _data(rnd, 16)
+   huge = dict((('f%d' % i, bytearray(os.urandom(s(4 << 20)))) for i in range(4)))
+   blob = bytearray(os.urandom(s(4 << 20)))
+   return [('wide', wide), ('deep', deep), ('tiny', tiny), ('huge', huge), ('blob', blob)]
+
+def measure_tree(tree):
+   """Return the size of the file contents and the number of entries."""
+   size = entries = 0
+   stack = [tree]
+   while stack:
+      t = stack.pop()
+      entries += 1
+      if isinstance(t, dict):
+         stack.extend(t.values())
+      else:
+         size += len(t)
+   return size, entries
+
+def write_tree(path, tree):
+   stack = [(path, tree)]
+   while stack:
+      p, t = stack.pop()
+      if isinstance(t, dict):
+         os.mkdir(p)
+         stack.extend(((os.path.join(p, k), v) for k, v in t.items()))
+      else:
+         with open(p, 'wb') as f:
+            f.write(t)
+
+def run_objtool(*args):
+   cmd = [sys.executable, objtool, '--no-cache'] + list(args)
+   with open(os.devnull, 'wb') as null:
+      out = subprocess.check_output(cmd, stderr=null)
+   return out.decode('ascii').strip()
+
+def prepare(work, name, tree):
+   """Write tree in work in every source representation.
+
+   Returns a dictionary mapping each source method to its argument."""
+   base = os.path.join(work, name)
+   write_tree(base + '.fs', tree)
+   args = {'fs': 'fs:' + base + '.fs'}
+   simple = not isinstance(tree, dict)
+   for m in ['json', 'pickle'] + (simple and ['raw', 'utf8'] or []):
+      run_objtool(args['fs'], '%s:%s.%s' % (m, base, m))
+      args[m] = '%s:%s.%s' % (m, base, m)
+   s = run_objtool(args['fs'], 'store:%s.store' % base)
+   args['store'] = 'store:%s.store@%s' % (base, s)
+   if simple:
+      args['str'] = 'str:' + binascii.b2a_hex(bytes(tree[:str_max // 2])).decode('ascii')
+   return args
+
+def pairs(name):
+   for s in sources:
+      if s in simple_only and name != 'blob':
+         continue
+      for d in destinations:
+         if d in simple_only and name != 'blob':
+            continue
+         yield s, d
+
+def _clean(path):
+   if os.path.isdir(path):
+      shutil.rmtree(path)
+   elif os.path.exists(path):
+      os.remove(path)
+
+def bench_pair(work, src, d, repeat):
+   out = os.path.join(work, 'out.' + d)
+   dst = d == 'fp' and 'fp:compact' or '%s:%s' % (d, out)
+   best = None
+   for i in range(repeat):
+      _clean(out)
+      t0 = time.time()
+      run_objtool(src, dst)
+      t = time.time() - t0
+      best = best is None and t or min(best, t)
+   _clean(out)
+   return best
+
+def bench_startup(repeat):
+   return min((timeit.timeit(lambda: run_objtool('str:x', 'fp:compact'), number=1)
+               for i in range(repeat)))
+
+def bench_fingerprints(repeat, n = 1000):
+   rnd = random.Random(42)
+   fps = [fp.fingerprint(bytearray((rnd.randint(0, 255) for i in range(32)))) for j in range(n)]
+   res = {}
+   for fmt in ['compact', 'long', 'hex']:
+      strs = [getattr(f, fmt)() for f in fps]
+      t = min(timeit.repeat(lambda: [fp.parse(s) for s in strs], number=1, repeat=repeat))
+      res['parse ' + fmt] = {'ops_s': n / t}
+      t = min(timeit.repeat(lambda: [getattr(f, fmt)() for f in fps], number=1, repeat=repeat))
+      res['format ' + fmt] = {'ops_s': n / t}
+   return res
+
+def compare(results, baseline, threshold):
+   """Print the ratio of each result to the baseline.
+
+   Returns the number of benchmarks slower than the baseline by more
+   than threshold (a fraction)."""
+   slower = 0
+   print("\n%-28s %12s %12s %8s" % ("benchmark", "baseline", "current", "ratio"))
+   for k in sorted(results):
+      if k not in baseline:
+         continue
+      unit = 'ops_s' in results[k] and 'ops_s' or 'entries_s'
+      old, new = baseline[k][unit], results[k][unit]
+      ratio = new / old
+      mark = ''
+      if ratio < 1 - threshold:
+         mark = '  SLOWER'
+         slower += 1
+      print("%-28s %12.1f %12.1f %7.2fx%s" % (k, old, new, ratio, mark))
+   return slower
+
+def usage():
+   print("usage: %s [-s SCALE] [-r REPEAT] [-k PATTERN] [-o FILE] [-c FILE [-t PERCENT]] [-w DIR]" % sys.argv[0])
+   print("Run the benchmarks on trees scaled by SCALE (default 1), keeping the\n"
+         "best of REPEAT (default 3) runs. Only benchmarks whose name matches\n"
+         "PATTERN (e.g. 'wide *', '* -> fp') are run. The results are written\n"
+         "to FILE in JSON with -o, and compared with those in FILE with -c;\n"
+         "a slowdown of more than PERCENT (default 10) percent is reported as\n"
+         "a regression. The trees are generated in DIR (default: a temporary\n"
+         "directory, removed afterwards).")
+
+opts, args = getopt.getopt(sys.argv[1:], "hs:r:k:o:c:t:w:", ['help'])
+dopts = dict(opts)
+if '-h' in dopts or '--help' in dopts:
+   usage()
+   sys.exit(0)
+
+scale = float(dopts.get('-s', 1))
+repeat = int(dopts.get('-r', 3))
+pattern = dopts.get('-k', '*')
+threshold = float(dopts.get('-t', 10)) / 100.
+work = dopts.get('-w') or tempfile.mkdtemp(prefix='sc-bench-')
+if not os.path.exists(work):
+   os.makedirs(work)
+
+results = {}
+try:
+   startup = bench_startup(repeat)
+   print("interpreter startup: %.3fs (included below)" % startup)
+   print("%-28s %9s %10s %12s" % ("benchmark", "time", "MB/s", "entries/s"))
+   for name, tree in shapes(scale):
+      size, entries = measure_tree(tree)
+      args = None
+      for s, d in pairs(name):
+         key = '%s %s -> %s' % (name, s, d)
+         if not fnmatch.fnmatch(key, pattern):
+            continue
+         if args is None:
+            args = prepare(work, name, tree)
+         if s not in args:
+            continue
+         t = bench_pair(work, args[s], d, repeat)
+         sz, n = s == 'str' and (len(args[s]) - 4, 1) or (size, entries)
+         results[key] = {'seconds': t, 'mb_s': sz / (1024. * 1024.) / t, 'entries_s': n / t}
+         print("%-28s %8.3fs %10.2f %12.0f" % (key, t, results[key]['mb_s'], results[key]['entries_s']))
+   fpres = dict((('fingerprint ' + k, v) for k, v in bench_fingerprints(repeat).items()))
+   for k in sorted(fpres):
+      if fnmatch.fnmatch(k, pattern):
+         results[k] = fpres[k]
+         print("%-28s %32.0f ops/s" % (k, results[k]['ops_s']))
+finally:
+   if '-w' not in dopts:
+      shutil.rmtree(work)
+
+if '-o' in dopts:
+   with open(dopts['-o'], 'w') as f:
+      json.dump({'python': platform.python_version(), 'scale': scale,
+                 'startup': startup, 'results': results}, f, indent=1, sort_keys=True)
+
+if '-c' in dopts:
+   with open(dopts['-c']) as f:
+      baseline = json.load(f)
+   if baseline.get('scale') != scale:
+      print("warning: baseline scale %s differs from %s" % (baseline.get('scale'), scale), file=sys.stderr)
+   if compare(results, baseline['results'], threshold) > 0:
+      sys.exit(1)
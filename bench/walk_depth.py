@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+"""Compare the recursive and iterative traversals of object trees.
+
+Each tree is fingerprinted with obj.visit(fp.compute_visitor()), which
+recurses once per level of nesting, and with walk.walk, which uses an
+explicit stack. For each traversal the time, the number of Python
+frames on the stack when the deepest file is reached and, with python
+3, the peak memory allocated are printed.
+
+The trees are a chain of nested dictionaries DEPTH levels deep, and a
+balanced tree of about as many files.
+"""
+
+from __future__ import print_function
+
+import os
+import os.path
+import sys
+import getopt
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sc import fp, py, walk
+
+try:
+   import tracemalloc
+except ImportError:
+   # python 2
+   tracemalloc = None
+
+def _frames():
+   n = 0
+   f = sys._getframe()
+   while f is not None:
+      n += 1
+      f = f.f_back
+   return n
+
+class probe_visitor(fp.compute_visitor):
+   """Fingerprint visitor recording the stack depth at the first file
+   found at the given nesting level."""
+
+   def __init__(self, level, depth = 0, top = None):
+      fp.compute_visitor.__init__(self)
+      self._level = level
+      self._depth = depth
+      self._top = top or self
+      self.frames = None
+
+   def enter_file(self, sz):
+      if self._depth == self._level and self._top.frames is None:
+         self._top.frames = _frames()
+      fp.compute_visitor.enter_file(self, sz)
+
+   def enter_entry(self, name, t):
+      self._check_entry(name)
+      return probe_visitor(self._level, self._depth + 1, self._top)
+
+def chain(depth):
+   d = {}
+   cur = d
+   for i in range(depth):
+      cur['f'] = 'level %d' % i
+      cur['d'] = {}
+      cur = cur['d']
+   cur['f'] = 'bottom'
+   return d
+
+def balanced(nfiles, fanout):
+   if nfiles <= fanout:
+      return dict((('f%d' % i, 'file %d' % i) for i in range(nfiles)))
+   per = (nfiles + fanout - 1) // fanout
+   return dict((('d%d' % (i // per), balanced(min(per, nfiles - i), fanout)) for i in range(0, nfiles, per)))
+
+def height(tree):
+   h = 0
+   while isinstance(tree, dict):
+      tree = tree[sorted(tree.keys())[0]]
+      h += 1
+   return h
+
+def run(label, f, obj, level):
+   if tracemalloc is not None:
+      tracemalloc.start()
+   t0 = time.time()
+   try:
+      v = f(obj, probe_visitor(level))
+      res = v.fingerprint().compact()
+   except RuntimeError: # RecursionError
+      v = None
+      res = 'recursion limit reached'
+   t = time.time() - t0
+   peak = '-'
+   if tracemalloc is not None:
+      peak = '%.1f MB' % (tracemalloc.get_traced_memory()[1] / (1024. * 1024.))
+      tracemalloc.stop()
+   frames = v is not None and v.frames or '-'
+   print("%-22s %8.2fs %8s %10s  %s" % (label, t, frames, peak, res))
+
+def recursive(obj, v):
+   obj.visit(v)
+   return v
+
+def usage():
+   print("usage: %s [-d DEPTH] [-f FANOUT] [-l LIMIT]" % sys.argv[0])
+   print("Traverse a chain of DEPTH (default 10000) nested dictionaries and a\n"
+         "balanced tree of as many files with FANOUT (default 10) entries per\n"
+         "dictionary. LIMIT sets the Python recursion limit (default: unchanged).")
+
+opts, args = getopt.getopt(sys.argv[1:], "hd:f:l:", ['help'])
+dopts = dict(opts)
+if '-h' in dopts or '--help' in dopts:
+   usage()
+   sys.exit(0)
+
+depth = int(dopts.get('-d', 10000))
+fanout = int(dopts.get('-f', 10))
+if '-l' in dopts:
+   sys.setrecursionlimit(int(dopts['-l']))
+
+print("%-22s %9s %8s %10s  %s" % ("traversal", "time", "frames", "peak mem", "fingerprint"))
+for shape, tree in [('chain', chain(depth)), ('balanced', balanced(depth, fanout))]:
+   obj = py.pyrepr_wrap(tree)
+   level = height(tree)
+   run('%s, recursive' % shape, recursive, obj, level)
+   run('%s, walk' % shape, walk.walk, obj, level)
@@ -11,6 +11,7 @@ patdict='{"zz":"more","hello":["fp:s5pIIHf32iiVNH_eBGBMXtlXhMa7dI3w9KBrvHZ-v1NRA
 
 for py in $PY3 $PY2; do
     $py sc/fp.py # self-test
+    $py -m sc.fpindex # self-test
 
     fpt="$py fptool.py"
     objt="$py objtool.py"
@@ -23,6 +24,9 @@ for py in $PY3 $PY2; do
     $fpt -f binary ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff
     $fpt -f compact b39a4820-77f7da28-95347fde-04604c5e-d95784c6-bb748df0-f4a06bbc-767ebf53
     $fpt -c fp:s5pIIHf32iiVNH_eBGBMXtlXhMa7dI3w9KBrvHZ-v1NRAA fp:DX8z4T4U8xsxlUlKx9IfHYjuWt7E05KrGj_jNqud8ku2Xw || true
+    printf 'fp:s5pIIHf32iiVNH_eBGBMXtlXhMa7dI3w9KBrvHZ-v1NRAA\nbogus\nB39A4820-77F7DA28-95347FDE-04604C5E-D95784C6-BB748DF0-F4A06BBC-767EBF53\n' | $fpt -f long - || true
+    s1=`printf 'fp:s5pIIHf32iiVNH_eBGBMXtlXhMa7dI3w9KBrvHZ-v1NRAA\n' | $fpt -f binary - | $fpt -B -f compact -`
+    test "$s1" = fp:s5pIIHf32iiVNH_eBGBMXtlXhMa7dI3w9KBrvHZ-v1NRAA
 
     $objt -h
 
@@ -56,8 +60,147 @@ for py in $PY3 $PY2; do
         printf "$datum" | $objt json:- fs:tmp1.d
         $objt fs:tmp1.d fs:tmp2.d
         diff -r tmp1.d tmp2.d
+        rm -rf tmp2.d
+        $objt -j 3 --fsync fs:tmp1.d fs:tmp2.d
+        diff -r tmp1.d tmp2.d
         $objt fs:tmp1.d fp:compact
         $objt fs:tmp2.d fp:compact
+        $objt -j 3 fs:tmp1.d fp:compact
+        if test $py = $PY3; then
+            test `$objt --async=4 fs:tmp1.d fp:compact` = `$objt fs:tmp1.d fp:compact`
+        fi
+        $objt --no-cache fs:tmp1.d fp:compact
+        rm -rf tmp.cache
+        XDG_CACHE_HOME=tmp.cache $objt fs:tmp1.d fp:compact >/dev/null
+        test ! -e tmp.cache
+        test `$objt --cache=tmp.cache fs:tmp1.d fp:compact` = `$objt fs:tmp1.d fp:compact`
+        test `$objt --cache=tmp.cache fs:tmp1.d fp:compact` = `$objt fs:tmp1.d fp:compact`
+        rm -rf tmp.cache
+        $objt --stats --progress fs:tmp1.d json:- >/dev/null
+        rm -rf tmp.store tmp3.d
+        s=`$objt fs:tmp1.d store:tmp.store`
+        $objt store:tmp.store@$s fs:tmp3.d
+        diff -r tmp1.d tmp3.d
+        $objt store:tmp.store@$s fp:compact
+        $objt verify $s fs:tmp1.d >/dev/null
+        $objt -j 2 verify $s fs:tmp1.d store:tmp.store >/dev/null
+        if $objt verify $s str:other store:tmp.store >/dev/null; then false; fi
+        if test -d tmp1.d; then
+            echo changed >tmp3.d/world
+            test "`$objt -j 2 verify $s fs:tmp3.d store:tmp.store`" = "mismatch: world (content differs)"
+            rm tmp3.d/world
+            mkdir tmp3.d/new
+            test "`$objt verify $s fs:tmp3.d store:tmp.store`" = "mismatch: new/ (unexpected entry)"
+            rmdir tmp3.d/new
+            test "`$objt verify $s fs:tmp3.d store:tmp.store`" = "mismatch: world (missing)"
+        fi
+        $objt diff fs:tmp1.d store:tmp.store@$s
+        rm -f tmp.mf tmp.mfb
+        test `$objt fs:tmp1.d manifest:tmp.mf` = $s
+        $objt fs:tmp1.d binmanifest:tmp.mfb >/dev/null
+        test `$objt manifest:tmp.mf fp:compact` = $s
+        test `$objt manifest:tmp.mfb fp:compact` = $s
+        $objt diff manifest:tmp.mf fs:tmp1.d
+        $objt verify $s fs:tmp1.d manifest:tmp.mfb >/dev/null
+        if $objt verify $s str:other manifest:tmp.mf >/dev/null; then false; fi
+        rm -f tmp.mf tmp.mfb
+        # entries named like the root
+        echo '{".":"x","..":{"a":"y"}}' | $objt json:- fs:tmp.sd
+        $objt prove fs:tmp.sd %2E >tmp.proof
+        sr=`$objt fs:tmp.sd fp:compact`
+        test "`$objt check-proof $sr json:tmp.proof fs:tmp.sd/%2E`" = "`$objt str:x fp:compact` %2E"
+        rm -rf tmp.sd tmp.proof
+        echo '{".":"x","..":{"a":"y"}}' | $objt json:- manifest:tmp.mf >/dev/null
+        test `$objt manifest:tmp.mf fp:compact` = `echo '{".":"x","..":{"a":"y"}}' | $objt json:- fp:compact`
+        rm -f tmp.mf
+        test `$objt --hash=sha256 -j 2 fs:tmp1.d fp:compact` = $s
+        if test $py = $PY3; then
+            test `$objt --hash=blake2b fs:tmp1.d fp:compact` != $s
+            if $objt --hash=blake2b fs:tmp1.d store:tmp.store; then false; fi
+            if $objt --hash=blake2b verify $s fs:tmp1.d; then false; fi
+            b=`$objt --hash=blake2b fs:tmp1.d fp:compact`
+            test `$objt --hash=blake2b -j 2 fs:tmp1.d fp:compact` = $b
+            test `$objt --hash=blake2b --async=2 fs:tmp1.d fp:compact` = $b
+            rm -f tmp.cache
+            test `$objt --hash=blake2b --cache=tmp.cache fs:tmp1.d fp:compact` = $b
+            test `$objt --hash=blake2b --cache=tmp.cache fs:tmp1.d fp:compact` = $b
+            if $objt --cache=tmp.cache fs:tmp1.d fp:compact 2>/dev/null; then false; fi
+            rm -f tmp.cache
+            $objt --cache=tmp.cache fs:tmp1.d fp:compact >/dev/null
+            if $objt --hash=blake2b --cache=tmp.cache fs:tmp1.d fp:compact 2>/dev/null; then false; fi
+            rm -f tmp.cache
+        fi
+        # file deleted after the manifest was written
+        rm -rf tmp.sd tmp.mf tmp.cache
+        echo '{"D":{"a":"x","b":"y"},"c":"z"}' | $objt json:- fs:tmp.sd
+        $objt fs:tmp.sd manifest:tmp.mf >/dev/null
+        rm tmp.sd/D/b
+        sleep 3
+        test `$objt --cache=tmp.cache --seed-cache=tmp.mf fs:tmp.sd fp:compact` = `$objt fs:tmp.sd fp:compact`
+        rm -rf tmp.sd tmp.mf tmp.cache
+        # names starting with '.' are written as %2E...
+        echo '{".hid":"a","vis":"b","x":{".y":"c"}}' | $objt json:- fs:tmp.sd
+        $objt fs:tmp.sd manifest:tmp.mf >/dev/null
+        sleep 3
+        $objt -v --cache=tmp.cache --seed-cache=tmp.mf fs:tmp.sd fp:compact 2>&1 >/dev/null | grep -q '^3 fingerprints seeded'
+        rm -rf tmp.sd tmp.mf tmp.cache
+        # reference rewritten in place: the directory is unchanged
+        echo '{"D":{"r":["fp:s5pIIHf32iiVNH_eBGBMXtlXhMa7dI3w9KBrvHZ-v1NRAA"],"a":"x"}}' | $objt json:- fs:tmp.sd
+        echo '{"D":{"r":["fp:s5pIIHf32iiVNH_eBGBMXtlXhMa7dI3w9KBrvHZ-v1NRAA"],"a":"x"}}' | $objt -j 2 --fsync json:- fs:tmp.sd2
+        diff -r tmp.sd tmp.sd2
+        rm -rf tmp.sd2
+        sleep 3
+        $objt --cache=tmp.cache fs:tmp.sd fp:compact >/dev/null
+        cp -r tmp.cache tmp.cache2
+        cp -r tmp.cache tmp.cache3
+        $fpt -f binary ffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffff >tmp.sd/D/%00r
+        test `$objt --cache=tmp.cache fs:tmp.sd fp:compact` = `$objt fs:tmp.sd fp:compact`
+        test `$objt --cache=tmp.cache2 -j 2 fs:tmp.sd fp:compact` = `$objt fs:tmp.sd fp:compact`
+        if test $py = $PY3; then
+            test `$objt --cache=tmp.cache3 --async=2 fs:tmp.sd fp:compact` = `$objt fs:tmp.sd fp:compact`
+        fi
+        rm -rf tmp.sd tmp.cache tmp.cache2 tmp.cache3
+        if $objt diff fs:tmp1.d str:other >/dev/null; then false; fi
+        if test -d tmp1.d; then
+            $objt prove fs:tmp1.d zz > tmp.proof
+            $objt check-proof $s json:tmp.proof fs:tmp1.d/zz >/dev/null
+            test "`printf "$datum" | $objt prove json:- zz`" = "`cat tmp.proof`"
+            if $objt prove fs:tmp1.d nope >/dev/null 2>&1; then false; fi
+            if $objt prove fs:tmp1.d zz/nope >/dev/null 2>&1; then false; fi
+            if $objt prove fs:tmp1.d . 2>/dev/null; then false; else test $? = 2; fi
+            $objt prove store:tmp.store@$s zz raw:tmp.proof
+            $objt check-proof $s raw:tmp.proof >/dev/null
+            if $objt check-proof $s raw:tmp.proof fs:tmp1.d/world 2>/dev/null; then false; fi
+            # tampered sibling fingerprint, wrong name and empty proofs
+            $objt prove fs:tmp1.d zz > tmp.proof
+            sed 's/\("world", "\)fp:[^"]*/\1fp:s5pIIHf32iiVNH_eBGBMXtlXhMa7dI3w9KBrvHZ-v1NRAA/' tmp.proof > tmp.proof2
+            if cmp -s tmp.proof tmp.proof2; then false; fi
+            if $objt check-proof $s json:tmp.proof2 2>/dev/null; then false; fi
+            sed 's/"path": \["zz"\]/"path": ["world"]/' tmp.proof > tmp.proof2
+            if cmp -s tmp.proof tmp.proof2; then false; fi
+            $objt check-proof $s json:tmp.proof2 >/dev/null
+            if $objt check-proof $s json:tmp.proof2 fs:tmp1.d/zz 2>/dev/null; then false; fi
+            sed 's/"path": \["zz"\]/"path": ["yy"]/' tmp.proof > tmp.proof2
+            if $objt check-proof $s json:tmp.proof2 2>/dev/null; then false; fi
+            echo '{"path": [], "levels": []}' > tmp.proof2
+            if $objt check-proof $s json:tmp.proof2 2>/dev/null; then false; fi
+            if printf 'p0\0' | $objt check-proof $s raw:- 2>/dev/null; then false; fi
+            if $objt check-proof `$objt fs:tmp1.d/zz fp:compact` json:tmp.proof2 2>/dev/null; then false; fi
+            rm -f tmp.proof tmp.proof2
+        fi
+        rm -f tmp.bin
+        $objt fs:tmp1.d bin:tmp.bin
+        $objt bin:tmp.bin fs:tmp3.d.bin
+        diff -r tmp1.d tmp3.d.bin
+        test `$objt bin:tmp.bin fp:compact` = $s
+        rm -rf tmp.bin tmp3.d.bin
+        $objt dups fs:tmp1.d >/dev/null
+        $objt --dedup=hardlink fs:tmp1.d fs:tmp3.d.bin
+        diff -r tmp1.d tmp3.d.bin
+        rm -rf tmp3.d.bin
+        echo '{"a":"dup","b":{"c":"dup"}}' | $objt --dedup=hardlink json:- fs:tmp3.d.bin
+        test `$objt dups fs:tmp3.d.bin | tail -1 | cut -d' ' -f3` = 1
+        rm -rf tmp3.d.bin
     }
 
     test4() {
@@ -70,7 +213,7 @@ for py in $PY3 $PY2; do
     }
 
     test3 "$patobj"  >>fpobj.tmp
-    for intr in json:- pickle:- raw:- utf8:-; do
+    for intr in json:- pickle:- raw:- utf8:- bin:-; do
         test2 "$patobj" "$intr" >>fpobj.tmp
         test4 "$intr" >>fpobj.tmp
         case $intr in
@@ -81,8 +224,12 @@ for py in $PY3 $PY2; do
         esac
     done
 
+    # pickle of {"a":"x","r":[FP]} written by python 2 before
+    # fingerprints had __slots__
+    test `printf '(dp0\nVa\np1\nc__builtin__\nbytearray\np2\n(Vx\np3\nS\047latin-1\047\np4\ntp5\nRp6\nsVr\np7\nccopy_reg\n_reconstructor\np8\n(csc.fp\nfingerprint\np9\nc__builtin__\nobject\np10\nNtp11\nRp12\n(dp13\nS\047_value\047\np14\ng2\n(V\263\232H w\367\332(\2254\177\336\004\140L^\331W\204\306\273t\215\360\364\240k\274v~\277S\np15\nS\047latin-1\047\np16\ntp17\nRp18\nsbs.' | $objt pickle:- fp:compact` = fp:TWD2sYQETN3Ibjywv3hglD9TWZ66ASop-2BPJ8tTCFRCEg
+
     test3 "$patdict" >>fpdict.tmp
-    for intr in json:- pickle:-; do
+    for intr in json:- pickle:- bin:-; do
         test2 "$patdict" "$intr" >>fpdict.tmp
         test4 "$intr" >>fpdict.tmp
         case $intr in
@@ -102,6 +249,27 @@ for py in $PY3 $PY2; do
     test "$s1" != "$s2"
     test "$s2" != "$s3"
     test "$s1" != "$s3"
+
+    # deeper than the recursion limit of python
+    rm -rf tmp.deep tmp.cache tmp.store
+    d=tmp.deep`printf '/d%.0s' $(seq 1200)`
+    mkdir -p $d
+    echo x >$d/f
+    s1=`$objt fs:tmp.deep fp:compact`
+    test `$objt -j 2 fs:tmp.deep fp:compact` = $s1
+    test `$objt --cache=tmp.cache fs:tmp.deep fp:compact` = $s1
+    if test $py = $PY3; then
+        test `$objt --async=4 fs:tmp.deep fp:compact` = $s1
+    fi
+    test `$objt fs:tmp.deep store:tmp.store` = $s1
+    $objt verify $s1 fs:tmp.deep >/dev/null
+    $objt -j 2 verify $s1 fs:tmp.deep store:tmp.store >/dev/null
+    $objt fs:tmp.deep bin:tmp.bin
+    test `$objt bin:tmp.bin fp:compact` = $s1
+    # written to a pipe: the dictionaries have no sizes and no index
+    $objt fs:tmp.deep bin:- | cat >tmp.bin
+    test `$objt bin:tmp.bin fp:compact` = $s1
+    rm -rf tmp.deep tmp.cache tmp.store tmp.bin
 done
 
 n=`uniq <fpobj.tmp | wc -l | awk '{print $1}'`
@@ -8,6 +8,7 @@ import getopt
 
 def usage():
     print("usage: %s [OPTION]... FINGERPRINT..." % sys.argv[0])
+    print("   or: %s [OPTION]... --input FILE" % sys.argv[0])
     print("Operation modes:\n"
           "  -a                   display all representations\n"
           "  -c                   compare the fingerprints\n"
@@ -15,6 +16,11 @@ def usage():
           "  -h, --help           display this help and exit\n"
           "  -s N                 split with hyphens every N characters\n"
           "\n"
+          "Batch mode:\n"
+          "  --input FILE         read fingerprints from FILE, one per line\n"
+          "                       (a single FINGERPRINT '-' reads standard input)\n"
+          "  -B                   read packed 32-byte binary fingerprints instead\n"
+          "\n"
           "Formats:\n"
           "  compact              Base64-encoded with checksum\n"
           "  long                 Base32-encoded with checksum\n"
@@ -29,18 +35,119 @@ def usage():
           "\t%s -f long -s 2 %s\n"
           "\t%s -f binary %s\n"
           "\t%s -f compact %s\n"
-          "\t%s -c %s %s" %
+          "\t%s -c %s %s\n"
+          "\t%s -f compact - <fingerprints.txt" %
           (sys.argv[0], empty_file_fp().compact(),
            sys.argv[0], empty_dict_fp().long(split=0),
            sys.argv[0], zero_fp().long(),
            sys.argv[0], ones_fp().hex(split=0),
            sys.argv[0], empty_file_fp().hex(),
-           sys.argv[0], empty_file_fp().compact(), empty_dict_fp().compact()
+           sys.argv[0], empty_file_fp().compact(), empty_dict_fp().compact(),
+           sys.argv[0]
        ))
 
-opts, args = getopt.getopt(sys.argv[1:], "acf:hs:", ['help'])
+def output(out, fp, fmt, s, opts, split):
+    """Write the representation(s) of fp requested by opts to out."""
+    if '-a' in opts:
+        out.write("Argument: '%s' (%s)\n"
+                  "  compact: %s\n"
+                  "  long:    %s\n"
+                  "  hex:     %s\n"
+                  "  dec:     %d\n"
+                  "  carray:  %s\n" %
+                  ( s, fmt,
+                    fp.compact(),
+                    fp.long(split),
+                    fp.hex(split),
+                    int(fp),
+                    fp.carray()) )
+    else:
+        if '-f' in opts:
+            fmt = opts['-f']
+
+        if fmt == 'binary':
+            getattr(out, 'buffer', out).write(fp.binary())
+        elif fmt == 'hex':
+            out.write(fp.hex(split) + '\n')
+        elif fmt == 'long':
+            out.write(fp.long(split) + '\n')
+        elif fmt == 'compact':
+            out.write(fp.compact() + '\n')
+        elif fmt == 'dec':
+            out.write('%d\n' % int(fp))
+        elif fmt == 'carray':
+            out.write(fp.carray() + '\n')
+
+def read_text(src):
+    """Iterate over (line number, fingerprint, format, text, error) from a text stream."""
+    for i, line in enumerate(src):
+        s = line.strip()
+        if len(s) == 0:
+            continue
+        fp, fmt, errmsg = parse(s)
+        yield (i + 1, fp, fmt, s, errmsg)
+
+def read_binary(src):
+    """Iterate over (record number, fingerprint, format, text, error) from packed binary records."""
+    i = 0
+    while True:
+        b = src.read(32)
+        if len(b) == 0:
+            break
+        i += 1
+        if len(b) < 32:
+            yield (i, None, 'binary', repr(b), "truncated record (%d bytes)" % len(b))
+            break
+        fp = fingerprint(bytearray(b))
+        yield (i, fp, 'binary', fp.hex(), None)
+
+def batch(src, opts, split):
+    """Convert or compare the fingerprints read from src, reporting errors per record.
+
+    Returns True if no error was encountered.
+    """
+    out = sys.stdout
+    ok = True
+    first = None
+    if '-B' in opts:
+        records = read_binary(getattr(src, 'buffer', src))
+    else:
+        records = read_text(src)
+    for n, fp, fmt, s, errmsg in records:
+        if fp is None:
+            out.flush()
+            print("error: %s: %d: unable to recognize '%s'" % (sys.argv[0], n, s), file=sys.stderr)
+            print("error: %s: %d: %s" % (sys.argv[0], n, errmsg), file=sys.stderr)
+            ok = False
+        elif '-c' in opts:
+            if first is None:
+                first = fp.binary()
+            elif first != fp.binary():
+                print("fingerprint %d differs from the first" % n, file=sys.stderr)
+                ok = False
+        else:
+            output(out, fp, fmt, s, opts, split)
+    out.flush()
+    getattr(out, 'buffer', out).flush()
+    return ok
+
+opts, args = getopt.getopt(sys.argv[1:], "acf:hs:B", ['help', 'input='])
 opts = dict(opts)
 
+split = None
+if '-s' in opts:
+    split = int(opts['-s'])
+
+if '--input' in opts or args == ['-']:
+    # batch mode
+    src = opts.get('--input', '-')
+    if src == '-':
+        ok = batch(sys.stdin, opts, split)
+    else:
+        with open(src, 'rb' if '-B' in opts else 'r') as f:
+            ok = batch(f, opts, split)
+    sys.exit(0 if ok else 1)
+
 if len(args) == 0 or '-h' in opts or '--help' in opts:
     usage()
     sys.exit(0)
@@ -75,39 +182,9 @@ else:
             sys.exit(0)
 
     # general mode: re-print all input fingerprints.
-    split = None
-    if '-s' in opts:
-        split = int(opts['-s'])
-
     for fp, fmt, s in fps:
-        if '-a' in opts:
-            print("Argument: '%s' (%s)\n"
-                  "  compact: %s\n"
-                  "  long:    %s\n"
-                  "  hex:     %s\n"
-                  "  dec:     %d\n"
-                  "  carray:  %s" %
-                  ( s, fmt,
-                    fp.compact(),
-                    fp.long(split),
-                    fp.hex(split),
-                    int(fp),
-                    fp.carray()) )
-        else:
-            if '-f' in opts:
-                fmt = opts['-f']
-
-            if fmt == 'binary':
-                if hasattr(sys.stdout, 'buffer'):
-                   sys.stdout.buffer.write(fp.binary())
-                else:
-                   sys.stdout.write(fp.binary())
-            elif fmt == 'hex':
-                print(fp.hex(split))
-            elif fmt == 'long':
-                print(fp.long(split))
-            elif fmt == 'compact':
-                print(fp.compact())
+        output(sys.stdout, fp, fmt, s, opts, split)
 
     sys.stdout.flush()
+    getattr(sys.stdout, 'buffer', sys.stdout).flush()
     sys.exit(0)
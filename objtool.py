@@ -2,7 +2,7 @@
 
 from __future__ import print_function
 
-from sc import fp, fs, py, js
+from sc import fp, fs, py, js, pack, par, aio, cache, store, walk, diff, proof, stats, verify, manifest
 
 import pickle
 import sys
@@ -10,43 +10,194 @@ import getopt
 import os
 import os.path
 import ast
+import sqlite3
+import codecs
+import json
 
 def force_bytes(data):
-    if isinstance(data, str) or isinstance(data, type(u'')):
-        data = bytearray((ord(c) for c in data))
+    if isinstance(data, type(u'')):
+        data = bytearray(data, 'latin-1')
+    elif isinstance(data, str): # python 2
+        data = bytearray(data)
     return data
 
+def open_cache(path, rebuild):
+    """Open the fingerprint cache, or return None if it is unavailable."""
+    if path is None:
+        path = cache.default_path()
+    try:
+        return cache.fp_cache(path, rebuild=rebuild, hash_name=hash_name)
+    except ValueError as e:
+        print("error: %s" % e, file=sys.stderr)
+        sys.exit(1)
+    except (OSError, IOError, sqlite3.Error) as e:
+        print("warning: fingerprint cache %s unavailable: %s" % (path, e), file=sys.stderr)
+        return None
+
+def open_manifest(name):
+    """Check the manifest file name and return its index, see manifest.load."""
+    try:
+        with open(name == '-' and '/dev/stdin' or name, 'rb') as f:
+            return manifest.load(manifest.read(f), verbose)
+    except ValueError as e:
+        print("error: invalid manifest %s: %s" % (name, e), file=sys.stderr)
+        sys.exit(1)
+
+def index_source(src):
+    """Return the fingerprint and the dictionaries of src, see diff.index."""
+    if src.startswith('manifest:'):
+        return open_manifest(src.split(':', 1)[1])[:2]
+    return diff.index(open_source(src), verbose)
+
+def seed_cache(c, path):
+    """Seed the fingerprint cache c for the object at path from --seed-cache."""
+    if c is None or '--seed-cache' not in dopts:
+        return
+    name = dopts['--seed-cache']
+    with open(name, 'rb') as f:
+        recs = list(manifest.read(f))
+    try:
+        manifest.load(recs)
+    except ValueError as e:
+        print("error: invalid manifest %s: %s" % (name, e), file=sys.stderr)
+        sys.exit(1)
+    n = manifest.seed(c, path, recs, ignorelist, verbose)
+    if verbose:
+        print("%d fingerprints seeded from %s" % (n, name), file=sys.stderr)
+
+def open_source(src, syscalls = None):
+    """Return a fingerprintable object for the SOURCE argument src.
+
+    syscalls counts the system calls of fs: sources, see fs.fs_wrap.
+    """
+    src_method, src_name = src.split(':',1)
+    if src_method in ['raw', 'json', 'py', 'pickle', 'utf8', 'bin']:
+        if src_name == '-':
+            src_file = open('/dev/stdin', src_method == 'json' and 'r' or 'rb')
+        else:
+            src_file = open(src_name, src_method == 'json' and 'r' or 'rb')
+
+    if src_method == 'fs':
+        assert os.path.exists(src_name)
+        src_obj = fs.fs_wrap(src_name, ignorelist, syscalls=syscalls)
+
+    elif src_method in ['raw', 'utf8', 'str', 'pickle']:
+
+        if src_method == 'raw':
+            # raw bytes, unencoded
+            data = force_bytes(src_file.read())
+
+        elif src_method == 'utf8':
+            # utf-8 encoded data
+            data = force_bytes(src_file.read())
+            data = data.decode('utf-8')
+            data = bytearray(data, 'latin-1')
+
+        elif src_method == 'str':
+            # utf-8 encoded data in name
+            data = bytearray(src_name, 'utf-8')
+
+        elif src_method == 'pickle':
+            data = pickle.load(src_file)
+
+        src_obj = py.decode(data)
+
+    elif src_method == 'json':
+        src_obj = js.decode_stream(src_file)
+
+    elif src_method == 'bin':
+        src_obj = pack.decode(src_file)
+
+    elif src_method == 'store':
+        store_path, store_fp = src_name.rsplit('@', 1)
+        src_obj = store.obj_store(store_path).get(store_fp)
+
+    else:
+        print("unknown input method '%s'" % src_method, file=sys.stderr)
+        sys.exit(1)
+    return src_obj
+
 def usage():
     print("usage: %s [OPTIONS] [SOURCE] [DESTINATION]" % sys.argv[0])
+    print("       %s [OPTIONS] diff SOURCE1 SOURCE2" % sys.argv[0])
+    print("       %s [OPTIONS] dups SOURCE" % sys.argv[0])
+    print("       %s [OPTIONS] manifest:PATH fp:FORMAT" % sys.argv[0])
+    print("       %s [OPTIONS] verify FP SOURCE [store:PATH|manifest:PATH]" % sys.argv[0])
+    print("       %s [OPTIONS] prove SOURCE PATH [json:FILE|raw:FILE]" % sys.argv[0])
+    print("       %s [OPTIONS] check-proof FP json:FILE|raw:FILE [SOURCE]" % sys.argv[0])
     print("Options:\n"
           "  -a        include filenames starting with .\n"
           "  -i PAT    ignore filenames matching PAT\n"
           "  -h        display this help and exit\n"
           "  -b        use Base64 for files when printing JSON\n"
-          "  -v        run verbosely\n")
+          "  -j N      fingerprint or write files using N parallel workers\n"
+          "  --async=N        fingerprint with up to N reads in flight (python 3)\n"
+          "  --cache[=FILE]   cache filesystem fingerprints (default file:\n"
+          "                   %s)\n"
+          "  --no-cache       do not use the fingerprint cache (default)\n"
+          "  --rebuild-cache  use the fingerprint cache, emptied first\n"
+          "  --seed-cache=MANIFEST  use the fingerprint cache, trusting the\n"
+          "                   fingerprints of MANIFEST for the unchanged\n"
+          "                   files of fs: sources\n"
+          "  --dedup=METHOD   with fs: destinations, link identical files\n"
+          "                   (METHOD: hardlink or reflink)\n"
+          "  --fsync          with fs: destinations, flush the files to disk\n"
+          "  --hash=NAME      compute fingerprints with the hash function NAME\n"
+          "                   (%s; only sha256 is standard,\n"
+          "                   the others only convert to fp:, json: or bin:)\n"
+          "  --stats          print statistics in JSON on stderr at the end\n"
+          "  --progress       print progress in JSON on stderr every second\n"
+          "  -v        run verbosely\n" % (cache.default_path(), ', '.join(sorted(fp.hashes))))
     print("Valid forms for SOURCE:\n"
           "  fs:PATH      Filesystem\n"
           "  json:PATH    JSON data\n"
+          "  bin:PATH     Packed binary data\n"
           "  raw:PATH     Raw bytes (simple object)\n"
           "  utf8:PATH    UTF-8 encoded bytes (simple object)\n"
           "  str:STRING   Immediate UTF-8 encoded string (simple object)\n"
           "  pickle:PATH  Python pickled object\n"
+          "  store:PATH@FP  Object with fingerprint FP in the object store PATH\n"
           "\n"
           "Valid forms for DESTINATION:\n"
           "  fp:FORMAT    Compute and print the fingerprint\n"
           "  fs:PATH      Filesystem\n"
           "  json:PATH    JSON data\n"
+          "  bin:PATH     Packed binary data\n"
           "  raw:PATH     Raw bytes (only simple object)\n"
           "  utf8:PATH    UTF-8 encoded bytes (only simple object)\n"
           "  pickle:PATH  Python pickled object\n"
+          "  store:PATH   Object store (prints the object fingerprint)\n"
+          "  manifest:PATH     Manifest of the fingerprints of all entries\n"
+          "  binmanifest:PATH  Manifest in binary form\n"
           "\n"
           "If PATH is a single hyphen '-', data is read from (resp. written to)\n"
-          "the standard input (resp. output).\n")
+          "the standard input (resp. output).\n"
+          "\n"
+          "A manifest:PATH source can only be converted to a fingerprint, which\n"
+          "is recomputed from the manifest alone.\n"
+          "\n"
+          "With diff, print the entries added (A), removed (D) or modified (M)\n"
+          "from SOURCE1 to SOURCE2, and exit with status 1 if there are any.\n"
+          "Either source can be a manifest:PATH.\n"
+          "\n"
+          "With verify, check that SOURCE has fingerprint FP, comparing its\n"
+          "dictionaries with those in the store or manifest PATH if given,\n"
+          "and stop at the first difference.\n"
+          "\n"
+          "With dups, list the sets of identical files in SOURCE and the\n"
+          "space that storing each of them once would reclaim.\n"
+          "\n"
+          "With prove, write a proof that the entry at PATH (names separated\n"
+          "by /) belongs to SOURCE, in JSON (default: json:-) or binary (raw:).\n"
+          "With check-proof, check such a proof against the root fingerprint FP,\n"
+          "and optionally that SOURCE is the proven entry.\n")
     print("Examples:\n"
           "\t%s fs:. fp:compact\n"
           "\t%s -b fs:. json:-" % (sys.argv[0], sys.argv[0]))
 
-opts, args = getopt.getopt(sys.argv[1:], "bvahi:", ['help'])
+# --cache takes an optional argument, which getopt does not support
+argv = [a == '--cache' and '--cache=' or a for a in sys.argv[1:]]
+opts, args = getopt.getopt(argv, "bvahi:j:", ['help', 'async=', 'cache=', 'no-cache', 'rebuild-cache', 'seed-cache=', 'dedup=', 'fsync', 'hash=', 'stats', 'progress'])
 dopts = dict(opts)
 
 if '-h' in dopts or '--help' in dopts:
@@ -61,6 +212,149 @@ for a, v in opts:
         ignorelist.append(v)
 verbose = ('-v' in dopts)
 b64json = ('-b' in dopts)
+jobs = int(dopts.get('-j', 1))
+inflight = int(dopts.get('--async', 0))
+use_cache = ('--no-cache' not in dopts and
+             ('--cache' in dopts or '--rebuild-cache' in dopts or '--seed-cache' in dopts))
+hash_name = dopts.get('--hash', 'sha256')
+if hash_name not in fp.hashes:
+    print("unknown hash function '%s'" % hash_name, file=sys.stderr)
+    sys.exit(1)
+if hash_name != 'sha256':
+    # other fingerprints must not end up in stores, manifests or
+    # proofs, nor be compared with standard ones
+    src = len(args) > 0 and args[0] or 'raw:-'
+    dst = len(args) > 1 and args[1] or 'fp:'
+    if (len(args) > 2 or ':' not in src or src.split(':', 1)[0] in ['store', 'manifest'] or
+        dst.split(':', 1)[0] not in ['fp', 'json', 'bin']):
+        print("--hash=%s can only be used to convert to fp:, json: or bin:" % hash_name, file=sys.stderr)
+        sys.exit(1)
+    if '--seed-cache' in dopts:
+        print("--hash=%s cannot be used with --seed-cache: manifests hold sha256 fingerprints" % hash_name,
+              file=sys.stderr)
+        sys.exit(1)
+
+if len(args) > 0 and args[0] == 'diff':
+    if len(args) != 3:
+        usage()
+        sys.exit(2)
+    fa, ia = index_source(args[1])
+    fb, ib = index_source(args[2])
+    changes = diff.diff_index(fa, ia, fb, ib)
+    for status, path, t in changes:
+        print("%s %s" % (status, diff.path_str(path, t)))
+    sys.exit(changes and 1 or 0)
+
+if len(args) > 0 and args[0] == 'verify':
+    if len(args) not in [3, 4]:
+        usage()
+        sys.exit(2)
+    try:
+        efp = fp.fingerprint(args[1])
+    except RuntimeError as e:
+        print("error: %s" % e, file=sys.stderr)
+        sys.exit(2)
+    records = sizes = None
+    if len(args) > 3:
+        m_method, m_name = args[3].split(':', 1)
+        if m_method == 'store':
+            records = store.obj_store(m_name).records
+        elif m_method == 'manifest':
+            root, idx, sizes = open_manifest(m_name)
+            if root != efp.digest():
+                print("error: %s is not a manifest of %s" % (m_name, efp.compact()), file=sys.stderr)
+                sys.exit(2)
+            records = lambda f: idx[bytes(f)]
+        else:
+            print("unknown manifest method '%s'" % m_method, file=sys.stderr)
+            sys.exit(1)
+    try:
+        res = verify.check(open_source(args[2]), efp, records, jobs, verbose, sizes)
+    except ValueError as e:
+        print("error: %s" % e, file=sys.stderr)
+        sys.exit(2)
+    if res is not None:
+        path, t, reason = res
+        print("mismatch: %s (%s)" % (diff.path_str(path, t), reason))
+        sys.exit(1)
+    print("OK")
+    sys.exit(0)
+
+if len(args) > 0 and args[0] == 'dups':
+    if len(args) != 2:
+        usage()
+        sys.exit(2)
+    groups = diff.duplicates(open_source(args[1]), verbose)
+    total = 0
+    for f, sz, paths in groups:
+        total += sz * (len(paths) - 1)
+        print("%s size %d, %d copies, %d bytes reclaimable" % (f.compact(), sz, len(paths), sz * (len(paths) - 1)))
+        for path in paths:
+            print("  %s" % diff.path_str(path, 's'))
+    print("%d sets, %d duplicate files, %d bytes reclaimable" %
+          (len(groups), sum((len(paths) - 1 for f, sz, paths in groups)), total))
+    sys.exit(0)
+
+if len(args) > 0 and args[0] == 'prove':
+    if len(args) not in [3, 4]:
+        usage()
+        sys.exit(2)
+    path = diff.parse_path(args[2])
+    if not path:
+        print("error: PATH must name an entry, not the root", file=sys.stderr)
+        sys.exit(2)
+    src_method, src_name = args[1].split(':', 1)
+    try:
+        if src_method == 'store':
+            # the dictionaries along the path are read from the store
+            store_path, store_fp = src_name.rsplit('@', 1)
+            p = proof.prove(store.obj_store(store_path).records, store_fp, path)
+        else:
+            p = proof.make(open_source(args[1]), path, verbose)
+    except KeyError as e:
+        print("error: %s" % e.args[0], file=sys.stderr)
+        sys.exit(1)
+    dst_method, dst_name = (len(args) > 3 and args[3] or 'json:-').split(':', 1)
+    if dst_method == 'json':
+        f = dst_name == '-' and sys.stdout or open(dst_name, 'w')
+        json.dump(proof.to_json(p), f)
+        f.write('\n')
+    elif dst_method == 'raw':
+        f = open(dst_name == '-' and '/dev/stdout' or dst_name, 'wb')
+        f.write(proof.encode(p))
+    else:
+        print("unknown proof output method '%s'" % dst_method, file=sys.stderr)
+        sys.exit(1)
+    f.close()
+    sys.exit(0)
+
+if len(args) > 0 and args[0] == 'check-proof':
+    if len(args) not in [3, 4]:
+        usage()
+        sys.exit(2)
+    proof_method, proof_name = args[2].split(':', 1)
+    f = proof_name == '-' and '/dev/stdin' or proof_name
+    try:
+        if proof_method == 'json':
+            with open(f, 'r') as pf:
+                p = proof.from_json(json.load(pf))
+        elif proof_method == 'raw':
+            with open(f, 'rb') as pf:
+                p = proof.decode(pf.read())
+        else:
+            print("unknown proof input method '%s'" % proof_method, file=sys.stderr)
+            sys.exit(1)
+        t, efp = proof.verify(args[1], p)
+    except (ValueError, KeyError, TypeError, RuntimeError) as e:
+        print("error: invalid proof: %s" % e, file=sys.stderr)
+        sys.exit(1)
+    if len(args) > 3:
+        ofp = walk.walk(open_source(args[3]), fp.compute_visitor(verbose)).fingerprint()
+        if ofp != efp:
+            print("error: %s does not match %s (%s)" % (args[3], diff.path_str(p.path, t), efp.compact()), file=sys.stderr)
+            sys.exit(1)
+    print("%s %s" % (efp.compact(), diff.path_str(p.path, t)))
+    sys.exit(0)
 
 src = 'raw:-'
 dst = 'fp:compact'
@@ -72,85 +366,105 @@ if len(args) > 1:
 
 src_method, src_name = src.split(':',1)
 dst_method, dst_name = dst.split(':',1)
-if src_method in ['raw', 'json', 'py', 'pickle', 'utf8']:
-    if src_name == '-':
-        src_file = open('/dev/stdin', src_method == 'json' and 'r' or 'rb')
-    else:
-        src_file = open(src_name, src_method == 'json' and 'r' or 'rb')
+if src_method == 'manifest':
+    if dst_method != 'fp':
+        print("a manifest can only be converted to a fingerprint", file=sys.stderr)
+        sys.exit(1)
+
+st = None
+if '--stats' in dopts or '--progress' in dopts:
+    progress = None
+    if '--progress' in dopts:
+        progress = lambda st: print(json.dumps({'progress': st.snapshot()}, sort_keys=True), file=sys.stderr)
+    st = stats.stats(dst_method == 'fp' and 'hash' or 'serialize', progress=progress)
+
+if src_method == 'manifest':
+    src_obj = None
+elif st is not None:
+    src_obj = stats.traced(open_source(src, st.syscall), st)
+else:
+    src_obj = open_source(src)
 
-if dst_method in ['raw', 'json', 'py', 'pickle', 'utf8']:
+if dst_method in ['raw', 'json', 'py', 'pickle', 'utf8', 'bin', 'manifest', 'binmanifest']:
     if dst_name == '-':
         dst_file = open('/dev/stdout', dst_method in ['json', 'py'] and 'w' or 'wb')
     else:
         dst_file = open(dst_name, dst_method in ['json', 'py'] and 'w' or 'wb')
 
-if src_method == 'fs':
-    assert os.path.exists(src_name)
-    src_obj = fs.fs_wrap(src_name, ignorelist)
-
-elif src_method in ['raw', 'utf8', 'str', 'pickle']:
-
-    if src_method == 'raw':
-        # raw bytes, unencoded
-        data = force_bytes(src_file.read())
-
-    elif src_method == 'utf8':
-        # utf-8 encoded data
-        data = force_bytes(src_file.read())
-        data = data.decode('utf-8')
-        data = bytearray((ord(c) for c in data))
-
-    elif src_method == 'str':
-        # utf-8 encoded data in name
-        data = bytearray(src_name, 'utf-8')
-
-    elif src_method == 'pickle':
-        data = pickle.load(src_file)
-
-    src_obj = py.decode(data)
+if dst_method in ['manifest', 'binmanifest']:
+    fp = manifest.write(src_obj, dst_file, dst_method == 'binmanifest', verbose)
+    if dst_name != '-':
+        print(fp.compact())
 
-elif src_method == 'json':
-    src_obj = js.decode(src_file)
 
-else:
-    print("unknown input method '%s'" % src_method, file=sys.stderr)
-    sys.exit(1)
+elif dst_method == 'fs':
+    if '--dedup' in dopts:
+        if dopts['--dedup'] not in ['hardlink', 'reflink']:
+            print("unknown deduplication method '%s'" % dopts['--dedup'], file=sys.stderr)
+            sys.exit(1)
+        dd = fs.dedup_state(dopts['--dedup'])
+        walk.walk(src_obj, fs.dedup_visitor(dst_name, verbose, dd))
+        if verbose:
+            print("%d files written (%d bytes), %d linked (%d bytes)" %
+                  (dd.written, dd.bytes_written, dd.linked, dd.bytes_saved), file=sys.stderr)
+    elif jobs > 1 or '--fsync' in dopts:
+        fs.encode(src_obj, dst_name, jobs, '--fsync' in dopts, verbose)
+    else:
+        walk.walk(src_obj, fs.encode_visitor(dst_name, verbose))
 
+elif dst_method == 'raw':
+    src_obj.visit(py.write_visitor(dst_file))
 
-if dst_method == 'fs':
-    v = fs.encode_visitor(dst_name, verbose)
-    src_obj.visit(v)
+elif dst_method == 'utf8':
+    # each byte is a character; re-encode each chunk as it arrives
+    to_utf8 = lambda b: codecs.latin_1_decode(b)[0].encode('utf-8')
+    src_obj.visit(py.write_visitor(dst_file, to_utf8))
 
-elif dst_method in ['py', 'raw', 'utf8', 'pickle']:
+elif dst_method in ['py', 'pickle']:
     src_py = py.encode(src_obj)
 
     if dst_method == 'py':
         dst_file.write(repr(src_py))
 
-    elif dst_method == 'raw':
-        assert isinstance(src_py, bytearray)
-        dst_file.write(src_py)
-
-    elif dst_method == 'utf8':
-        assert isinstance(src_py, bytearray)
-        try:
-            x = unichr(0)
-        except:
-            unichr = chr
-        src_str = u''.join((unichr(x) for x in src_py))
-        src_data = force_bytes(src_str.encode('utf-8'))
-        dst_file.write(src_data)
-
     elif dst_method == 'pickle':
         pickle.dump(src_py, dst_file)
 
 elif dst_method == 'json':
     js.encode(src_obj, dst_file, use_base64=b64json)
 
+elif dst_method == 'bin':
+    pack.encode(src_obj, dst_file)
+
+elif dst_method == 'store':
+    fpcache = None
+    if src_method == 'fs' and use_cache:
+        fpcache = open_cache(dopts.get('--cache') or None, '--rebuild-cache' in dopts)
+        seed_cache(fpcache, src_name)
+    fp = store.obj_store(dst_name, create=True).put(src_obj, fpcache, verbose)
+    if fpcache is not None:
+        fpcache.close()
+    print(fp.compact())
+
 elif dst_method == 'fp':
-    v = fp.compute_visitor(verbose)
-    src_obj.visit(v)
-    fp = v.fingerprint()
+    fpcache = None
+    if src_method == 'fs' and use_cache:
+        fpcache = open_cache(dopts.get('--cache') or None, '--rebuild-cache' in dopts)
+        seed_cache(fpcache, src_name)
+    if src_method == 'manifest':
+        fp = fp.fingerprint(open_manifest(src_name)[0])
+    elif inflight > 0:
+        if aio.asyncio is None:
+            print("error: --async requires python 3.4 or later", file=sys.stderr)
+            sys.exit(1)
+        fp = aio.compute(src_obj, inflight, verbose=verbose, cache=fpcache, hash_name=hash_name)
+        if fpcache is not None:
+            fpcache.close()
+    elif jobs > 1 or fpcache is not None:
+        fp = par.compute(src_obj, jobs, verbose=verbose, cache=fpcache, hash_name=hash_name)
+        if fpcache is not None:
+            fpcache.close()
+    else:
+        fp = walk.walk(src_obj, fp.compute_visitor(verbose, hash_name)).fingerprint()
     if dst_name == 'compact':
         print(fp.compact())
     elif dst_name == 'hex':
@@ -168,3 +482,6 @@ elif dst_method == 'fp':
 else:
     print("unknown output method '%s'" % dst_method, file=sys.stderr)
     sys.exit(1)
+
+if '--stats' in dopts:
+    print(json.dumps({'stats': st.report()}, sort_keys=True), file=sys.stderr)
@@ -0,0 +1,236 @@
+"""Fingerprinting with overlapped I/O, using asyncio.
+
+When files are fetched from high-latency storage (network or FUSE
+filesystems), fingerprinting is bounded by the round trip of each
+open and read rather than by hashing. The pipeline below keeps up to
+a given number of blocking operations in flight: each file is read
+and hashed, and each directory listed, by an executor thread, while
+the event loop combines the dictionary digests as their entries
+complete. The fingerprints are identical to those of
+``fp.compute_visitor``.
+
+This requires python 3.4 or later.
+"""
+
+from __future__ import print_function
+
+import sys
+import collections
+from sc import fp, walk
+from sc.par import file_fp
+
+try:
+   import asyncio
+   import concurrent.futures
+except ImportError:
+   asyncio = None
+
+class _scan_visitor(fp.compute_visitor):
+   """Fingerprint a file, or list the entries of a dictionary.
+
+   The entries are (name, t, obj, key) tuples, where key is the cache
+   key of obj if cache_keys is true.
+   """
+
+   def __init__(self, cache_keys, hash_name):
+      fp.compute_visitor.__init__(self, hash_name=hash_name)
+      self._keys = cache_keys
+      self.ents = None
+
+   def enter_dict(self):
+      self.ents = []
+      self._names = set()
+
+   def visit_entry(self, name, t, obj):
+      fp.validate_name(name)
+      assert name not in self._names, "duplicate name %r" % name
+      self._names.add(name)
+      if t == 'l' and hasattr(obj, 'binary'):
+         self.ents.append((name, t, obj.binary(), None))
+      elif t in ['s', 't'] and isinstance(obj, fp.fingerprintable):
+         key = None
+         if self._keys and hasattr(obj, 'cache_key'):
+            key = obj.cache_key()
+         self.ents.append((name, t, obj, key))
+      else:
+         raise TypeError("unknown entity type in dictionary")
+
+   def leave_dict(self):
+      pass
+
+def _scan(obj, cache_keys, hash_name):
+   """Return ('s', fp) for a file, ('t', entries) for a dictionary."""
+   if not obj.standalone:
+      # the entries would not outlive the visit: do it all here
+      return ('s', walk.walk(obj, fp.compute_visitor(hash_name=hash_name))._fp)
+   v = _scan_visitor(cache_keys, hash_name)
+   obj.visit(v)
+   if v.ents is None:
+      return ('s', v._fp)
+   return ('t', v.ents)
+
+class _dict(object):
+   """Dictionary whose entries are being fingerprinted.
+
+   key is its cache key or None, and hits is true while all its
+   entries are found in the cache.
+   """
+
+   __slots__ = ('parent', 'name', 'ents', 'pending', 'key', 'hits')
+
+   def __init__(self, parent, name, key):
+      self.parent = parent
+      self.name = name
+      self.ents = {}
+      self.pending = 0
+      self.key = key
+      self.hits = True
+
+class pipeline(object):
+   """Fingerprinting pipeline running on an asyncio event loop.
+
+   At most limit blocking operations are submitted to executor at a
+   time. If cache is not None, it must be a ``cache.fp_cache`` used
+   from the thread running the loop; the fingerprints of objects
+   providing a ``cache_key`` method are looked up and saved there. As
+   with par.compute, a dictionary whose entries are all found in the
+   cache, and which holds no fingerprint reference, reuses its stored
+   fingerprint. hash_name is the hash function computing the
+   fingerprints, see fp.hashes.
+   """
+
+   def __init__(self, loop, executor, limit = 16, cache = None, verbose = False,
+                hash_name = 'sha256'):
+      assert limit > 0
+      if cache is not None and cache.hash_name != hash_name:
+         raise ValueError("the cache holds %s fingerprints, not %s" % (cache.hash_name, hash_name))
+      self._loop = loop
+      self._executor = executor
+      self._limit = limit
+      self._cache = cache
+      self._v = verbose
+      self._hash = hash_name
+      self._queue = collections.deque()
+      self._running = 0
+      self._result = None
+
+   def fingerprint(self, obj):
+      """Start fingerprinting obj and return a future for its fingerprint."""
+      assert isinstance(obj, fp.fingerprintable)
+      assert self._result is None, "a pipeline computes one fingerprint"
+      self._result = asyncio.Future(loop=self._loop)
+      key = None
+      if self._cache is not None and hasattr(obj, 'cache_key'):
+         key = obj.cache_key()
+      self._submit(_scan, obj, self._scanned, (None, None, key))
+      self._pump()
+      return self._result
+
+   def _submit(self, fn, obj, cb, arg):
+      self._queue.append((fn, obj, cb, arg))
+
+   def _pump(self):
+      while self._queue and self._running < self._limit and not self._result.done():
+         fn, obj, cb, arg = self._queue.popleft()
+         self._running += 1
+         args = fn is _scan and (obj, self._cache is not None, self._hash) or (obj, self._hash)
+         f = self._loop.run_in_executor(self._executor, fn, *args)
+         f.add_done_callback(lambda f, cb=cb, arg=arg: self._finished(f, cb, arg))
+
+   def _finished(self, f, cb, arg):
+      self._running -= 1
+      if self._result.done():
+         return
+      try:
+         cb(arg, f.result())
+      except Exception as e:
+         self._result.set_exception(e)
+         return
+      self._pump()
+
+   def _file_done(self, arg, value):
+      (parent, name), key = arg
+      if key is not None:
+         self._cache.store(key, value)
+      self._resolve(parent, name, 's', value, False)
+
+   def _scanned(self, arg, res):
+      parent, name, key = arg
+      t, value = res
+      if t == 's':
+         if key is not None:
+            self._cache.store(key, value)
+         self._resolve(parent, name, 's', value, False)
+         return
+      d = _dict(parent, name, key)
+      if self._v:
+         print("dictionary %r, %d entries" % (name, len(value)), file=sys.stderr)
+      for ename, et, obj, key in value:
+         if et == 'l':
+            # references are read from files that can change without
+            # changing the cache key of the directory
+            d.hits = False
+            d.ents[ename] = (et, obj)
+            continue
+         d.pending += 1
+         if et == 't':
+            self._submit(_scan, obj, self._scanned, (d, ename, key))
+            continue
+         cached = key is not None and self._cache.lookup(key) or None
+         if cached is not None:
+            d.pending -= 1
+            d.ents[ename] = (et, cached)
+         else:
+            d.hits = False
+            self._submit(file_fp, obj, self._file_done, ((d, ename), key))
+      if d.pending == 0:
+         value, cached = self._digest(d)
+         self._resolve(d.parent, d.name, 't', value, cached)
+
+   def _resolve(self, d, name, t, value, cached):
+      # the last entry of a dictionary completes it, and so on up the
+      # tree, in a loop so that the depth is not limited by the stack
+      while True:
+         if self._v:
+            where = d is None and "root" or "entry %r" % name
+            print("%s: %s" % (where, fp.fingerprint(value).compact()), file=sys.stderr)
+         if d is None:
+            self._result.set_result(value)
+            return
+         d.ents[name] = (t, value)
+         d.hits = d.hits and cached
+         d.pending -= 1
+         if d.pending > 0:
+            return
+         value, cached = self._digest(d)
+         d, name, t = d.parent, d.name, 't'
+
+   def _digest(self, d):
+      # returns the fingerprint of d and whether it was cached
+      value = None
+      if d.key is not None and d.hits:
+         value = self._cache.lookup(d.key)
+      cached = value is not None
+      if not cached:
+         value = fp.dict_digest(d.ents, self._hash)
+         if d.key is not None:
+            self._cache.store(d.key, value)
+      d.ents = None
+      return value, cached
+
+def compute(obj, limit = 16, verbose = False, cache = None, hash_name = 'sha256'):
+   """Compute the fingerprint of obj with up to limit operations in flight.
+
+   The operations run in a pool of limit threads, driven by a new
+   event loop. See help(pipeline) for the meaning of the arguments.
+   """
+   if asyncio is None:
+      raise RuntimeError("asynchronous fingerprinting requires asyncio")
+   loop = asyncio.new_event_loop()
+   executor = concurrent.futures.ThreadPoolExecutor(limit)
+   try:
+      p = pipeline(loop, executor, limit, cache, verbose, hash_name)
+      return fp.fingerprint(loop.run_until_complete(p.fingerprint(obj)))
+   finally:
+      executor.shutdown(wait=True)
+      loop.close()
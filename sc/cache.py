@@ -0,0 +1,111 @@
+"""Persistent cache of fingerprints for filesystem objects.
+
+The cache maps the state of a filesystem object, as returned by
+``fs.fs_wrap.cache_key``, to its fingerprint. It is stored in a SQLite
+database so that it can be shared between runs. The database records
+the hash function of the fingerprints it holds, so that fingerprints
+computed with different functions are not mixed.
+"""
+
+import os
+import os.path
+import time
+import sqlite3
+
+def default_path():
+   """Return the default location of the fingerprint cache."""
+   d = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+   return os.path.join(d, 'sc', 'fpcache.db')
+
+def _int64(v):
+   # sqlite integers are signed 64 bits
+   if v >= 2**63:
+      v -= 2**64
+   return v
+
+class fp_cache(object):
+   """On-disk cache of fingerprints keyed by filesystem object state.
+
+   Entries that were not used during max_age seconds are evicted when
+   the cache is closed. If rebuild is non-false, the cache is emptied
+   first. hash_name is the hash function of the fingerprints (see
+   fp.hashes); a ValueError is raised if the cache holds fingerprints
+   of another one.
+   """
+
+   # objects modified less than this many nanoseconds before the
+   # cache was opened may still change within the same timestamp;
+   # their fingerprint is not stored.
+   racy_ns = 2000000000
+
+   def __init__(self, path, max_age = 30 * 86400, rebuild = False, hash_name = 'sha256'):
+      d = os.path.dirname(path)
+      if d and not os.path.isdir(d):
+         os.makedirs(d)
+      self._db = sqlite3.connect(path)
+      if rebuild:
+         self._db.execute("DROP TABLE IF EXISTS fps")
+         self._db.execute("DROP TABLE IF EXISTS meta")
+      self._db.execute("CREATE TABLE IF NOT EXISTS fps ("
+                       "t TEXT, dev INTEGER, ino INTEGER, size INTEGER, "
+                       "mtime INTEGER, ctime INTEGER, ctx TEXT, "
+                       "fp BLOB, used INTEGER, "
+                       "PRIMARY KEY (t, dev, ino, size, mtime, ctime, ctx))")
+      self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+      row = self._db.execute("SELECT value FROM meta WHERE name = 'hash'").fetchone()
+      if row is None:
+         # caches from before the hash was recorded hold sha256
+         # fingerprints
+         if self._db.execute("SELECT 1 FROM fps LIMIT 1").fetchone() is None:
+            row = (hash_name,)
+         else:
+            row = ('sha256',)
+         self._db.execute("INSERT INTO meta VALUES ('hash', ?)", row)
+      if row[0] != hash_name:
+         self._db.close()
+         raise ValueError("cache %s holds %s fingerprints, not %s" % (path, row[0], hash_name))
+      self.hash_name = hash_name
+      self._now = int(time.time())
+      self._max_age = max_age
+      self.hits = 0
+      self.misses = 0
+
+   def _key(self, key):
+      t, dev, ino, size, mtime, ctime, ctx = key
+      return (t, _int64(dev), _int64(ino), size, mtime, ctime, ctx)
+
+   def lookup(self, key):
+      """Return the binary fingerprint stored for key, or None."""
+      k = self._key(key)
+      row = self._db.execute("SELECT fp, used FROM fps WHERE t = ? AND dev = ? AND ino = ? "
+                             "AND size = ? AND mtime = ? AND ctime = ? AND ctx = ?", k).fetchone()
+      if row is None:
+         self.misses += 1
+         return None
+      self.hits += 1
+      value, used = row
+      if used < self._now - 86400:
+         self._db.execute("UPDATE fps SET used = ? WHERE t = ? AND dev = ? AND ino = ? "
+                          "AND size = ? AND mtime = ? AND ctime = ? AND ctx = ?", (self._now,) + k)
+      return bytearray(value)
+
+   def store(self, key, value):
+      """Record value as the binary fingerprint for key."""
+      assert len(value) == 32
+      limit = self._now * 1000000000 - self.racy_ns
+      if key[4] >= limit or key[5] >= limit:
+         return
+      self._db.execute("INSERT OR REPLACE INTO fps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       self._key(key) + (sqlite3.Binary(bytes(value)), self._now))
+
+   def evict(self, max_age = None):
+      """Remove the entries not used during the last max_age seconds."""
+      if max_age is None:
+         max_age = self._max_age
+      self._db.execute("DELETE FROM fps WHERE used < ?", (self._now - max_age,))
+
+   def close(self):
+      """Evict old entries and save the cache to disk."""
+      self.evict()
+      self._db.commit()
+      self._db.close()
@@ -0,0 +1,173 @@
+"""Compare two Structured Commons objects.
+
+Each object is fingerprinted once, while the serialized entries of its
+dictionaries are recorded by fingerprint. The two trees are then
+compared from the root, descending only into the dictionaries whose
+fingerprints differ, so the cost of the comparison itself is
+proportional to the number of changed paths.
+"""
+
+from __future__ import print_function
+
+import re
+import sys
+from sc import fp, walk
+from sc.store import parse_records
+
+class index_visitor(fp.compute_visitor):
+   """Visitor computing a fingerprint and recording dictionaries.
+
+   The serialized entries of each dictionary (see fp.dict_records)
+   are stored in index, keyed by the binary fingerprint of the
+   dictionary.
+
+   index_visitor :: Fingerprintable a => a -> fingerprint
+   """
+
+   def __init__(self, index, verbose = False):
+      fp.compute_visitor.__init__(self, verbose)
+      self._index = index
+
+   def enter_entry(self, name, t):
+      self._check_entry(name)
+      return index_visitor(self._index, self._v)
+
+   def leave_dict(self):
+      buf = fp.dict_records(self._ents)
+      self._h = fp.records_hash(buf)
+      self._finish()
+      self._index[bytes(self._fp)] = bytearray(buf)
+      del self._ents
+      if self._v:
+         print("leaving dictionary (%s)" % fp.fingerprint(self._fp).compact(), file=sys.stderr)
+
+def index(obj, verbose = False):
+   """Fingerprint obj and record its dictionaries.
+
+   Returns the binary fingerprint of obj and a dictionary mapping the
+   binary fingerprint of each dictionary in obj to its serialized
+   entries.
+   """
+   idx = {}
+   v = walk.walk(obj, index_visitor(idx, verbose))
+   return bytes(v._fp), idx
+
+def diff(a, b, verbose = False):
+   """Compare the fingerprintable objects a and b.
+
+   Returns the list of differences from a to b, as (status, path, t)
+   tuples in path order, where:
+   - status is 'A' for an entry only in b, 'D' for an entry only in a
+     and 'M' for an entry whose content or type differs;
+   - path is the tuple of entry names from the root, empty if a and b
+     are not both dictionaries;
+   - t is the type of the entry in b ('s', 't' or 'l'), or in a for
+     removed entries.
+
+   The entries of added or removed dictionaries are not listed.
+   """
+   fa, ia = index(a, verbose)
+   fb, ib = index(b, verbose)
+   return diff_index(fa, ia, fb, ib)
+
+def _escape(n):
+   n = n.replace('%', '%25').replace('/', '%2F')
+   if n in ['.', '..']:
+      n = '%2E' + n[1:]
+   return n
+
+def path_str(path, t):
+   """Format a path returned by diff, with '/' between the names.
+
+   The characters '%' and '/' in names are escaped as %25 and %2F,
+   and the names '.' and '..' as %2E and %2E., so that they are not
+   mistaken for the root. A trailing '/' marks dictionaries. The root
+   is '.'.
+   """
+   s = '/'.join((_escape(n) for n in path)) or '.'
+   if t == 't' and path:
+      s += '/'
+   return s
+
+_escaped = re.compile(r'%(25|2[fF]|2[eE])')
+_unescaped = {'25': '%', '2f': '/', '2e': '.'}
+
+def parse_path(s):
+   """Return the path designated by a string formatted as by path_str."""
+   s = s.rstrip('/')
+   if s in ['', '.']:
+      return ()
+   unescape = lambda m: _unescaped[m.group(1).lower()]
+   return tuple((_escaped.sub(unescape, n) for n in s.split('/')))
+
+def diff_index(fa, ia, fb, ib):
+   """Compare two indexed objects, see help(index) and help(diff)."""
+   res = []
+   if fa == fb:
+      return res
+   if fa not in ia or fb not in ib:
+      # at least one side is a file
+      res.append(('M', (), fb in ib and 't' or 's'))
+      return res
+
+   stack = [((), fa, fb)]
+   while stack:
+      path, da, db = stack.pop()
+      ea = parse_records(ia[da])
+      eb = parse_records(ib[db])
+      i = j = 0
+      subdirs = []
+      while i < len(ea) or j < len(eb):
+         if j == len(eb) or (i < len(ea) and ea[i][0] < eb[j][0]):
+            name, t, f = ea[i]
+            res.append(('D', path + (name,), t))
+            i += 1
+         elif i == len(ea) or eb[j][0] < ea[i][0]:
+            name, t, f = eb[j]
+            res.append(('A', path + (name,), t))
+            j += 1
+         else:
+            name, ta, f = ea[i]
+            tb, g = eb[j][1], eb[j][2]
+            if ta != tb or f != g:
+               if ta == 't' and tb == 't':
+                  subdirs.append((path + (name,), bytes(f), bytes(g)))
+               else:
+                  res.append(('M', path + (name,), tb))
+            i += 1
+            j += 1
+      # visit the subdirectories in name order
+      stack.extend(reversed(subdirs))
+   res.sort(key=lambda d: d[1])
+   return res
+
+class _dups_visitor(fp.compute_visitor):
+   """Fingerprint visitor recording the files by fingerprint."""
+
+   def __init__(self, files, path = (), verbose = False):
+      fp.compute_visitor.__init__(self, verbose)
+      self._files = files
+      self._path = path
+
+   def enter_entry(self, name, t):
+      self._check_entry(name)
+      return _dups_visitor(self._files, self._path + (name,), self._v)
+
+   def leave_file(self):
+      fp.compute_visitor.leave_file(self)
+      self._files.setdefault(bytes(self._fp), (self._sz, []))[1].append(self._path)
+
+def duplicates(obj, verbose = False):
+   """Find the files of obj that have identical contents.
+
+   Returns a list of (fingerprint, size, paths) tuples, one for each
+   set of two or more identical non-empty files, with the largest
+   amount of duplicated data first. The space that can be reclaimed
+   by storing each of them once is size * (len(paths) - 1).
+   """
+   files = {}
+   walk.walk(obj, _dups_visitor(files, (), verbose))
+   res = [(fp.fingerprint(f), sz, sorted(paths)) for f, (sz, paths) in files.items()
+          if len(paths) > 1 and sz > 0]
+   res.sort(key=lambda d: (-d[1] * (len(d[2]) - 1), d[2]))
+   return res
@@ -2,9 +2,12 @@
 
 from __future__ import print_function
 import base64
+import binascii
 import codecs
 import hashlib
+import operator
 import re
+import struct
 import sys
 
 if hasattr(int, 'from_bytes'):
@@ -25,9 +28,42 @@ else:
         assert len(f) == 32
         return bytearray(f)
 
+# Hash functions that can compute fingerprints, by name, as
+# constructors of hashlib-style objects with 32-byte digests. Only
+# sha256 yields the fingerprints of the specification, and is the
+# default everywhere; the others are for experiments and benchmarks,
+# and are only used when asked for by name (see compute_visitor).
+def _hashlib_new(name, **kwargs):
+    return lambda: hashlib.new(name, **kwargs)
+
+def _hashes():
+    h = {'sha256': hashlib.sha256}
+    for name, kwargs in [('sha512_256', {}), ('sha3_256', {}), ('blake2s', {}),
+                         ('blake2b', {'digest_size': 32})]:
+        try:
+            if len(hashlib.new(name, **kwargs).digest()) == 32:
+                h[name] = _hashlib_new(name, **kwargs)
+        except (ValueError, TypeError):
+            # not provided by this python or its OpenSSL
+            pass
+    return h
+
+hashes = _hashes()
+
+def new_hash(hash_name = 'sha256'):
+    """Return a new hash object of the hash function hash_name.
+
+    hash_name must be a key of ``hashes``.
+    """
+    if hash_name not in hashes:
+        raise ValueError("unknown hash function %r" % hash_name)
+    return hashes[hash_name]()
+
 def fletcher(barray):
     """Return the two Fletcher-16 sums of a byte array."""
     assert isinstance(barray, bytes) or isinstance(barray, bytearray)
+    if len(barray) == 32:
+        return _fletcher32(barray)
     a = 0
     b = 0
     for c in barray:
@@ -35,6 +71,17 @@ def fletcher(barray):
         b = (a + b) % 255
     return (a, b)
 
+# weights of each byte in the second Fletcher-16 sum of 32 bytes
+_fletcher_weights = list(range(32, 0, -1))
+
+def _fletcher32(barray):
+    # As 256 = 1 + 255, the big-endian value of 32 bytes x[j] is
+    # congruent modulo 255**2 to sum(x) + 255 * sum((31 - j) * x[j]),
+    # which yields both sums without a loop over the bytes.
+    s = sum(bytearray(barray))
+    w = ((bytes_to_long(barray) - s) % 65025) // 255
+    return (s % 255, (w + s) % 255)
+
 def validate_name(name):
     """Ensure a name is valid.
 
@@ -55,6 +102,10 @@ class fingerprintable(object):
 
     """Base class for Python objects that can be fingerprinted."""
 
+    # True if the objects in the entries of a dictionary can still be
+    # visited after the visit of the dictionary returns, see help(sc.walk).
+    standalone = False
+
     def visit(self, v):
         """Visitor dispatch method to be implemented by sub-classes.
 
@@ -68,6 +119,10 @@ class fingerprintable(object):
           v.visit_entry(name, t, obj) zero or more times, followed by
           v.leave_dict() once.
 
+        The data b passed to visit_data may be a bytes, bytearray
+        or memoryview object, and may be reused by the caller after
+        visit_data returns.
+
         See the help of class ``visitor`` for details.
         """
         pass
@@ -80,13 +135,15 @@ class compute_visitor(object):
     compute_visitor :: Fingerprintable a => a -> fingerprint
     """
 
-    def __init__(self, verbose = False):
+    def __init__(self, verbose = False, hash_name = 'sha256'):
         """Instantiate a visitor.
 
         If verbose is non-false, the visitor prints detail on the
-        standard output.
+        standard output. hash_name is the hash function computing the
+        fingerprints, see ``hashes``.
         """
         self._v = verbose
+        self._hash = hash_name
 
     def _finish(self):
         s = self._h.digest()
@@ -102,14 +159,14 @@ class compute_visitor(object):
         """Start fingerprinting an object file."""
         self._sz = sz
         self._cnt = 0
-        self._h = hashlib.sha256()
+        self._h = new_hash(self._hash)
         self._h.update(b's')
         self._h.update(bytearray('%d' % sz, 'ascii'))
         self._h.update(b'\0')
 
     def visit_data(self, b):
         """Fingerprint some more data from a file previously entered."""
-        assert isinstance(b, bytearray) or isinstance(b, bytes)
+        assert isinstance(b, bytearray) or isinstance(b, bytes) or isinstance(b, memoryview)
         self._cnt += len(b)
         self._h.update(b)
 
@@ -135,85 +192,164 @@ class compute_visitor(object):
         obj -- either a fingerprint or another fingerprintable object
         """
 
-        if self._v:
-            print("entry %r: " % name, end='', file=sys.stderr)
-
-        # name must have valid form
-        validate_name(name)
-
-        # names must be unique in dictionary
-        assert name not in self._ents, "duplicate name %r" % name
-
         if (t == 'l') and hasattr(obj, 'binary'):
+            self._check_entry(name)
             self._ents[name] = (t, obj.binary())
             if self._v:
                 print("fingerprint (%s)" % obj.compact(), file=sys.stderr)
 
         elif t in ['s', 't'] and isinstance(obj, fingerprintable):
-            fpv = compute_visitor(self._v)
+            fpv = self.enter_entry(name, t)
             obj.visit(fpv)
-            self._ents[name] = (t, fpv._fp)
+            self.leave_entry(name, t, fpv)
 
         else:
+            self._check_entry(name)
             print(type(t), t, obj, type(obj), file=sys.stderr)
             raise TypeError("unknown entity type in dictionary")
 
+    def _check_entry(self, name):
+        if self._v:
+            print("entry %r: " % name, end='', file=sys.stderr)
+
+        # name must have valid form
+        validate_name(name)
+
+        # names must be unique in dictionary
+        assert name not in self._ents, "duplicate name %r" % name
+
+    def enter_entry(self, name, t):
+        """Return the visitor for the object of entry name, of type t.
+
+        See help(sc.walk) for details.
+        """
+        self._check_entry(name)
+        return compute_visitor(self._v, self._hash)
+
+    def leave_entry(self, name, t, fpv):
+        """Record the fingerprint computed by the visitor of entry name."""
+        self._ents[name] = (t, fpv._fp)
+
     def leave_dict(self):
         """Finish fingerprinting an object dictionary."""
-
-        keys = sorted(self._ents.keys())
-        buf = bytearray()
-        for k in keys:
-            t, fp = self._ents[k]
-            buf += bytearray(t, 'ascii')
-            buf += b':'
-            buf += bytearray(k, 'utf-8')
-            buf += b'\0'
-            buf += fp
-        self._h = hashlib.sha256()
-        self._h.update(b't')
-        self._h.update(bytearray('%d' % len(buf), 'ascii'))
-        self._h.update(b'\0')
-        self._h.update(buf)
+        self._h = dict_hash(self._ents, self._hash)
         self._finish()
         if self._v:
             print("leaving dictionary (%s)" % fingerprint(self._fp).compact(), file = sys.stderr)
 
 
+def dict_records(ents):
+    """Serialize the entries of an object dictionary.
+
+    ents maps each entry name to a pair (t, fp) where t is 't', 's'
+    or 'l' and fp is the binary fingerprint of the entry. The records
+    are concatenated in name order.
+    """
+    buf = bytearray()
+    for k in sorted(ents.keys()):
+        t, fp = ents[k]
+        buf += bytearray(t, 'ascii')
+        buf += b':'
+        buf += bytearray(k, 'utf-8')
+        buf += b'\0'
+        buf += fp
+    return buf
+
+def dict_hash(ents, hash_name = 'sha256'):
+    """Return a hash object over the serialized entries of a dictionary.
+
+    See help(dict_records) for the format of ents.
+    """
+    return records_hash(dict_records(ents), hash_name)
+
+def records_hash(buf, hash_name = 'sha256'):
+    """Return a hash object over the entries of a dictionary serialized by dict_records."""
+    h = new_hash(hash_name)
+    h.update(b't')
+    h.update(bytearray('%d' % len(buf), 'ascii'))
+    h.update(b'\0')
+    h.update(buf)
+    return h
+
+def dict_digest(ents, hash_name = 'sha256'):
+    """Return the binary fingerprint of a dictionary as a byte array.
+
+    See help(dict_records) for the format of ents.
+    """
+    s = dict_hash(ents, hash_name).digest()
+    if isinstance(s, str): # python 2 compat
+        s = bytearray(s)
+    return s
+
+
 class fingerprint(object):
     """fingerprint(fingerprintable) -> compute fingerprint of object
     fingerprint(str) -> parse fingerprint representation
     fingerprint(fingerprint or bytearray) -> copy fingerprint
+
+    Fingerprints are immutable. They can be compared, sorted and used
+    as dictionary keys or set members. The 32-byte value is held in an
+    immutable bytes object, returned without copy by digest() and
+    bytes(), and shared by memoryview() on python 3.12+.
     """
 
+    __slots__ = ('_value',)
+
     def __init__(self, obj):
         """Initialize a fingerprint. See help(fingerprint) for signature."""
 
-        if hasattr(obj, 'binary'): # assume already a fingerprint
+        if isinstance(obj, fingerprint):
+            self._value = obj._value
+
+        elif hasattr(obj, 'binary'): # assume already a fingerprint
             v = obj.binary()
             assert len(v) == 32
-            self._value = v
+            self._value = bytes(v)
 
         elif isinstance(obj, int) or isinstance(obj, long):
-            self._value = long_to_bytes(obj)
+            self._value = bytes(long_to_bytes(obj))
+
+        elif isinstance(obj, bytes) and len(obj) == 32:
+            # binary, such as returned by digest(); no text
+            # representation is 32 characters long (python 2)
+            self._value = obj
 
         elif isinstance(obj, str) or isinstance(obj, type(u'')):
-            fp, fmt, errmsg = parse(obj)
+            fp, fmt, code = scan(obj)
             if fp is None:
-                raise RuntimeError(errmsg)
+                raise RuntimeError(error_message(code, obj, fmt))
             self._value = fp._value
 
         elif (isinstance(obj, bytearray) or isinstance(obj, bytes)) and len(obj) == 32:
-            self._value = bytearray(obj)
+            self._value = bytes(obj)
+
+        elif isinstance(obj, memoryview) and len(obj) == 32:
+            self._value = obj.tobytes()
 
         elif isinstance(obj, fingerprintable):
             v = compute_visitor()
             obj.visit(v)
-            self._value = v._fp
+            self._value = bytes(v._fp)
 
         else:
             raise TypeError("a string, fingerprint or fingerprintable is required")
 
+    @classmethod
+    def _make(cls, value):
+        # build a fingerprint from 32 bytes already validated
+        f = cls.__new__(cls)
+        f._value = value
+        return f
+
+    def __getstate__(self):
+        return self._value
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # pickled before fingerprints had __slots__
+            state = bytes(state['_value'])
+        self._value = state
+
     def __int__(self):
         """Return the binary representation of the fingerprint as a long integer."""
         return bytes_to_long(self._value)
@@ -224,10 +360,58 @@ class fingerprint(object):
         """Pretty print a fingerprint object."""
         return "<%s>" % self.compact()
 
+    def __hash__(self):
+        # the hash of a bytes object is computed once and cached
+        return hash(self._value)
+
+    def __eq__(self, other):
+        if not isinstance(other, fingerprint):
+            return NotImplemented
+        return self._value == other._value
+
+    def __ne__(self, other):
+        if not isinstance(other, fingerprint):
+            return NotImplemented
+        return self._value != other._value
+
+    def __lt__(self, other):
+        if not isinstance(other, fingerprint):
+            return NotImplemented
+        return self._value < other._value
+
+    def __le__(self, other):
+        if not isinstance(other, fingerprint):
+            return NotImplemented
+        return self._value <= other._value
+
+    def __gt__(self, other):
+        if not isinstance(other, fingerprint):
+            return NotImplemented
+        return self._value > other._value
+
+    def __ge__(self, other):
+        if not isinstance(other, fingerprint):
+            return NotImplemented
+        return self._value >= other._value
+
     def __cmp__(self, other):
-        """Compare two fingerprints."""
+        """Compare two fingerprints (python 2)."""
+        if not isinstance(other, fingerprint):
+            return NotImplemented
         return cmp(self._value, other._value)
 
+    def __bytes__(self):
+        return self._value
+
+    def __buffer__(self, flags):
+        # buffer protocol (python 3.12+): memoryview(f) shares the
+        # value, read-only
+        return memoryview(self._value)
+
+    def digest(self):
+        """Returns the binary representation of the fingerprint as an immutable bytes object, without copy."""
+        return self._value
+
     def binary(self):
         """Returns the binary representation of the fingerprint as a byte array."""
         return bytearray(self._value)
@@ -235,7 +419,7 @@ class fingerprint(object):
     def carray(self):
         """Returns a C array definition equivalent to the fingerprint."""
         buf = 'char fp[32] = "'
-        for c in self._value:
+        for c in bytearray(self._value):
             if c == ord('\\'):
                 buf += '\\\\'
             elif c == ord('"'):
@@ -253,8 +437,7 @@ class fingerprint(object):
         The optional 'split' argument introduces hyphens for increased
         readability.
         """
-        x = self.binary()
-        r = codecs.encode(x, 'hex_codec').decode('ascii')
+        r = codecs.encode(self._value, 'hex_codec').decode('ascii')
 
         if split is None:
             split = 8
@@ -337,59 +520,121 @@ def ones_fp():
         b = bytearray(b)
     return fingerprint(b)
 
-def _check_ck(f):
-    assert isinstance(f, bytearray) or isinstance(f, bytes)
-    fp = f[:-2]
-    a, b = fletcher(fp)
-    x, y = f[-2], f[-1]
-    if (a, b) != (x, y):
-        return (None, "invalid checksum (fp says %d %d, computed %d %d)" % (a, b, x, y))
-    return (fingerprint(fp), None)
-
-def _from_compact(s):
-    assert isinstance(s, str) or isinstance(s, type(u''))
-    if not s.startswith('fp:'):
-        return (None, "invalid prefix (expected 'fp:', got '%s')" % s[:3])
-    s = s[3:]
-    if len(s) != 46:
-        return (None, "invalid length (expected 46, got %d)" % len(s))
-    s = bytearray(s + '==', 'ascii')
-    f = base64.urlsafe_b64decode(s)
-    if isinstance(f, str): # python 2 compat
-        f = bytearray(f)
-    return _check_ck(f)
-
-def _from_long(s):
-    assert isinstance(s, str) or isinstance(s, type(u''))
-    s = s.upper()
-    if not s.startswith('FP::'):
-        return (None, "invalid prefix (expected 'fp::', got '%s')" % s[:4])
-    s = s[4:].replace('-', '')
-    if len(s) != 55:
-        return (None, "invalid length (expected 55, got %d)" % len(s))
-    s = bytearray(s + '=', 'ascii')
-    f = base64.b32decode(bytes(s))
-    if isinstance(f, str): # python 2 compat
-        f = bytearray(f)
-    return _check_ck(f)
-
-def _from_hex(s):
-
-    s = s.replace('-', '')
-    if len(s) != 64:
-        return (None, "invalid length (expected 64, got %d)" % len(s))
-
-    s = bytearray(s, 'ascii')
-
-    f = codecs.decode(s, 'hex_codec')
-    if isinstance(f, str): # python 2 compat
-        f = bytearray(f)
-
-    return (fingerprint(f), None)
-
-_rlong = re.compile(r'^[fF][pP]::[a-zA-Z2-7-]*$')
-_rcompact = re.compile(r'^fp:[a-zA-Z0-9_-]*$')
-_rhex = re.compile(r'^[0-9a-fA-F-]*$')
+class intern_table(object):
+    """Table of unique fingerprint objects.
+
+    Calling the table with a fingerprint, or any argument accepted by
+    fingerprint(), returns the single fingerprint object with that
+    value stored in the table, so that equal fingerprints held by an
+    application share their memory.
+    """
+
+    def __init__(self):
+        self._fps = {}
+
+    def __call__(self, obj):
+        if not isinstance(obj, fingerprint):
+            obj = fingerprint(obj)
+        return self._fps.setdefault(obj, obj)
+
+    def __len__(self):
+        return len(self._fps)
+
+    def __contains__(self, obj):
+        return obj in self._fps
+
+# Error codes returned by scan().
+E_FORMAT = 1   # not a fingerprint representation
+E_LENGTH = 2   # invalid length for the recognized representation
+E_CHECKSUM = 3 # invalid checksum
+
+_errors = {
+    E_FORMAT: "unknown fingerprint format",
+    E_LENGTH: "invalid length",
+    E_CHECKSUM: "invalid checksum",
+}
+
+# expected number of digits for each representation, hyphens excluded
+_lengths = {'long': 55, 'compact': 46, 'hex': 64}
+
+_chars_long = frozenset(u'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz234567-')
+_chars_compact = frozenset(u'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-')
+_chars_hex = frozenset(u'0123456789abcdefABCDEF-')
+
+def _table(src, dst):
+    assert len(src) == len(dst)
+    t = bytearray(range(256))
+    for a, b in zip(bytearray(src, 'ascii'), bytearray(dst, 'ascii')):
+        t[a] = b
+    return bytes(t)
+
+# Base32 digits are mapped to the digits of int(x, 32), so that the
+# long representation is decoded by a single conversion.
+_digits32 = '0123456789abcdefghijklmnopqrstuv'
+_table_long = _table('ABCDEFGHIJKLMNOPQRSTUVWXYZ' + 'abcdefghijklmnopqrstuvwxyz' + '234567',
+                     _digits32[:26] + _digits32[:26] + _digits32[26:])
+_table_compact = _table('-_', '+/')
+
+def _checked(raw, fmt):
+    # raw holds the 32 bytes of the fingerprint followed by the checksum.
+    value = bytes(raw[:32])
+    if _fletcher32(value) != tuple(bytearray(raw[32:])):
+        return (None, fmt, E_CHECKSUM)
+    return (fingerprint._make(value), fmt, None)
+
+def scan(s):
+    """Parse a string representation of a fingerprint in a single pass.
+
+    The representation is recognized from its prefix, then its
+    characters are checked and decoded once. Returns a 3-tuple
+    containing:
+    - the fingerprint, or None if an error was encountered,
+    - the representation type that was recognized (long, compact or hex),
+      or None if the format is unknown,
+    - None, or one of the error codes E_FORMAT, E_LENGTH or E_CHECKSUM.
+
+    See error_message() to describe an error code.
+    """
+    if s[2:4] == '::' and s[:2] in ('fp', 'FP', 'fP', 'Fp'):
+        if not _chars_long.issuperset(s[4:]):
+            return (None, None, E_FORMAT)
+        x = s[4:].encode('ascii').translate(_table_long, b'-')
+        if len(x) != 55:
+            return (None, 'long', E_LENGTH)
+        # 55 digits of 5 bits hold 34 bytes and 3 padding bits
+        return _checked(_lanes_to_bytes(int(x, 32) >> 3, 34), 'long')
+
+    if s[:3] == 'fp:':
+        if not _chars_compact.issuperset(s[3:]):
+            return (None, None, E_FORMAT)
+        if len(s) != 49:
+            return (None, 'compact', E_LENGTH)
+        x = s[3:].encode('ascii').translate(_table_compact)
+        return _checked(binascii.a2b_base64(x + b'=='), 'compact')
+
+    if not _chars_hex.issuperset(s):
+        return (None, None, E_FORMAT)
+    x = s.encode('ascii').translate(None, b'-')
+    if len(x) != 64:
+        return (None, 'hex', E_LENGTH)
+    return (fingerprint._make(binascii.a2b_hex(x)), 'hex', None)
+
+def error_message(code, s = None, fmt = None):
+    """Return a message describing an error code returned by scan().
+
+    If the parsed string s and the recognized format fmt are given,
+    the message includes the offending length.
+    """
+    msg = _errors[code]
+    if code == E_LENGTH and s is not None and fmt is not None:
+        if fmt == 'long':
+            n = len(s[4:].replace('-', ''))
+        elif fmt == 'compact':
+            n = len(s) - 3
+        else:
+            n = len(s.replace('-', ''))
+        msg = "%s (expected %d, got %d)" % (msg, _lengths[fmt], n)
+    return msg
 
 def parse(s):
     """Parse a string representation of a fingerprint.
@@ -398,25 +643,207 @@ def parse(s):
     - the fingerprint, or None if an error was encountered,
     - the representation type that was recognized (long, compact or hex)
     - an error message or None if no error was encountered.
+
+    See scan() to obtain an error code instead of a message.
+    """
+    fp, fmt, code = scan(s)
+    if code is None:
+        return (fp, fmt, None)
+    return (None, fmt, error_message(code, s, fmt))
+
+# Bulk codec: the functions below work on packed buffers holding
+# N fingerprints of 32 bytes each, e.g. a bytearray, an array('B') or
+# a NumPy uint8 array. Errors are reported with per-row validity masks.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def _rows(buf):
+    buf = memoryview(buf)
+    if buf.ndim != 1 or buf.itemsize != 1:
+        buf = memoryview(bytearray(buf))
+    assert len(buf) % 32 == 0, "buffer size is not a multiple of 32"
+    return buf
+
+def pack(fps):
+    """Return a packed buffer holding the binary form of the given fingerprints."""
+    buf = bytearray()
+    for f in fps:
+        buf += f._value
+    return buf
+
+def unpack(buf):
+    """Return the list of fingerprints held in a packed buffer."""
+    buf = _rows(buf)
+    return [fingerprint(bytearray(buf[i:i+32])) for i in range(0, len(buf), 32)]
+
+def bulk_fletcher(buf):
+    """Return the Fletcher-16 sums of each fingerprint in a packed buffer.
+
+    The result is a pair of byte arrays (A, B) such that
+    (A[i], B[i]) == fletcher(row i).
+    """
+    buf = _rows(buf)
+    if numpy is not None:
+        rows = numpy.frombuffer(buf, dtype=numpy.uint8).reshape((-1, 32)).astype(numpy.uint32)
+        a = rows.sum(axis=1) % 255
+        b = rows.dot(numpy.array(_fletcher_weights, dtype=numpy.uint32)) % 255
+        return (bytearray(a.astype(numpy.uint8).tobytes()), bytearray(b.astype(numpy.uint8).tobytes()))
+    # The running sums of fletcher() reduce to a sum and a weighted
+    # sum of the 32 columns. Each column is spread in 32-bit lanes of
+    # a big integer, so that all rows are summed at once.
+    data = bytearray(buf)
+    n = len(data) // 32
+    ta = tb = 0
+    for j, w in enumerate(_fletcher_weights):
+        lanes = bytearray(4 * n)
+        lanes[3::4] = data[j::32]
+        col = bytes_to_long(lanes)
+        ta += col
+        tb += w * col
+    a = struct.unpack('>%dI' % n, _lanes_to_bytes(ta, 4 * n))
+    b = struct.unpack('>%dI' % n, _lanes_to_bytes(tb, 4 * n))
+    return (bytearray((x % 255 for x in a)), bytearray((x % 255 for x in b)))
+
+def _lanes_to_bytes(val, size):
+    if hasattr(val, 'to_bytes'):
+        return val.to_bytes(size, 'big')
+    return codecs.decode('%0*x' % (2 * size, val), 'hex_codec') # python 2
+
+def _with_checksums(buf, pad):
+    """Return the rows of buf followed by their checksum and pad zero bytes."""
+    ca, cb = bulk_fletcher(buf)
+    data = bytearray(buf)
+    w = 34 + pad
+    out = bytearray(w * len(ca))
+    for j in range(32):
+        out[j::w] = data[j::32]
+    out[32::w] = ca
+    out[33::w] = cb
+    return out
+
+
+def bulk_encode(buf, fmt = 'compact', split = None):
+    """Return the representations of the fingerprints in a packed buffer.
+
+    fmt is 'compact', 'long' or 'hex'; split has the same meaning as
+    for the corresponding fingerprint method.
     """
-    if re.match(_rlong, s) is not None:
-        fmt = "long"
-        fp, errmsg = _from_long(s)
+    buf = _rows(buf)
+    if fmt == 'hex':
+        r = codecs.encode(buf.tobytes(), 'hex_codec').decode('ascii')
+        if split is None:
+            split = 8
+        w = 64
+        prefix = ''
+    elif fmt == 'compact':
+        # 34 bytes padded to 36 encode to 48 characters, of which the
+        # first 46 are the unpadded encoding of the 34 bytes
+        r = base64.urlsafe_b64encode(bytes(_with_checksums(buf, 2))).decode('ascii')
+        split = 0
+        w = 48
+        prefix = 'fp:'
+    elif fmt == 'long':
+        # likewise, 34 bytes padded to 35 encode to 56 characters
+        r = base64.b32encode(bytes(_with_checksums(buf, 1))).decode('ascii')
+        if split is None:
+            split = 4
+        w = 56
+        prefix = 'fp::'
+    else:
+        raise ValueError("unknown fingerprint format %r" % fmt)
+    n = {'hex': 64, 'compact': 46, 'long': 55}[fmt]
+    res = [r[i:i+n] for i in range(0, len(r), w)]
+    if split:
+        groups = operator.itemgetter(*[slice(i, i+split) for i in range(0, n, split)])
+        if n <= split:
+            res = [prefix + x for x in res]
+        else:
+            res = [prefix + '-'.join(groups(x)) for x in res]
+    else:
+        res = [prefix + x for x in res]
+    return [str(x) for x in res]
 
-    elif re.match(_rcompact, s) is not None:
-        fmt = "compact"
-        fp, errmsg = _from_compact(s)
+# \Z rather than $, which also matches before a trailing newline
+_bcompact = re.compile(r'fp:[a-zA-Z0-9_-]{46}\Z')
+_blong = re.compile(r'[A-Z2-7]{55}\Z')
+_bhex = re.compile(r'[0-9a-fA-F]{64}\Z')
 
-    elif re.match(_rhex, s) is not None:
-        fmt = "hex"
-        fp, errmsg = _from_hex(s)
+def _bulk_from(strs, fmt):
+    """Decode strings of a single format, assumed to be valid.
 
+    Returns a packed buffer of 34-byte rows (fingerprint and checksum),
+    or of 32-byte rows for the hex format.
+    """
+    if fmt == 'compact':
+        data = base64.urlsafe_b64decode(''.join((x[3:] + 'AA' for x in strs)).encode('ascii'))
+        w = 36
+    elif fmt == 'long':
+        data = base64.b32decode(''.join((x + 'A' for x in strs)).encode('ascii'))
+        w = 35
     else:
-        fp = None
-        fmt = None
-        errmsg = "unknown fingerprint format"
-
-    return (fp, fmt, errmsg)
+        return bytearray(codecs.decode(''.join(strs).encode('ascii'), 'hex_codec'))
+    data = bytearray(data)
+    out = bytearray()
+    for i in range(0, len(data), w):
+        out += data[i:i+34]
+    return out
+
+def bulk_decode(strs, fmt = None):
+    """Parse a sequence of fingerprint representations.
+
+    fmt is 'compact', 'long' or 'hex', or None to recognize the format
+    of each string from its prefix. Returns a pair (buf, mask) where buf
+    is a packed buffer of the fingerprints and mask a list of booleans
+    indicating which rows were valid; invalid rows are set to zero.
+    """
+    strs = list(strs)
+    groups = {'compact': ([], []), 'long': ([], []), 'hex': ([], [])}
+    for i, s in enumerate(strs):
+        f = fmt
+        if f is None:
+            if s[:4].lower() == 'fp::':
+                f = 'long'
+            elif s[:3] == 'fp:':
+                f = 'compact'
+            else:
+                f = 'hex'
+        if f == 'long':
+            x = s[4:].upper().replace('-', '')
+            ok = s[:4].lower() == 'fp::' and _blong.match(x) is not None
+        elif f == 'compact':
+            x = s
+            ok = _bcompact.match(x) is not None
+        elif f == 'hex':
+            x = s.replace('-', '')
+            ok = _bhex.match(x) is not None
+        else:
+            raise ValueError("unknown fingerprint format %r" % fmt)
+        if ok:
+            groups[f][0].append(i)
+            groups[f][1].append(x)
+    buf = bytearray(32 * len(strs))
+    mask = [False] * len(strs)
+    for f, (idx, xs) in groups.items():
+        if len(idx) == 0:
+            continue
+        rows = _bulk_from(xs, f)
+        if f == 'hex':
+            for n, i in enumerate(idx):
+                buf[32*i:32*i+32] = rows[32*n:32*n+32]
+                mask[i] = True
+            continue
+        fps = bytearray()
+        for n in range(len(idx)):
+            fps += rows[34*n:34*n+32]
+        ca, cb = bulk_fletcher(fps)
+        for n, i in enumerate(idx):
+            if (ca[n], cb[n]) == (rows[34*n+32], rows[34*n+33]):
+                buf[32*i:32*i+32] = fps[32*n:32*n+32]
+                mask[i] = True
+    return (buf, mask)
 
 if __name__ == "__main__":
     print("testing...")
@@ -433,6 +860,12 @@ if __name__ == "__main__":
         81236592145469940157203126607178760648047830708351681206000552870365001334611
     ]
 
+    assert scan('fp:' + 'A' * 45) == (None, 'compact', E_LENGTH)
+    assert scan('fp::' + 'B' * 55) == (None, 'long', E_CHECKSUM)
+    assert scan('fp:A=') == (None, None, E_FORMAT)
+    assert scan('xyz') == (None, None, E_FORMAT)
+    assert parse('ab')[2] == "invalid length (expected 64, got 2)"
+
     for r in rl:
         if isinstance(r, str):
             fp, fmt, errmsg = parse(r)
@@ -456,6 +889,15 @@ if __name__ == "__main__":
         s = f.binary()
         assert isinstance(s, bytearray) and len(s) == 32
 
+        assert f.digest() is f.digest() and f.digest() == bytes(s)
+        if sys.version_info >= (3,):
+            assert bytes(f) is f.digest()
+        if sys.version_info >= (3, 12):
+            m = memoryview(f)
+            assert m.readonly and m.nbytes == 32 and m == f.digest()
+        assert f == fingerprint(s) and hash(f) == hash(fingerprint(s))
+        assert not (f < f) and f <= f and not (f != fingerprint(f))
+
         s = int(f)
         assert s >= 0 and s < (2**256)
 
@@ -463,4 +905,32 @@ if __name__ == "__main__":
         b2 = (f != f)
         assert b1 or b2
 
+    assert sorted(l) == sorted(l, key=lambda f: f.binary())
+    assert len(set(l)) == len(set((f.hex() for f in l)))
+    t = intern_table()
+    assert t(l[0]) is t(fingerprint(l[0].compact())) and len(t) == 1
+
+    buf = pack(l)
+    assert len(buf) == 32 * len(l)
+    assert [x.binary() for x in unpack(buf)] == [f.binary() for f in l]
+    ca, cb = bulk_fletcher(buf)
+    assert list(zip(ca, cb)) == [fletcher(f.binary()) for f in l]
+    for fmt in ['compact', 'long', 'hex']:
+        r = bulk_encode(buf, fmt)
+        assert r == [getattr(f, fmt)() for f in l]
+        assert bulk_encode(buf, fmt, 0) == [getattr(f, fmt)(0) if fmt != 'compact' else f.compact() for f in l]
+        b, mask = bulk_decode(r + ['bogus', r[0] + 'A', r[0] + '\n'], fmt)
+        assert b[:len(buf)] == buf and mask == [True] * len(l) + [False, False, False]
+    b, mask = bulk_decode([r for r in rl if isinstance(r, str)] + ['fp:' + 'B' * 46])
+    assert mask == [True] * (len(rl) - 1) + [False]
+
+    for name in sorted(hashes):
+        v = compute_visitor(hash_name=name)
+        v.enter_file(0)
+        v.leave_file()
+        assert len(v._fp) == 32 and (name == 'sha256') == (v.fingerprint() == l[0])
+        v.enter_dict()
+        v.leave_dict()
+        assert (name == 'sha256') == (v.fingerprint() == l[1])
+
     print("ok")
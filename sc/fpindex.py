@@ -0,0 +1,269 @@
+"""Incremental fingerprints of object trees.
+
+An fp_index keeps, for each dictionary of a tree, its serialized
+entries (see fp.dict_records) in name order, and its fingerprint.
+After an entry is updated or deleted, only the dictionaries on its
+path are hashed again, when the fingerprint is next requested.
+"""
+
+from __future__ import print_function
+
+import bisect
+from sc import fp, walk
+
+def _record(name, t, f):
+   return bytes(fp.dict_records({name: (t, f)}))
+
+def _file_fp(data):
+   v = fp.compute_visitor()
+   v.enter_file(len(data))
+   v.visit_data(data)
+   v.leave_file()
+   return v._fp
+
+class _node(object):
+   """Dictionary in an index.
+
+   recs maps each entry name to its serialized record, and names
+   holds the entry names in order. children maps names of type 't'
+   to their nodes, when known. dirty is the set of children whose
+   fingerprint changed; fp is None if the node must be hashed again.
+   """
+
+   __slots__ = ('recs', 'names', 'children', 'dirty', 'fp')
+
+   def __init__(self, ents = {}, children = {}):
+      self.recs = dict(((n, _record(n, t, f)) for n, (t, f) in ents.items()))
+      self.names = sorted(self.recs.keys())
+      self.children = dict(children)
+      self.dirty = set()
+      self.fp = None
+
+   def set(self, name, rec):
+      if name not in self.recs:
+         bisect.insort(self.names, name)
+      self.recs[name] = rec
+
+   def remove(self, name):
+      del self.recs[name]
+      del self.names[bisect.bisect_left(self.names, name)]
+      self.children.pop(name, None)
+      self.dirty.discard(name)
+
+   def rehash(self):
+      self.fp = fp.records_hash(b''.join([self.recs[n] for n in self.names])).digest()
+
+class _build_visitor(fp.compute_visitor):
+   """Fingerprint visitor building the nodes of an index."""
+
+   def enter_dict(self):
+      fp.compute_visitor.enter_dict(self)
+      self._children = {}
+
+   def enter_entry(self, name, t):
+      self._check_entry(name)
+      return _build_visitor(self._v)
+
+   def leave_entry(self, name, t, v):
+      self._ents[name] = (t, v._fp)
+      if t == 't':
+         self._children[name] = v.node
+
+   def leave_dict(self):
+      self.node = _node(self._ents, self._children)
+      self.node.rehash()
+      self._fp = self.node.fp
+      del self._ents, self._children
+
+class fp_index(object):
+   """Index of the fingerprints of a tree, updated incrementally.
+
+   The tree is initially the fingerprintable dictionary obj, or an
+   empty dictionary. Paths are tuples of entry names from the root.
+   """
+
+   def __init__(self, obj = None, verbose = False):
+      if obj is None:
+         self._root = _node()
+         return
+      v = walk.walk(obj, _build_visitor(verbose))
+      if not hasattr(v, 'node'):
+         raise TypeError("the root of an index must be a dictionary")
+      self._root = v.node
+
+   def _parents(self, path, create = False):
+      """Return the list of nodes from the root to the parent of path.
+
+      If create is non-false, missing dictionaries are created.
+      """
+      nodes = [self._root]
+      for i, name in enumerate(path[:-1]):
+         n = nodes[-1]
+         c = n.children.get(name)
+         if c is None:
+            if not create or name in n.recs:
+               raise KeyError("%r is not an indexed dictionary" % (tuple(path[:i + 1]),))
+            fp.validate_name(name)
+            c = _node()
+            n.children[name] = c
+            n.set(name, None)
+         nodes.append(c)
+      return nodes
+
+   def _invalidate(self, nodes, path):
+      # mark the dictionaries on the path for hashing, up to the root
+      for n, name in zip(nodes[:-1], path):
+         n.dirty.add(name)
+      for n in nodes:
+         n.fp = None
+
+   def update(self, path, value, t = 's'):
+      """Set the entry at path, creating missing dictionaries.
+
+      value may be:
+      - a fingerprint: the entry is set to it, with type t;
+      - bytes or a bytearray: the data of a file;
+      - a fingerprintable object: dictionaries are indexed, so that
+        their entries can be updated later.
+      """
+      path = tuple(path)
+      assert len(path) > 0, "the path must not be empty"
+      fp.validate_name(path[-1])
+      child = None
+      if isinstance(value, fp.fingerprint):
+         assert t in ['s', 't', 'l']
+         f = value.digest()
+      elif isinstance(value, bytes) or isinstance(value, bytearray):
+         t = 's'
+         f = _file_fp(value)
+      elif isinstance(value, fp.fingerprintable):
+         v = walk.walk(value, _build_visitor())
+         t = hasattr(v, 'node') and 't' or 's'
+         child = getattr(v, 'node', None)
+         f = v._fp
+      else:
+         raise TypeError("a fingerprint, bytes or fingerprintable is required")
+
+      nodes = self._parents(path, create = True)
+      n = nodes[-1]
+      name = path[-1]
+      n.set(name, _record(name, t, f))
+      if child is not None:
+         n.children[name] = child
+      else:
+         n.children.pop(name, None)
+      n.dirty.discard(name)
+      self._invalidate(nodes, path)
+
+   def delete(self, path):
+      """Remove the entry at path."""
+      path = tuple(path)
+      assert len(path) > 0, "the path must not be empty"
+      nodes = self._parents(path)
+      if path[-1] not in nodes[-1].recs:
+         raise KeyError("no entry %r" % (path,))
+      nodes[-1].remove(path[-1])
+      self._invalidate(nodes, path)
+
+   def _rehash(self):
+      # hash the dirty dictionaries, children first
+      if self._root.fp is not None:
+         return
+      stack = [(self._root, None, None)]
+      while stack:
+         n, parent, name = stack[-1]
+         if n.dirty:
+            cname = n.dirty.pop()
+            stack.append((n.children[cname], n, cname))
+            continue
+         stack.pop()
+         if n.fp is None:
+            n.rehash()
+         if parent is not None:
+            parent.set(name, _record(name, 't', n.fp))
+
+   def get(self, path = ()):
+      """Return the type and fingerprint of the entry at path.
+
+      The type of the root is 't'.
+      """
+      self._rehash()
+      path = tuple(path)
+      if not path:
+         return ('t', fp.fingerprint(self._root.fp))
+      n = self._parents(path)[-1]
+      rec = n.recs.get(path[-1])
+      if rec is None:
+         raise KeyError("no entry %r" % (path,))
+      return (chr(bytearray(rec)[0]), fp.fingerprint(rec[-32:]))
+
+   def fingerprint(self, path = ()):
+      """Return the fingerprint of the entry at path, by default of the whole tree."""
+      return self.get(path)[1]
+
+   def __contains__(self, path):
+      try:
+         self.get(path)
+      except KeyError:
+         return False
+      return True
+
+if __name__ == "__main__":
+   # compare the index with the fingerprints of the whole tree
+   from sc import py
+   print("testing...")
+
+   def full(tree):
+      return walk.walk(py.pyrepr_wrap(tree), fp.compute_visitor()).fingerprint()
+
+   def fails(f, *args):
+      try:
+         f(*args)
+      except KeyError:
+         return True
+      return False
+
+   assert fp_index().fingerprint() == fp.empty_dict_fp()
+   tree = {'a': bytearray(b'x'), 'd': {'e': bytearray(b'y'), 'f': {}}}
+   idx = fp_index(py.pyrepr_wrap(tree))
+   assert idx.fingerprint() == full(tree)
+   assert idx.get(('d',)) == ('t', full(tree['d']))
+
+   idx.update(('d', 'e'), b'z')
+   tree['d']['e'] = bytearray(b'z')
+   assert idx.fingerprint() == full(tree)
+   assert idx.get(('d', 'e')) == ('s', full(tree['d']['e']))
+
+   # missing intermediate dictionaries are created
+   idx.update(('n', 'm', 'o'), bytearray(b'w'))
+   tree['n'] = {'m': {'o': bytearray(b'w')}}
+   assert idx.fingerprint() == full(tree)
+   assert idx.fingerprint(('n', 'm')) == full(tree['n']['m'])
+
+   # a dictionary replaced with a file, and a file with a dictionary
+   idx.update(('d',), b'v')
+   tree['d'] = bytearray(b'v')
+   assert idx.fingerprint() == full(tree)
+   assert ('d', 'e') not in idx and fails(idx.update, ('d', 'e'), b'')
+   idx.update(('a',), py.pyrepr_wrap({'b': bytearray(b'u')}))
+   tree['a'] = {'b': bytearray(b'u')}
+   assert idx.fingerprint() == full(tree)
+   idx.update(('a', 'b'), b't')
+   tree['a']['b'] = bytearray(b't')
+   assert idx.fingerprint() == full(tree)
+
+   idx.update(('r',), fp.ones_fp(), 'l')
+   tree['r'] = fp.ones_fp()
+   assert idx.fingerprint() == full(tree) and idx.get(('r',)) == ('l', fp.ones_fp())
+
+   idx.delete(('n', 'm', 'o'))
+   del tree['n']['m']['o']
+   assert idx.fingerprint() == full(tree)
+   idx.delete(('n',))
+   del tree['n']
+   assert idx.fingerprint() == full(tree)
+
+   for path in [('n',), ('n', 'm'), ('a', 'x'), ('a', 'b', 'c')]:
+      assert path not in idx and fails(idx.get, path) and fails(idx.delete, path)
+   assert idx.fingerprint() == full(tree)
+   print("ok")
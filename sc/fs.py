@@ -4,9 +4,22 @@ from __future__ import print_function
 import sys
 import os
 import os.path
+import stat
+import mmap
+import errno
 import fnmatch
+import tempfile
 import urllib
-from sc import fp
+import collections
+import multiprocessing
+import multiprocessing.pool
+from sc import fp, walk
+
+try:
+   import fcntl
+except ImportError:
+   # not a Unix system
+   fcntl = None
 
 try:
    # python 3
@@ -26,25 +39,128 @@ except:
       """Transform a filesystem name to an object name."""
       return urllib.unquote(n).decode('utf-8')
 
+def entry_name(name):
+   """Return the filesystem name of the entry name written by encode_visitor."""
+   fsname = quote(name)
+   if fsname.startswith('.'):
+      # avoid "bad" entries "." amd ".." and hidden filenames
+      fsname = '%2E' + fsname[1:]
+   return fsname
+
+try:
+   # python 3.5+
+   from os import scandir
+except ImportError:
+   try:
+      # python 2 with the scandir backport
+      from scandir import scandir
+   except ImportError:
+      class _dir_entry(object):
+         """Minimal replacement for os.DirEntry."""
+         def __init__(self, d, name):
+            self.name = name
+            self.path = os.path.join(d, name)
+            self._st = None
+         def stat(self):
+            if self._st is None:
+               self._st = os.stat(self.path)
+            return self._st
+         def is_dir(self):
+            return stat.S_ISDIR(self.stat().st_mode)
+
+      def scandir(d):
+         """Iterate over the entries of directory d."""
+         return (_dir_entry(d, name) for name in os.listdir(d))
+
 class fs_wrap(fp.fingerprintable):
-   """Wrapper for filesystem paths that enable fingerprinting."""
+   """Wrapper for filesystem paths that enable fingerprinting.
 
-   def __init__(self, path, ignorelist = ['.*']):
-      assert os.path.exists(path)
+   The status of each path is queried at most once. When the wrapper
+   is created while scanning a parent directory, entry is the
+   corresponding os.DirEntry, whose cached type and status are reused.
+
+   If syscalls is not None, it is called with the name of each system
+   call issued by this object and the objects of its entries, from
+   any thread (see sc.stats).
+   """
+
+   standalone = True
+
+   # files are read in blocks of this many bytes into a reused buffer,
+   # or mapped in memory if they are at least mmap_threshold bytes large.
+   blocksize = 1024 * 1024
+   mmap_threshold = 64 * 1024 * 1024
+
+   def __init__(self, path, ignorelist = ['.*'], entry = None, syscalls = None):
       self._path = path
       self._ignorelist = ignorelist
+      self._entry = entry
+      self._syscalls = syscalls
+      self._st = None
+      if entry is None:
+         self.stat() # fail early if the path does not exist
+
+   def __getstate__(self):
+      # os.DirEntry objects cannot be pickled
+      state = self.__dict__.copy()
+      if self._entry is not None:
+         state['_st'] = self.stat()
+         state['_entry'] = None
+      # the system calls of worker processes are not counted
+      state['_syscalls'] = None
+      return state
+
+   def stat(self):
+      """Return the status of the path, as given by os.stat."""
+      if self._st is None:
+         if self._entry is not None:
+            self._st = self._entry.stat()
+         else:
+            self._st = os.stat(self._path)
+         self._count('stat')
+      return self._st
+
+   def isdir(self):
+      """Return True if the path is a directory."""
+      if self._st is None and self._entry is not None:
+         return self._entry.is_dir()
+      return stat.S_ISDIR(self.stat().st_mode)
+
+   def cache_key(self):
+      """Return a key identifying the current state of the path.
+
+      The key is a tuple (t, device, inode, size, mtime_ns, ctime_ns,
+      context) where t is 't' for directories and 's' for files, and
+      context reflects the ignore list for directories. It is suitable
+      to index fingerprint caches, see help(sc.cache).
+      """
+      st = self.stat()
+      mtime = getattr(st, 'st_mtime_ns', None)
+      if mtime is None:
+         # python 2
+         mtime = int(st.st_mtime * 1000000000)
+      ctime = getattr(st, 'st_ctime_ns', None)
+      if ctime is None:
+         ctime = int(st.st_ctime * 1000000000)
+      if stat.S_ISDIR(st.st_mode):
+         return ('t', st.st_dev, st.st_ino, st.st_size, mtime, ctime, '\0'.join(self._ignorelist))
+      return ('s', st.st_dev, st.st_ino, st.st_size, mtime, ctime, '')
 
    def visit(self, v):
       """Visitor dispatch method.
 
       See help(fp.fingerprintable.visit) for details.
       """
-      if os.path.isdir(self._path):
+      if self.isdir():
           v.enter_dict()
-          for f in os.listdir(self._path):
+          # read the directory at once to release its descriptor
+          # before visiting the children.
+          self._count('scandir')
+          for e in list(scandir(self._path)):
+             f = e.name
              if any((fnmatch.fnmatch(f, p) for p in self._ignorelist)):
                 continue
-             fpath = os.path.join(self._path, f)
+             fpath = e.path
              name = unquote(f)
              if name[0] == '\0':
                 # special: reference to fingerprint
@@ -55,24 +171,59 @@ class fs_wrap(fp.fingerprintable):
                    if isinstance(bref, str):
                       bref = bytearray(bref) # python 2
                    obj = fp.fingerprint(bref)
-             elif os.path.isdir(fpath):
+                self._count('open')
+             elif e.is_dir():
                 t = 't'
-                obj = fs_wrap(fpath, self._ignorelist)
+                obj = fs_wrap(fpath, self._ignorelist, e, self._syscalls)
              else:
                 t = 's'
-                obj = fs_wrap(fpath, self._ignorelist)
+                obj = fs_wrap(fpath, self._ignorelist, e, self._syscalls)
              v.visit_entry(name, t, obj)
           v.leave_dict()
 
       else:
-          v.enter_file(os.path.getsize(self._path))
+          sz = self.stat().st_size
+          v.enter_file(sz)
+          self._count('open')
           with open(self._path, 'rb') as f:
-             while True:
-                chunk = bytearray(f.read(8192))
-                if len(chunk) == 0: break
-                v.visit_data(chunk)
+             if sz < self.mmap_threshold or not self._visit_mmap(f, sz, v):
+                self._visit_read(f, v)
           v.leave_file()
 
+   def _count(self, name):
+      if self._syscalls is not None:
+         self._syscalls(name)
+
+   def _visit_read(self, f, v):
+      buf = bytearray(self.blocksize)
+      view = memoryview(buf)
+      while True:
+         n = f.readinto(buf)
+         self._count('read')
+         if not n: break
+         v.visit_data(view[:n])
+
+   def _visit_mmap(self, f, sz, v):
+      try:
+         m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      except (EnvironmentError, ValueError):
+         return False
+      self._count('mmap')
+      try:
+         try:
+            view = memoryview(m)
+         except TypeError:
+            # python 2 mmap objects do not export buffers
+            return False
+         try:
+            for off in range(0, sz, self.blocksize):
+               v.visit_data(view[off:off + self.blocksize])
+         finally:
+            view.release()
+      finally:
+         m.close()
+      return True
+
 class encode_visitor(object):
    def __init__(self, path, verbose = False):
       assert not os.path.exists(path)
@@ -87,7 +238,7 @@ class encode_visitor(object):
          print("file '%s', sz %d" % (self._path, sz), end='', file=sys.stderr)
 
    def visit_data(self, b):
-      assert isinstance(b, bytearray) or isinstance(b, bytes)
+      assert isinstance(b, bytearray) or isinstance(b, bytes) or isinstance(b, memoryview)
       self._cnt += len(b)
       self._f.write(b)
       if self._v:
@@ -107,29 +258,333 @@ class encode_visitor(object):
 
    def visit_entry(self, name, t, obj):
 
-      fp.validate_name(name)
-      assert name not in self._names, "duplicate name %r" % name
-      self._names.add(name)
-
       if t == 'l' and isinstance(obj, fp.fingerprint):
+         self._check_entry(name)
          fpath = os.path.join(self._path, quote('\0' + name))
          if self._v:
             print("reference '%s'" % fpath, file=sys.stderr)
-         with open(fpath, 'wb') as f:
-            f.write(obj.binary())
+         self._write_reference(fpath, obj.binary())
 
       elif isinstance(obj, fp.fingerprintable):
-         fsname = quote(name)
-         if fsname.startswith('.'):
-            # avoid "bad" entries "." amd ".." and hidden filenames
-            fsname = '%2E' + fsname[1:]
-         fpath = os.path.join(self._path, fsname)
-         obj.visit(encode_visitor(fpath, self._v))
+         obj.visit(self.enter_entry(name, t))
 
       else:
+         self._check_entry(name)
          raise TypeError("invalid object type")
 
+   def _write_reference(self, path, data):
+      with open(path, 'wb') as f:
+         f.write(data)
+
+   def _check_entry(self, name):
+      fp.validate_name(name)
+      assert name not in self._names, "duplicate name %r" % name
+      self._names.add(name)
+
+   def _entry_path(self, name):
+      self._check_entry(name)
+      return os.path.join(self._path, entry_name(name))
+
+   def enter_entry(self, name, t):
+      return encode_visitor(self._entry_path(name), self._v)
+
+   def leave_entry(self, name, t, v):
+      pass
+
    def leave_dict(self):
       del self._names
       if self._v:
          print("end dir '%s'" % self._path, file=sys.stderr)
+
+def _write_file(path, data, sync = False):
+   with open(path, 'wb') as f:
+      f.write(data)
+      if sync:
+         f.flush()
+         os.fsync(f.fileno())
+
+def _fsync_dir(path):
+   fd = os.open(path, os.O_RDONLY)
+   try:
+      os.fsync(fd)
+   finally:
+      os.close(fd)
+
+def _preallocate(f, sz):
+   # reserve the space of a file at once, where supported
+   if hasattr(os, 'posix_fallocate'):
+      try:
+         os.posix_fallocate(f.fileno(), 0, sz)
+      except EnvironmentError:
+         pass
+
+class _writer(object):
+   """Pool of threads writing files for parallel_encode_visitors.
+
+   At most max_jobs writes, holding at most max_bytes of data, are
+   pending at a time. If sync is non-false, each file is flushed to
+   disk by the thread writing it, and the directories recorded with
+   created() are flushed at the end.
+   """
+
+   max_jobs = 1024
+   max_bytes = 64 * 1024 * 1024
+
+   def __init__(self, jobs, sync = False):
+      self._pool = multiprocessing.pool.ThreadPool(jobs)
+      self._pending = collections.deque()
+      self._bytes = 0
+      self.sync = sync
+      # directories to flush at the end, once their entries exist
+      self.dirs = []
+
+   def _wait(self):
+      r, sz = self._pending.popleft()
+      self._bytes -= sz
+      r.get()
+
+   def write(self, path, data):
+      """Write data to the file path, asynchronously."""
+      while self._pending and self._pending[0][0].ready():
+         self._wait()
+      while self._pending and (len(self._pending) >= self.max_jobs or
+                               self._bytes + len(data) > self.max_bytes):
+         self._wait()
+      self._pending.append((self._pool.apply_async(_write_file, (path, data, self.sync)), len(data)))
+      self._bytes += len(data)
+
+   def created(self, path):
+      """Record that the directory path was created."""
+      if self.sync:
+         self.dirs.append(path)
+
+   def finish(self):
+      """Wait for the pending writes, then flush them if requested."""
+      while self._pending:
+         self._wait()
+      self._pool.close()
+      self._pool.join()
+      if self.sync:
+         try:
+            for p in self.dirs:
+               _fsync_dir(p)
+         except EnvironmentError:
+            # directories cannot be opened or flushed on this platform
+            if hasattr(os, 'sync'):
+               os.sync()
+
+   def abort(self):
+      self._pool.terminate()
+      self._pool.join()
+
+class parallel_encode_visitor(encode_visitor):
+   """Materialize an abstract object tree, writing files in parallel.
+
+   Directories are created as they are visited, before their entries.
+   The data of each file up to coalesce bytes is gathered in memory and
+   written at once by a thread of writer; larger files are preallocated
+   and written by the calling thread in blocks of coalesce bytes.
+   Fingerprint references are written by writer too. The layout is the
+   same as with encode_visitor.
+   """
+
+   coalesce = 8 * 1024 * 1024
+
+   def __init__(self, path, verbose = False, writer = None):
+      encode_visitor.__init__(self, path, verbose)
+      self._w = writer
+
+   def enter_file(self, sz):
+      self._sz = sz
+      self._cnt = 0
+      self._buf = bytearray()
+      self._f = None
+      if sz > self.coalesce:
+         self._f = open(self._path, 'wb')
+         _preallocate(self._f, sz)
+      if self._v:
+         print("file '%s', sz %d" % (self._path, sz), file=sys.stderr)
+
+   def visit_data(self, b):
+      assert isinstance(b, bytearray) or isinstance(b, bytes) or isinstance(b, memoryview)
+      self._cnt += len(b)
+      self._buf += b
+      if self._f is not None and len(self._buf) >= self.coalesce:
+         self._f.write(self._buf)
+         del self._buf[:]
+
+   def leave_file(self):
+      assert self._sz == self._cnt
+      if self._f is not None:
+         self._f.write(self._buf)
+         if self._w.sync:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+         self._f.close()
+      else:
+         self._w.write(self._path, self._buf)
+      del self._buf, self._f
+
+   def enter_dict(self):
+      encode_visitor.enter_dict(self)
+      self._w.created(self._path)
+
+   def _write_reference(self, path, data):
+      self._w.write(path, data)
+
+   def enter_entry(self, name, t):
+      return parallel_encode_visitor(self._entry_path(name), self._v, self._w)
+
+def encode(obj, path, jobs = None, sync = False, verbose = False):
+   """Materialize the fingerprintable object obj at path, in parallel.
+
+   Arguments:
+   jobs -- the number of writer threads (default: the number of CPUs)
+   sync -- flush the files and directories written to disk before
+           returning
+   verbose -- print detail on the standard error
+   """
+   assert isinstance(obj, fp.fingerprintable)
+   w = _writer(jobs or multiprocessing.cpu_count(), sync)
+   try:
+      walk.walk(obj, parallel_encode_visitor(path, verbose, w))
+   except:
+      w.abort()
+      raise
+   # the entry of path itself
+   w.created(os.path.dirname(os.path.abspath(path)))
+   w.finish()
+
+# ioctl request to share the extents of a file (Linux, Btrfs/XFS)
+FICLONE = 0x40049409
+
+def reflink(src, dst):
+   """Create dst as a copy of the file src sharing its storage.
+
+   An EnvironmentError is raised if the filesystem does not support
+   it, in which case dst is not created.
+   """
+   if fcntl is None:
+      raise EnvironmentError(errno.EOPNOTSUPP, "reflinks are not supported")
+   with open(src, 'rb') as s:
+      fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+      try:
+         fcntl.ioctl(fd, FICLONE, s.fileno())
+      except:
+         os.close(fd)
+         os.remove(dst)
+         raise
+      os.close(fd)
+
+class dedup_state(object):
+   """Files written by dedup_visitors, by fingerprint.
+
+   method is 'hardlink' or 'reflink'. The counters written and linked
+   hold the number of files written and linked, and the attributes
+   bytes_written and bytes_saved the corresponding sizes.
+   """
+
+   def __init__(self, method = 'hardlink'):
+      assert method in ['hardlink', 'reflink']
+      self.method = method
+      self.paths = {}
+      self.written = self.linked = 0
+      self.bytes_written = self.bytes_saved = 0
+      # temporary files are created private; give them the mode of
+      # the files created by open()
+      self.umask = os.umask(0)
+      os.umask(self.umask)
+
+   def link(self, src, dst):
+      """Create dst as a link or reflink to src; return False on failure."""
+      try:
+         if self.method == 'hardlink':
+            os.link(src, dst)
+         else:
+            reflink(src, dst)
+      except EnvironmentError:
+         # e.g. other filesystem, too many links or no reflink support
+         return False
+      return True
+
+class dedup_visitor(encode_visitor):
+   """Materialize an abstract object tree, linking identical files.
+
+   Each file is fingerprinted as its data arrives. Its first copy is
+   written normally; the later ones are hard links (or reflinks) to it,
+   see help(dedup_state). The data of files up to buffer_size bytes is
+   kept in memory until the fingerprint is known, so that duplicates
+   are not written at all; larger files are written to a temporary
+   file which is removed if they are duplicates. Files are written
+   normally when linking fails, and are then linked to by the later
+   copies instead, e.g. once the first copy has reached the maximum
+   number of hard links.
+
+   All the visitors of a tree share state.
+   """
+
+   buffer_size = 1024 * 1024
+
+   def __init__(self, path, verbose = False, state = None):
+      encode_visitor.__init__(self, path, verbose)
+      if state is None:
+         state = dedup_state()
+      self.state = state
+
+   def enter_file(self, sz):
+      self._sz = sz
+      self._cnt = 0
+      self._h = fp.compute_visitor()
+      self._h.enter_file(sz)
+      self._buf = bytearray()
+      self._f = None
+      if self._v:
+         print("file '%s', sz %d" % (self._path, sz), end='', file=sys.stderr)
+
+   def visit_data(self, b):
+      assert isinstance(b, bytearray) or isinstance(b, bytes) or isinstance(b, memoryview)
+      self._cnt += len(b)
+      self._h.visit_data(b)
+      if self._f is None and len(self._buf) + len(b) > self.buffer_size:
+         fd, self._tpath = tempfile.mkstemp(prefix='.sc-', dir=os.path.dirname(self._path) or '.')
+         self._f = os.fdopen(fd, 'wb')
+         self._f.write(self._buf)
+         self._buf = None
+      if self._f is None:
+         self._buf += b
+      else:
+         self._f.write(b)
+      if self._v:
+         print(".", end='', file=sys.stderr)
+
+   def leave_file(self):
+      assert self._sz == self._cnt
+      self._h.leave_file()
+      key = bytes(self._h._fp)
+      st = self.state
+      src = st.paths.get(key)
+      if self._f is not None:
+         self._f.close()
+      if src is not None and self._sz > 0 and st.link(src, self._path):
+         st.linked += 1
+         st.bytes_saved += self._sz
+         if self._f is not None:
+            os.remove(self._tpath)
+         how = "linked to '%s'" % src
+      else:
+         if self._f is not None:
+            os.chmod(self._tpath, 0o666 & ~st.umask)
+            os.rename(self._tpath, self._path)
+         else:
+            with open(self._path, 'wb') as f:
+               f.write(self._buf)
+         st.paths[key] = self._path
+         st.written += 1
+         st.bytes_written += self._sz
+         how = "written"
+      del self._h, self._buf, self._f
+      if self._v:
+         print(", %s" % how, file=sys.stderr)
+
+   def enter_entry(self, name, t):
+      return dedup_visitor(self._entry_path(name), self._v, self.state)
@@ -5,12 +5,10 @@ from __future__ import print_function
 import sys
 import json
 import base64
-from sc import fp
-
-try:
-   unichr(0)
-except:
-   unichr = chr
+import codecs
+from json.decoder import scanstring
+from json.encoder import encode_basestring_ascii
+from sc import fp, walk
 
 class pyjson_visitor(object):
    """Convert an abstract object tree to a JSON-serializable Python concrete object.
@@ -34,45 +32,51 @@ class pyjson_visitor(object):
    def enter_file(self, sz):
       self._sz = sz
       self._cnt = 0
-      if self._b64:
-         self._value = bytearray()
-      else:
-         self._value = u''
+      self._value = bytearray()
 
    def visit_data(self, b):
-      assert isinstance(b, bytearray) or isinstance(b, bytes)
+      assert isinstance(b, bytearray) or isinstance(b, bytes) or isinstance(b, memoryview)
       self._cnt += len(b)
-      if self._b64:
-         self._value += b
-      else:
-         for c in b:
-            self._value += unichr(c)
+      self._value += b
 
    def leave_file(self):
       assert self._sz == self._cnt
       assert len(self._value) == self._sz
       if self._b64:
          self._value = [base64.urlsafe_b64encode(self._value).decode('ascii')]
+      else:
+         # each byte becomes the character with the same code
+         self._value = self._value.decode('latin-1')
 
    def enter_dict(self):
       self._value = {}
 
    def visit_entry(self, name, t, obj):
 
-      fp.validate_name(name)
-      assert name not in self._value, "duplicate name %r" % name
-
       if t == 'l' and isinstance(obj, fp.fingerprint):
+         self._check_entry(name)
          self._value[name] = [obj.compact()]
 
       elif isinstance(obj, fp.fingerprintable):
-         v = pyjson_visitor(self._b64)
+         v = self.enter_entry(name, t)
          obj.visit(v)
-         self._value[name] = v.value()
+         self.leave_entry(name, t, v)
 
       else:
+         self._check_entry(name)
          raise TypeError("invalid object type: %r" % obj)
 
+   def _check_entry(self, name):
+      fp.validate_name(name)
+      assert name not in self._value, "duplicate name %r" % name
+
+   def enter_entry(self, name, t):
+      self._check_entry(name)
+      return pyjson_visitor(self._b64)
+
+   def leave_entry(self, name, t, v):
+      self._value[name] = v.value()
+
    def leave_dict(self):
       pass
 
@@ -80,6 +84,88 @@ class pyjson_visitor(object):
       """Returns the Python object computed by this visitor."""
       return self._value
 
+class write_visitor(object):
+   """Write an abstract object tree as JSON text, as it is visited.
+
+   The text is the same as that produced by json.dump from the value
+   of a pyjson_visitor, but nothing is kept in memory besides the
+   state of the enclosing dictionaries.
+
+   write_visitor :: Fingerprintable a => a -> IO ()
+   """
+
+   def __init__(self, dst, use_base64):
+      self._dst = dst
+      self._b64 = use_base64
+
+   def enter_file(self, sz):
+      self._sz = sz
+      self._cnt = 0
+      if self._b64:
+         self._rest = bytearray()
+         self._dst.write('["')
+      else:
+         self._dst.write('"')
+
+   def visit_data(self, b):
+      assert isinstance(b, bytearray) or isinstance(b, bytes) or isinstance(b, memoryview)
+      self._cnt += len(b)
+      if self._b64:
+         # encode whole groups of 3 bytes, keep the remainder for later
+         data = self._rest + b
+         n = len(data) - len(data) % 3
+         self._dst.write(base64.urlsafe_b64encode(bytes(data[:n])).decode('ascii'))
+         self._rest = data[n:]
+      else:
+         s = codecs.latin_1_decode(b)[0]
+         self._dst.write(encode_basestring_ascii(s)[1:-1])
+
+   def leave_file(self):
+      assert self._sz == self._cnt
+      if self._b64:
+         self._dst.write(base64.urlsafe_b64encode(bytes(self._rest)).decode('ascii'))
+         self._dst.write('"]')
+      else:
+         self._dst.write('"')
+
+   def enter_dict(self):
+      self._names = set()
+      self._dst.write('{')
+
+   def visit_entry(self, name, t, obj):
+
+      if t == 'l' and isinstance(obj, fp.fingerprint):
+         self._write_name(name)
+         self._dst.write('["%s"]' % obj.compact())
+
+      elif isinstance(obj, fp.fingerprintable):
+         obj.visit(self.enter_entry(name, t))
+
+      else:
+         self._write_name(name)
+         raise TypeError("invalid object type: %r" % obj)
+
+   def _write_name(self, name):
+      fp.validate_name(name)
+      assert name not in self._names, "duplicate name %r" % name
+
+      if len(self._names) > 0:
+         self._dst.write(', ')
+      self._names.add(name)
+      self._dst.write(encode_basestring_ascii(name))
+      self._dst.write(': ')
+
+   def enter_entry(self, name, t):
+      self._write_name(name)
+      return write_visitor(self._dst, self._b64)
+
+   def leave_entry(self, name, t, v):
+      pass
+
+   def leave_dict(self):
+      del self._names
+      self._dst.write('}')
+
 class pyjson_wrap(fp.fingerprintable):
    """Wrap a JSON-serializable Python concrete dictionary tree in the fingerprintable
 interface.
@@ -88,9 +174,13 @@ interface.
    (fp.compute_visitor), save to filesystem (fs.encode_visitor), etc.
    """
 
+   standalone = True
+
    def __init__(self, obj):
-      if isinstance(obj, str) or isinstance(obj, type(u'')):
-         obj = bytearray((ord(c) for c in obj))
+      if isinstance(obj, type(u'')):
+         obj = bytearray(obj, 'latin-1')
+      elif isinstance(obj, str): # python 2
+         obj = bytearray(obj)
       elif isinstance(obj, list) and len(obj) == 1:
          obj = base64.urlsafe_b64decode(str(obj[0]))
       self._obj = obj
@@ -119,14 +209,178 @@ interface.
          v.visit_data(self._obj)
          v.leave_file()
 
+class _reader(object):
+   """Incremental tokenizer for a JSON text read from a stream.
+
+   Only the unread part of the current chunk is kept in memory,
+   extended as needed to hold the string being scanned.
+   """
+
+   def __init__(self, src, bufsize = 65536):
+      self._src = src
+      self._bufsize = bufsize
+      self._buf = u''
+      self._pos = 0
+      self._dec = codecs.getincrementaldecoder('utf-8')()
+      self._eof = False
+
+   def _fill(self, n):
+      """Read at least n more characters, unless at end of stream."""
+      if self._eof:
+         return False
+      chunk = u''
+      while len(chunk) < n:
+         data = self._src.read(max(n, self._bufsize))
+         eof = (len(data) == 0)
+         if isinstance(data, bytes):
+            data = self._dec.decode(data, final = eof)
+         chunk += data
+         if eof:
+            self._eof = True
+            break
+      self._buf = self._buf[self._pos:] + chunk
+      self._pos = 0
+      return len(chunk) > 0
+
+   def peek(self):
+      """Skip whitespace and return the next character, or '' at the end."""
+      while True:
+         while self._pos < len(self._buf) and self._buf[self._pos] in u' \t\n\r':
+            self._pos += 1
+         if self._pos < len(self._buf):
+            return self._buf[self._pos]
+         if not self._fill(1):
+            return u''
+
+   def expect(self, c):
+      """Consume the next character, which must be c."""
+      n = self.peek()
+      if n != c:
+         raise ValueError("expected %r, found %r in JSON data" % (c, n or 'end of data'))
+      self._pos += 1
+
+   def string(self):
+      """Consume and return the next string."""
+      self.expect(u'"')
+      while True:
+         try:
+            s, end = scanstring(self._buf, self._pos)
+            self._pos = end
+            return s
+         except ValueError:
+            # the string may continue in the next chunk; keep it from
+            # its opening quote and read as much again.
+            self._pos -= 1
+            grown = self._fill(len(self._buf) - self._pos)
+            self._pos = 1
+            if not grown:
+               raise
+
+   def end(self):
+      """Check that the stream is exhausted."""
+      if self.peek() != u'':
+         raise ValueError("extra data after JSON value")
+
+class _skip_visitor(object):
+   """Visitor that consumes an object without looking at it."""
+
+   def enter_file(self, sz): pass
+   def visit_data(self, b): pass
+   def leave_file(self): pass
+   def enter_dict(self): pass
+   def visit_entry(self, name, t, obj): pass
+   def leave_dict(self): pass
+
+class stream_wrap(fp.fingerprintable):
+   """Wrap a JSON value read incrementally from a stream in the
+fingerprintable interface.
+
+   Unlike pyjson_wrap, the JSON data is parsed while the object is
+   visited, so memory use is bounded by the nesting depth and the
+   largest string. As a consequence the object can only be visited
+   once, and the entries of a dictionary must be visited in the order
+   they are presented to ``visit_entry``; entries that a visitor does
+   not visit are skipped.
+   """
+
+   def __init__(self, reader, root = False):
+      self._r = reader
+      self._root = root
+      self._visited = False
+
+   def _file_data(self):
+      r = self._r
+      if r.peek() == u'[':
+         r.expect(u'[')
+         s = r.string()
+         r.expect(u']')
+         return ('l', s)
+      s = r.string()
+      return ('s', s.encode('latin-1'))
+
+   def visit(self, v):
+      assert not self._visited, "a JSON stream can only be visited once"
+      self._visited = True
+      r = self._r
+      if r.peek() == u'{':
+         r.expect(u'{')
+         v.enter_dict()
+         if r.peek() == u'}':
+            r.expect(u'}')
+         else:
+            while True:
+               k = r.string()
+               r.expect(u':')
+               c = r.peek()
+               if c == u'{':
+                  obj = stream_wrap(r)
+                  v.visit_entry(k, 't', obj)
+                  if not obj._visited:
+                     obj.visit(_skip_visitor())
+               elif c in [u'"', u'[']:
+                  t, val = self._file_data()
+                  if t == 'l':
+                     if val[:3].lower() == 'fp:':
+                        v.visit_entry(k, 'l', fp.fingerprint(val))
+                     else:
+                        v.visit_entry(k, 's', pyjson_wrap([val]))
+                  else:
+                     v.visit_entry(k, 's', pyjson_wrap(val))
+               else:
+                  raise TypeError("invalid object type in JSON data: %r" % c)
+               if r.peek() == u',':
+                  r.expect(u',')
+               else:
+                  r.expect(u'}')
+                  break
+         v.leave_dict()
+      elif r.peek() in [u'"', u'[']:
+         t, val = self._file_data()
+         if t == 'l':
+            val = [val]
+         pyjson_wrap(val).visit(v)
+      else:
+         raise TypeError("invalid object type in JSON data: %r" % r.peek())
+      if self._root:
+         r.end()
+
+def decode_stream(json_src):
+    """Return a fingerprintable interface to the JSON object read from json_src.
+
+    The object is parsed incrementally while it is visited, and can
+    be visited only once. See help(stream_wrap) for details.
+    """
+    return stream_wrap(_reader(json_src), root = True)
+
 def decode(json_src):
     """Return a fingerprintable interface to the JSON object given as argument."""
     obj = json.load(json_src)
     return pyjson_wrap(obj)
 
 def encode(obj, json_dst, use_base64 = False):
-    """Encode a fingerprintable object to a JSON object."""
+    """Encode a fingerprintable object to a JSON object.
+
+    The JSON text is written to json_dst as the object is visited.
+    """
     assert isinstance(obj, fp.fingerprintable)
-    v = pyjson_visitor(use_base64)
-    obj.visit(v)
-    json.dump(v.value(), json_dst)
+    walk.walk(obj, write_visitor(json_dst, use_base64))
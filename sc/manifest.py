@@ -0,0 +1,240 @@
+"""Manifests of the fingerprints of all the entries of objects.
+
+A manifest lists every node of an object: the root and, recursively,
+the entries of its dictionaries, with their type, size and
+fingerprint. It is computed in the same pass as the fingerprint of the
+object, and is enough to recompute that fingerprint, to compare the
+object with another one, or to check a copy of the object without
+access to the original.
+
+The nodes are listed in post-order, each dictionary after its entries,
+and the entries of a dictionary in name order (except for objects read
+sequentially from a stream, whose entries follow the stream). The size
+of a file is its number of bytes, the size of a dictionary the total
+size of the files it contains; references have no size.
+
+In the text format, each node is a line::
+
+  TYPE SIZE FINGERPRINT PATH
+
+where TYPE is 's', 't' or 'l', SIZE is '-' for references,
+FINGERPRINT is in compact form and PATH is formatted by diff.path_str,
+the root being '.'. The lines are encoded in UTF-8.
+
+The binary format starts with the 4 bytes 'SCM\\x01'. Each node is
+then its type (1 byte), its size as an 8-byte big-endian integer
+(0xffffffffffffffff for references), its fingerprint (32 bytes), the
+size of its path (4 bytes) and its path as UTF-8 names separated by
+NUL bytes.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import os.path
+import struct
+from sc import fp, fs, walk, diff
+
+magic = b'SCM\x01'
+unknown = 0xffffffffffffffff
+
+class _output(object):
+   """Destination of the records of a manifest."""
+
+   def __init__(self, f, binary):
+      self.f = f
+      self.binary = binary
+      if binary:
+         f.write(magic)
+
+   def add(self, path, t, size, f):
+      if self.binary:
+         p = u'\0'.join(path).encode('utf-8')
+         if size is None:
+            size = unknown
+         self.f.write(t.encode('ascii') + struct.pack('>Q', size) + bytes(f) +
+                      struct.pack('>I', len(p)) + p)
+      else:
+         if size is None:
+            size = '-'
+         line = u'%s %s %s %s\n' % (t, size, fp.fingerprint(f).compact(), diff.path_str(path, t))
+         self.f.write(line.encode('utf-8'))
+
+class write_visitor(fp.compute_visitor):
+   """Visitor computing a fingerprint and writing the manifest of the object.
+
+   The records of the visited object are added to out, see
+   help(_output), after those of its entries.
+
+   write_visitor :: Fingerprintable a => a -> fingerprint
+   """
+
+   def __init__(self, out, path = (), verbose = False):
+      fp.compute_visitor.__init__(self, verbose)
+      self._out = out
+      self._path = path
+
+   def leave_file(self):
+      fp.compute_visitor.leave_file(self)
+      self._size = self._sz
+      self._out.add(self._path, 's', self._size, self._fp)
+
+   def enter_dict(self):
+      fp.compute_visitor.enter_dict(self)
+      self._size = 0
+
+   def visit_entry(self, name, t, obj):
+      fp.compute_visitor.visit_entry(self, name, t, obj)
+      if t == 'l':
+         self._out.add(self._path + (name,), 'l', None, obj.binary())
+
+   def enter_entry(self, name, t):
+      self._check_entry(name)
+      return write_visitor(self._out, self._path + (name,), self._v)
+
+   def leave_entry(self, name, t, v):
+      fp.compute_visitor.leave_entry(self, name, t, v)
+      self._size += v._size
+
+   def leave_dict(self):
+      fp.compute_visitor.leave_dict(self)
+      self._out.add(self._path, 't', self._size, self._fp)
+
+def write(obj, f, binary = False, verbose = False):
+   """Write the manifest of the fingerprintable object obj to the binary stream f.
+
+   Returns the fingerprint of obj.
+   """
+   assert isinstance(obj, fp.fingerprintable)
+   return walk.walk(obj, write_visitor(_output(f, binary), (), verbose), sort=True).fingerprint()
+
+def _read(f, n):
+   b = f.read(n)
+   if len(b) != n:
+      raise ValueError("truncated manifest")
+   return b
+
+_types = {b's': 's', b't': 't', b'l': 'l'}
+
+def read(f):
+   """Iterate over the records of the manifest read from the binary stream f.
+
+   The text and binary formats are recognized. Yields (path, t, size,
+   fp) tuples where path is a tuple of names, size is None for
+   references and fp is the binary fingerprint of the node.
+   """
+   head = f.read(len(magic))
+   if head == magic:
+      while True:
+         t = f.read(1)
+         if not t:
+            return
+         if t not in _types:
+            raise ValueError("invalid node type in manifest: %r" % t)
+         size = struct.unpack('>Q', _read(f, 8))[0]
+         if size == unknown:
+            size = None
+         h = bytearray(_read(f, 32))
+         p = _read(f, struct.unpack('>I', _read(f, 4))[0]).decode('utf-8')
+         yield p and tuple(p.split(u'\0')) or (), _types[t], size, h
+      return
+
+   line = head + f.readline()
+   while line:
+      try:
+         t, size, h, p = line.decode('utf-8').rstrip('\n').split(' ', 3)
+         if t not in ['s', 't', 'l']:
+            raise ValueError("invalid node type %r" % t)
+         if size == '-':
+            size = None
+         else:
+            size = int(size)
+         yield diff.parse_path(p), t, size, fp.fingerprint(h).digest()
+      except (ValueError, RuntimeError) as e:
+         raise ValueError("invalid manifest line %r: %s" % (line, e))
+      line = f.readline()
+
+def load(records, verbose = False):
+   """Check the records of a manifest and index the dictionaries.
+
+   The fingerprint of each dictionary is recomputed from the records
+   of its entries, so the manifest is consistent if the fingerprint of
+   the root is as expected. A ValueError is raised if the records do
+   not describe an object.
+
+   Returns the binary fingerprint of the root, the serialized entries
+   of each dictionary indexed by binary fingerprint (see diff.index),
+   and the size of each file indexed by binary fingerprint.
+   """
+   # the entries of the dictionaries not listed yet, by path
+   pending = {}
+   idx = {}
+   sizes = {}
+   root = None
+   for path, t, size, h in records:
+      h = bytes(h)
+      if root is not None:
+         raise ValueError("record after the root: %s" % diff.path_str(path, t))
+      for name in path:
+         fp.validate_name(name)
+      if t == 't':
+         ents = pending.pop(path, {})
+         total = sum((sz or 0 for et, ef, sz in ents.values()))
+         buf = fp.dict_records(dict(((n, (et, ef)) for n, (et, ef, sz) in ents.items())))
+         if bytes(fp.records_hash(buf).digest()) != h:
+            raise ValueError("fingerprint of %s does not match its entries" % diff.path_str(path, t))
+         if size != total:
+            raise ValueError("size of %s does not match its entries" % diff.path_str(path, t))
+         idx[h] = buf
+      elif t == 's':
+         if size is None:
+            raise ValueError("file without size: %s" % diff.path_str(path, t))
+         sizes[h] = size
+      elif not path:
+         raise ValueError("the root cannot be a reference")
+      if verbose:
+         print("%s %s" % (fp.fingerprint(h).compact(), diff.path_str(path, t)), file=sys.stderr)
+      if not path:
+         root = h
+         continue
+      ents = pending.setdefault(path[:-1], {})
+      if path[-1] in ents:
+         raise ValueError("duplicate entry: %s" % diff.path_str(path, t))
+      ents[path[-1]] = (t, h, size)
+   if root is None:
+      raise ValueError("no root in manifest")
+   if pending:
+      path = min(pending)
+      raise ValueError("entries outside of any dictionary: %s" % diff.path_str(path, 't'))
+   return root, idx, sizes
+
+def seed(c, path, records, ignorelist = ['.*'], verbose = False):
+   """Store the fingerprints of the files of the manifest in the cache c.
+
+   path is the directory (or file) holding the object described by
+   the records, with the entry names of fs.entry_name. The fingerprint of each file is recorded for the
+   current state of the corresponding filesystem path, if it is a
+   file of the same size: its contents are trusted to be those
+   described by the manifest, e.g. after a download checked by other
+   means. The fingerprints of dictionaries are not recorded, since
+   entries may have been added or removed since: they are recomputed
+   from those of their entries. Returns the number of fingerprints
+   stored.
+   """
+   n = 0
+   for p, t, size, h in records:
+      if t != 's':
+         continue
+      local = os.path.join(path, *[fs.entry_name(name) for name in p])
+      try:
+         obj = fs.fs_wrap(local, ignorelist)
+         if obj.isdir() or obj.stat().st_size != size:
+            continue
+      except OSError:
+         continue
+      c.store(obj.cache_key(), h)
+      n += 1
+      if verbose:
+         print("seeded %s" % diff.path_str(p, t), file=sys.stderr)
+   return n
@@ -0,0 +1,434 @@
+"""Convert Structured Commons objects to a packed binary format and back.
+
+The format follows the events of the visitor protocol, so that it can
+be written and read in one pass:
+
+- the header is the 4 bytes 'SCB\\x01', followed by the object;
+
+- a file is 's', its size as an 8-byte big-endian integer, and its
+  data;
+
+- a dictionary is 't', its number of entries and the size of its
+  entries in bytes, as 8-byte big-endian integers, and its entries.
+  When the output cannot be rewound to fill in these numbers, both are
+  0xffffffffffffffff and the entries are followed by 4 zero bytes;
+
+- an entry is the size of its UTF-8 encoded name as a 4-byte
+  big-endian integer, the name, and either a file, a dictionary or 'l'
+  followed by the 32 bytes of a fingerprint.
+
+The object may be followed by an index of the positions of all the
+entries, for random access by path: 'X', the number of entries as an
+8-byte integer then, for each entry, the position of its file,
+dictionary or fingerprint from the start of the header (8 bytes), the
+size of its path (4 bytes) and its path as UTF-8 names separated by
+NUL bytes. The position of 'X' (8 bytes) and 'SCBX' end the index.
+"""
+
+import struct
+import threading
+from sc import fp, walk
+from sc.js import _skip_visitor
+
+magic = b'SCB\x01'
+index_magic = b'SCBX'
+unknown = 0xffffffffffffffff
+
+def _seekable(f):
+   try:
+      return f.seekable()
+   except AttributeError:
+      # python 2 files
+      try:
+         f.tell()
+         return True
+      except IOError:
+         return False
+
+class _output(object):
+   """Destination stream shared by the visitors of an object."""
+
+   def __init__(self, f, index):
+      self.f = f
+      self.pos = 0
+      self.seekable = _seekable(f)
+      self.index = None
+      if index:
+         self.index = []
+
+   def write(self, b):
+      self.f.write(b)
+      self.pos += len(b)
+
+class write_visitor(object):
+   """Write an abstract object tree in the packed format, as it is visited.
+
+   The dictionaries are rewound to fill in their headers when the
+   destination is seekable. The positions of the entries are recorded
+   for the index if out.index is not None.
+
+   write_visitor :: Fingerprintable a => a -> IO ()
+   """
+
+   def __init__(self, out, path = ()):
+      self._out = out
+      self._path = path
+
+   def enter_file(self, sz):
+      self._sz = sz
+      self._cnt = 0
+      self._out.write(b's' + struct.pack('>Q', sz))
+
+   def visit_data(self, b):
+      assert isinstance(b, bytearray) or isinstance(b, bytes) or isinstance(b, memoryview)
+      self._cnt += len(b)
+      self._out.write(b)
+
+   def leave_file(self):
+      assert self._sz == self._cnt
+
+   def enter_dict(self):
+      self._names = set()
+      self._out.write(b't')
+      self._hdr = self._out.pos
+      self._out.write(struct.pack('>QQ', unknown, unknown))
+
+   def _write_name(self, name):
+      fp.validate_name(name)
+      assert name not in self._names, "duplicate name %r" % name
+      self._names.add(name)
+      b = name.encode('utf-8')
+      self._out.write(struct.pack('>I', len(b)) + b)
+      if self._out.index is not None:
+         self._out.index.append((self._out.pos, self._path + (name,)))
+
+   def visit_entry(self, name, t, obj):
+
+      if t == 'l' and isinstance(obj, fp.fingerprint):
+         self._write_name(name)
+         self._out.write(b'l' + obj.digest())
+
+      elif isinstance(obj, fp.fingerprintable):
+         v = self.enter_entry(name, t)
+         obj.visit(v)
+         self.leave_entry(name, t, v)
+
+      else:
+         raise TypeError("invalid object type: %r" % obj)
+
+   def enter_entry(self, name, t):
+      self._write_name(name)
+      return write_visitor(self._out, self._path + (name,))
+
+   def leave_entry(self, name, t, v):
+      pass
+
+   def leave_dict(self):
+      out = self._out
+      if out.seekable:
+         end = out.pos
+         out.f.seek(self._hdr - end, 1)
+         out.f.write(struct.pack('>QQ', len(self._names), end - self._hdr - 16))
+         out.f.seek(end - self._hdr - 16, 1)
+      else:
+         out.write(struct.pack('>I', 0))
+      del self._names
+
+def encode(obj, dst, index = None):
+   """Write the fingerprintable object obj to the binary stream dst.
+
+   The index of the entries is written after the object if index is
+   non-false or, by default, if dst is seekable: a reader of a pipe
+   could not use it, and stops reading after the object.
+   """
+   assert isinstance(obj, fp.fingerprintable)
+   if index is None:
+      index = _seekable(dst)
+   out = _output(dst, index)
+   out.write(magic)
+   walk.walk(obj, write_visitor(out))
+   if out.index is not None:
+      start = out.pos
+      out.write(b'X' + struct.pack('>Q', len(out.index)))
+      for pos, path in out.index:
+         p = u'\0'.join(path).encode('utf-8')
+         out.write(struct.pack('>QI', pos, len(p)) + p)
+      out.write(struct.pack('>Q', start) + index_magic)
+
+class _reader(object):
+   """Read a seekable stream at given positions, from any thread."""
+
+   blocksize = 1024 * 1024
+
+   def __init__(self, f):
+      self._f = f
+      self._lock = threading.Lock()
+      # the end positions of the dictionaries without sizes already
+      # scanned, by position
+      self.ends = {}
+
+   def read(self, pos, n):
+      with self._lock:
+         self._f.seek(pos)
+         b = self._f.read(n)
+      if len(b) != n:
+         raise ValueError("truncated packed object")
+      return b
+
+   def size(self):
+      with self._lock:
+         self._f.seek(0, 2)
+         return self._f.tell()
+
+_types = {b's': 's', b't': 't', b'l': 'l'}
+
+def _header(r, pos):
+   # return the type of the object at pos, its header and the position
+   # of its contents
+   t = r.read(pos, 1)
+   if t == b's':
+      return 's', struct.unpack('>Q', r.read(pos + 1, 8)), pos + 9
+   elif t == b't':
+      return 't', struct.unpack('>QQ', r.read(pos + 1, 16)), pos + 17
+   elif t == b'l':
+      return 'l', (), pos + 1
+   raise ValueError("invalid object type in packed data: %r" % t)
+
+def _entries(r, pos, count):
+   """Iterate over the entries of a dictionary whose contents start at pos.
+
+   Yields (name, pos) where pos is the position of the object of the
+   entry.
+   """
+   i = 0
+   while count == unknown or i < count:
+      n = struct.unpack('>I', r.read(pos, 4))[0]
+      if n == 0 and count == unknown:
+         return
+      name = r.read(pos + 4, n).decode('utf-8')
+      pos += 4 + n
+      yield name, pos
+      pos = _skip(r, pos)
+      i += 1
+
+def _skip(r, pos, index = None):
+   """Return the position following the object at pos.
+
+   The dictionaries whose size is not in their header are scanned
+   with an explicit stack, once: their end is remembered in r.ends. If
+   index is not None, the whole object is scanned instead and the
+   position of each of its entries is recorded in index by path.
+   """
+   # each frame is a dictionary being scanned: the number of entries
+   # left to read (or unknown), its path and its position
+   stack = []
+   path = ()
+   while True:
+      t, hdr, start = _header(r, pos)
+      if t == 's':
+         pos = start + hdr[0]
+      elif t == 'l':
+         pos = start + 32
+      elif index is None and hdr[1] != unknown:
+         pos = start + hdr[1]
+      elif index is None and pos in r.ends:
+         pos = r.ends[pos]
+      else:
+         stack.append([hdr[0], path, pos])
+         pos = start
+      # move to the next entry, leaving the dictionaries completed
+      while stack:
+         frame = stack[-1]
+         if frame[0] == 0:
+            stack.pop()
+            continue
+         n = struct.unpack('>I', r.read(pos, 4))[0]
+         if n == 0 and frame[0] == unknown:
+            pos += 4
+            r.ends[frame[2]] = pos
+            stack.pop()
+            continue
+         if frame[0] != unknown:
+            frame[0] -= 1
+         path = frame[1] + (r.read(pos + 4, n).decode('utf-8'),)
+         pos += 4 + n
+         if index is not None:
+            index[path] = pos
+         break
+      else:
+         return pos
+
+class packed_wrap(fp.fingerprintable):
+   """Wrap the object at a given position of a seekable packed stream
+in the fingerprintable interface.
+
+   The data is read when the object is visited, and the object can be
+   visited any number of times, by several threads.
+   """
+
+   standalone = True
+
+   def __init__(self, r, pos):
+      self._r = r
+      self._pos = pos
+
+   def visit(self, v):
+      """Visitor dispatch method.
+
+      See help(fp.fingerprintable.visit) for details.
+      """
+      r = self._r
+      t, hdr, start = _header(r, self._pos)
+      if t == 's':
+         sz = hdr[0]
+         v.enter_file(sz)
+         for off in range(0, sz, r.blocksize):
+            v.visit_data(r.read(start + off, min(r.blocksize, sz - off)))
+         v.leave_file()
+      elif t == 't':
+         v.enter_dict()
+         for name, p in _entries(r, start, hdr[0]):
+            et = _header(r, p)[0]
+            if et == 'l':
+               v.visit_entry(name, 'l', fp.fingerprint(r.read(p + 1, 32)))
+            else:
+               v.visit_entry(name, et, packed_wrap(r, p))
+         v.leave_dict()
+      else:
+         raise ValueError("the root of a packed object must be a file or dictionary")
+
+class archive(object):
+   """Random access to a packed object in the seekable binary stream f."""
+
+   def __init__(self, f):
+      self._r = _reader(f)
+      if self._r.read(0, 4) != magic:
+         raise ValueError("not a packed object")
+      self._index = None
+
+   def root(self):
+      """Return a fingerprintable interface to the whole object."""
+      return packed_wrap(self._r, 4)
+
+   def index(self):
+      """Return the index of the object, mapping paths to positions.
+
+      The index following the object is read if there is one,
+      otherwise the object is scanned to build it. This is done once.
+      """
+      if self._index is None:
+         r = self._r
+         end = _skip(r, 4)
+         if end == r.size():
+            idx = {}
+            _skip(r, 4, idx)
+            self._index = idx
+            return idx
+         start = struct.unpack('>Q', r.read(r.size() - 12, 8))[0]
+         if start != end or r.read(r.size() - 4, 4) != index_magic or r.read(start, 1) != b'X':
+            raise ValueError("invalid packed object index")
+         idx = {}
+         pos = start + 9
+         for i in range(struct.unpack('>Q', r.read(start + 1, 8))[0]):
+            p, n = struct.unpack('>QI', r.read(pos, 12))
+            idx[tuple(r.read(pos + 12, n).decode('utf-8').split(u'\0'))] = p
+            pos += 12 + n
+         self._index = idx
+      return self._index
+
+   def get(self, path):
+      """Return the type and object of the entry at path (a tuple of names).
+
+      The object is a fingerprint for type 'l', a fingerprintable
+      object otherwise. A KeyError is raised if there is no such entry.
+      """
+      path = tuple(path)
+      if not path:
+         return 't', self.root()
+      idx = self.index()
+      if path not in idx:
+         raise KeyError("no entry %r" % (path,))
+      r = self._r
+      pos = idx[path]
+      t = _header(r, pos)[0]
+      if t == 'l':
+         return t, fp.fingerprint(r.read(pos + 1, 32))
+      return t, packed_wrap(r, pos)
+
+class _stream(object):
+   """Read a stream sequentially."""
+
+   def __init__(self, f):
+      self._f = f
+
+   def read(self, n):
+      b = self._f.read(n)
+      if len(b) != n:
+         raise ValueError("truncated packed object")
+      return b
+
+class stream_wrap(fp.fingerprintable):
+   """Wrap a packed object read sequentially from a stream in the
+fingerprintable interface.
+
+   t is the type of the object, already read from the stream. As with
+   js.stream_wrap, the object can only be visited once, and the
+   entries of a dictionary must be visited in the order they are
+   presented to ``visit_entry``; entries that a visitor does not visit
+   are skipped.
+   """
+
+   blocksize = 1024 * 1024
+
+   def __init__(self, s, t):
+      self._s = s
+      self._t = t
+      self._visited = False
+
+   def visit(self, v):
+      assert not self._visited, "a packed stream can only be visited once"
+      self._visited = True
+      s = self._s
+      if self._t == 's':
+         sz = struct.unpack('>Q', s.read(8))[0]
+         v.enter_file(sz)
+         for off in range(0, sz, self.blocksize):
+            v.visit_data(s.read(min(self.blocksize, sz - off)))
+         v.leave_file()
+      elif self._t == 't':
+         count = struct.unpack('>QQ', s.read(16))[0]
+         v.enter_dict()
+         i = 0
+         while count == unknown or i < count:
+            n = struct.unpack('>I', s.read(4))[0]
+            if n == 0 and count == unknown:
+               break
+            name = s.read(n).decode('utf-8')
+            t = _types.get(s.read(1))
+            if t == 'l':
+               v.visit_entry(name, 'l', fp.fingerprint(s.read(32)))
+            elif t is not None:
+               obj = stream_wrap(s, t)
+               v.visit_entry(name, t, obj)
+               if not obj._visited:
+                  obj.visit(_skip_visitor())
+            else:
+               raise ValueError("invalid object type in packed data")
+            i += 1
+         v.leave_dict()
+      else:
+         raise ValueError("the root of a packed object must be a file or dictionary")
+
+def decode(src):
+   """Return a fingerprintable interface to the packed object read from src.
+
+   If the binary stream src is seekable, the object is read as it is
+   visited, see help(packed_wrap). Otherwise it is read sequentially
+   and can be visited only once, see help(stream_wrap).
+   """
+   if _seekable(src):
+      return archive(src).root()
+   s = _stream(src)
+   if s.read(4) != magic:
+      raise ValueError("not a packed object")
+   return stream_wrap(s, _types.get(s.read(1)))
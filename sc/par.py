@@ -0,0 +1,325 @@
+"""Parallel computation of fingerprints over abstract object trees."""
+
+from __future__ import print_function
+
+import sys
+import collections
+import multiprocessing
+import multiprocessing.pool
+from sc import fp
+
+def file_fp(obj, hash_name = 'sha256'):
+   """Compute the binary fingerprint of a file object.
+
+   This is the task run by the workers of the pools (see also
+   sc.aio); obj must be picklable when the pool is made of processes.
+   """
+   v = fp.compute_visitor(hash_name=hash_name)
+   obj.visit(v)
+   return v._fp
+
+class _done(object):
+   """Stand-in for an asynchronous result that is already known."""
+
+   def __init__(self, value):
+      self._value = value
+
+   def ready(self):
+      return True
+
+   def get(self):
+      return self._value
+
+class _window(object):
+   """Bound on the number of asynchronous results in flight.
+
+   add() waits for the oldest results while more than size are
+   pending, so that the workers are not handed a whole tree at once.
+   """
+
+   def __init__(self, size):
+      self._size = size
+      self._results = collections.deque()
+
+   def add(self, r):
+      self._results.append(r)
+      while self._results and (self._results[0].ready() or len(self._results) > self._size):
+         self._results.popleft().wait()
+      return r
+
+class parallel_compute_visitor(object):
+   """Visitor to compute fingerprints using a pool of workers.
+
+   The file objects found in dictionaries are fingerprinted
+   asynchronously by the workers of ``pool``, while the dictionaries
+   themselves are walked by the calling thread. The digest of a
+   dictionary is combined once all its entries are known, using the
+   same serialization as ``compute_visitor.leave_dict``, so the
+   resulting fingerprints are identical to those of
+   ``compute_visitor``.
+
+   If pool is None, files are fingerprinted immediately. If window is
+   not None, it bounds the number of files submitted to the pool and
+   not yet fingerprinted, see compute().
+
+   If queue is not None, the standalone dictionaries found in entries
+   are not visited immediately: (obj, visitor) pairs are appended to
+   queue instead, for the caller to visit them, and the visitors must
+   then be finalized with get() after those of their entries, see
+   compute(). Each such visitor counts in _pending those of its
+   dictionaries still queued, and links to the visitor to finalize
+   after it in _parent. Otherwise the dictionaries are visited
+   recursively.
+
+   If cache is not None, it must be a ``cache.fp_cache``. The
+   fingerprints of objects providing a ``cache_key`` method are then
+   looked up in and saved to the cache. A dictionary whose entries are
+   all found in the cache reuses its stored fingerprint, unless it
+   holds fingerprint references: these are read from files which can
+   be rewritten without changing the cache key of the dictionary.
+
+   hash_name is the hash function computing the fingerprints, see
+   fp.hashes.
+
+   parallel_compute_visitor :: Fingerprintable a => a -> fingerprint
+   """
+
+   def __init__(self, pool, verbose = False, cache = None, key = None, queue = None,
+                hash_name = 'sha256', window = None):
+      """Instantiate a visitor.
+
+      If verbose is non-false, the visitor prints detail on the
+      standard error. If key is not None, it is the cache key of the
+      object visited.
+      """
+      self._pool = pool
+      self._v = verbose
+      self._cache = cache
+      self._key = key
+      self._queue = queue
+      self._hash = hash_name
+      self._window = window
+      # the queued visitor this one is finalized with (None: itself),
+      # its queued dictionaries not finalized yet, and the visitor
+      # waiting for it
+      self._owner = None
+      self._pending = 0
+      self._parent = None
+      self._fp = None
+      # True if the fingerprint was found in the cache
+      self._cached = False
+
+   def _submit(self, obj):
+      if self._pool is None:
+         return _done(file_fp(obj, self._hash))
+      r = self._pool.apply_async(file_fp, (obj, self._hash))
+      if self._window is not None:
+         self._window.add(r)
+      return r
+
+   def _ready(self):
+      for t, r in self._ents.values():
+         if not r.ready():
+            return False
+      return True
+
+   def _lookup(self):
+      # reuse the cached fingerprint of the dictionary if all its
+      # entries were found in the cache
+      if self._cache is None or self._key is None or not self._hits:
+         return False
+      for t, r in self._ents.values():
+         if t == 't' and not r._cached:
+            return False
+      value = self._cache.lookup(self._key)
+      if value is None:
+         return False
+      self._fp = value
+      self._cached = True
+      del self._ents, self._keys
+      if self._v:
+         print("leaving dictionary (%s), cached" % fp.fingerprint(self._fp).compact(), file=sys.stderr)
+      return True
+
+   def get(self):
+      """Wait for the entries of the object and return its binary fingerprint."""
+      if self._fp is None and not self._lookup():
+         ents = {}
+         for name in sorted(self._ents.keys()):
+            t, r = self._ents[name]
+            ents[name] = (t, r.get())
+            if name in self._keys:
+               self._cache.store(self._keys[name], ents[name][1])
+            if self._v:
+               kind = {'s': 'file', 't': 'dictionary', 'l': 'fingerprint'}[t]
+               print("entry %r: %s (%s)" % (name, kind, fp.fingerprint(ents[name][1]).compact()), file=sys.stderr)
+         self._fp = fp.dict_digest(ents, self._hash)
+         del self._ents, self._keys
+         if self._key is not None:
+            self._cache.store(self._key, self._fp)
+         if self._v:
+            print("leaving dictionary (%s)" % fp.fingerprint(self._fp).compact(), file=sys.stderr)
+      return self._fp
+
+   def ready(self):
+      # the entries of a dictionary still queued are not known yet
+      return self._fp is not None or (hasattr(self, '_ents') and self._ready())
+
+   def fingerprint(self):
+      """Return the fingerprint computed by this visitor."""
+      return fp.fingerprint(self.get())
+
+   def enter_file(self, sz):
+      """Start fingerprinting an object file."""
+      self._file = fp.compute_visitor(self._v, self._hash)
+      self._file.enter_file(sz)
+
+   def visit_data(self, b):
+      """Fingerprint some more data from a file previously entered."""
+      self._file.visit_data(b)
+
+   def leave_file(self):
+      """Finish fingerprinting an object file."""
+      self._file.leave_file()
+      self._fp = self._file._fp
+      del self._file
+      if self._key is not None:
+         self._cache.store(self._key, self._fp)
+
+   def enter_dict(self):
+      """Start fingerprinting an object dictionary."""
+      self._ents = {}
+      self._keys = {}
+      self._hits = True
+      if self._v:
+         print("dictionary, entering:", file=sys.stderr)
+
+   def visit_entry(self, name, t, obj):
+      """Schedule the fingerprinting of a dictionary entry.
+
+      See help(fp.compute_visitor.visit_entry) for details.
+      """
+      fp.validate_name(name)
+      assert name not in self._ents, "duplicate name %r" % name
+
+      if (t == 'l') and hasattr(obj, 'binary'):
+         self._hits = False
+         self._ents[name] = (t, _done(obj.binary()))
+
+      elif t == 's' and isinstance(obj, fp.fingerprintable):
+         key = self._cache_key(obj)
+         value = None
+         if key is not None:
+            value = self._cache.lookup(key)
+         if value is not None:
+            self._ents[name] = (t, _done(value))
+         else:
+            self._hits = False
+            if key is not None:
+               self._keys[name] = key
+            self._ents[name] = (t, self._submit(obj))
+
+      elif t == 't' and isinstance(obj, fp.fingerprintable):
+         v = parallel_compute_visitor(self._pool, self._v, self._cache, self._cache_key(obj), self._queue,
+                                      self._hash, self._window)
+         owner = self._owner or self
+         if self._queue is not None and obj.standalone:
+            v._parent = owner
+            owner._pending += 1
+            self._queue.append((obj, v))
+         else:
+            v._owner = owner
+            obj.visit(v)
+         self._ents[name] = (t, v)
+
+      else:
+         raise TypeError("unknown entity type in dictionary")
+
+   def leave_dict(self):
+      """Finish walking an object dictionary.
+
+      The digest is combined immediately if all the entries are
+      already known, otherwise when it is first requested.
+      """
+      if self._ready():
+         self.get()
+
+   def _cache_key(self, obj):
+      if self._cache is None or not hasattr(obj, 'cache_key'):
+         return None
+      return obj.cache_key()
+
+def _finalize(done, wait):
+   # finalize the visitors of done whose files are known (all of them
+   # if wait), then those of their parents left without pending
+   # dictionaries; return the visitors still waiting
+   waiting = []
+   while done:
+      dv = done.pop()
+      if not wait and not dv.ready():
+         waiting.append(dv)
+         continue
+      dv.get()
+      p = dv._parent
+      dv._parent = None
+      if p is not None:
+         p._pending -= 1
+         if p._pending == 0:
+            done.append(p)
+   return waiting
+
+def compute(obj, jobs = None, processes = False, verbose = False, cache = None, hash_name = 'sha256'):
+   """Compute the fingerprint of a fingerprintable object in parallel.
+
+   The dictionaries are visited one at a time from an explicit queue,
+   so that the depth of the object is only limited by memory. Each is
+   finalized and released once its entries are known, and at most
+   4 * jobs files are submitted to the workers ahead of the walk, so
+   that memory grows with the depth and width of the object rather
+   than its size.
+
+   Arguments:
+   obj -- the object to fingerprint
+   jobs -- the number of workers (default: the number of CPUs)
+   processes -- use a pool of processes instead of threads
+   verbose -- print detail on the standard error
+   cache -- a cache.fp_cache to reuse fingerprints from (default: none)
+   hash_name -- the hash function, see fp.hashes (default: sha256)
+   """
+   assert isinstance(obj, fp.fingerprintable)
+   if cache is not None and cache.hash_name != hash_name:
+      raise ValueError("the cache holds %s fingerprints, not %s" % (cache.hash_name, hash_name))
+   key = None
+   if cache is not None and hasattr(obj, 'cache_key'):
+      key = obj.cache_key()
+      if key[0] == 's':
+         value = cache.lookup(key)
+         if value is not None:
+            return fp.fingerprint(value)
+   if jobs is None:
+      jobs = multiprocessing.cpu_count()
+   if jobs <= 1:
+      pool = None
+   elif processes:
+      pool = multiprocessing.Pool(jobs)
+   else:
+      pool = multiprocessing.pool.ThreadPool(jobs)
+   try:
+      queue = []
+      v = parallel_compute_visitor(pool, verbose, cache, key, queue, hash_name, _window(4 * jobs))
+      queue.append((obj, v))
+      # visitors whose queued dictionaries are all finalized, waiting
+      # for their files
+      done = []
+      while queue:
+         o, dv = queue.pop()
+         o.visit(dv)
+         if dv._pending == 0:
+            done.append(dv)
+         done = _finalize(done, False)
+      _finalize(done, True)
+      return v.fingerprint()
+   finally:
+      if pool is not None:
+         pool.terminate()
+         pool.join()
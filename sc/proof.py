@@ -0,0 +1,190 @@
+"""Inclusion proofs for entries of Structured Commons objects.
+
+The fingerprint of a dictionary is the hash of its serialized entries
+(see fp.dict_records), each of which holds the fingerprint of an
+entry. A proof that an entry at a given path belongs to an object
+with a known root fingerprint is therefore the list of the serialized
+entries of each dictionary along the path: hashing them in turn leads
+from the root to the fingerprint of the entry, with O(depth x fan-out)
+hashing and without access to the rest of the object.
+
+Binary encoding: 'p', the number of levels in decimal, a NUL byte,
+then for each level the entry name in UTF-8, a NUL byte, the size of
+the serialized entries in decimal, a NUL byte and the entries.
+
+JSON encoding: an object {"path": [NAME, ...], "levels": [[[T, NAME,
+FP], ...], ...]} where each level lists the entries of a dictionary
+with their type and compact fingerprint.
+"""
+
+from sc import fp, diff, walk, py
+from sc.store import parse_records
+
+class proof(object):
+   """Inclusion proof for the entry at path (a tuple of names).
+
+   levels holds the serialized entries of the dictionaries along the
+   path, starting with the root.
+   """
+
+   def __init__(self, path, levels):
+      if len(path) != len(levels):
+         raise ValueError("the proof must have one level per name of the path")
+      self.path = tuple(path)
+      self.levels = levels
+
+def _lookup(recs, name):
+   for n, t, f in parse_records(recs):
+      if n == name:
+         return t, bytes(f)
+   return None
+
+def prove(records, root, path):
+   """Return the proof for the entry at path in the object with fingerprint root.
+
+   records is a function returning the serialized entries of a
+   dictionary given its binary fingerprint, and raising KeyError for
+   unknown dictionaries; e.g. the __getitem__ method of an index
+   returned by diff.index, or the records method of a
+   store.obj_store. A KeyError is raised if there is no entry at path.
+   """
+   path = tuple(path)
+   assert len(path) > 0, "the path must not be empty"
+   f = fp.fingerprint(root).digest()
+   levels = []
+   for i, name in enumerate(path):
+      try:
+         recs = records(f)
+      except KeyError:
+         raise KeyError("%s is not a dictionary" % diff.path_str(path[:i], 't'))
+      levels.append(recs)
+      ent = _lookup(recs, name)
+      if ent is None:
+         raise KeyError("no entry %s" % diff.path_str(path[:i + 1], 's'))
+      f = ent[1]
+   return proof(path, levels)
+
+def _entry(view, verbose):
+   # the type and binary fingerprint of an entry of a py.lazy_dict
+   if isinstance(view, py.lazy_dict):
+      t = 't'
+   elif isinstance(view, py.lazy_file):
+      t = 's'
+   else:
+      return 'l', view.binary()
+   return t, bytes(walk.walk(view, fp.compute_visitor(verbose))._fp)
+
+def make(obj, path, verbose = False):
+   """Fingerprint obj and return the proof for the entry at path.
+
+   If obj can be visited again (see py.lazy), the dictionaries along
+   the path are looked up first, so that a KeyError is raised before
+   any file is read if there is no entry at path; their entries are
+   then fingerprinted from the deepest one up, and only these
+   dictionaries are kept. Other objects are indexed whole, see
+   diff.index.
+   """
+   path = tuple(path)
+   assert len(path) > 0, "the path must not be empty"
+   if not obj.standalone:
+      root, idx = diff.index(obj, verbose)
+      return prove(idx.__getitem__, root, path)
+   views = [py.lazy(obj)]
+   for i, name in enumerate(path):
+      d = views[-1]
+      if not isinstance(d, py.lazy_dict):
+         raise KeyError("%s is not a dictionary" % diff.path_str(path[:i], 't'))
+      if name not in d:
+         raise KeyError("no entry %s" % diff.path_str(path[:i + 1], 's'))
+      views.append(d[name])
+   levels = []
+   f = None
+   for i in reversed(range(len(path))):
+      ents = {}
+      for name, view in views[i].items():
+         if name == path[i] and f is not None:
+            # the dictionary of the level below
+            ents[name] = ('t', f)
+         else:
+            ents[name] = _entry(view, verbose)
+      recs = fp.dict_records(ents)
+      levels.insert(0, recs)
+      f = bytes(fp.records_hash(recs).digest())
+   return proof(path, levels)
+
+def verify(root, p):
+   """Check the proof p against the root fingerprint root.
+
+   Returns the type and fingerprint of the entry proven by p. A
+   ValueError is raised if the proof does not match the root, or if it
+   is empty: the type of the root is not recorded, and prove never
+   returns an empty proof.
+   """
+   if not p.path:
+      raise ValueError("empty proof")
+   f = fp.fingerprint(root).digest()
+   t = 't'
+   for i, (name, recs) in enumerate(zip(p.path, p.levels)):
+      where = diff.path_str(p.path[:i], 't')
+      if t != 't':
+         raise ValueError("%s is not a dictionary" % where)
+      if fp.records_hash(recs).digest() != f:
+         raise ValueError("fingerprint mismatch at %s" % where)
+      ent = _lookup(recs, name)
+      if ent is None:
+         raise ValueError("no entry %r at %s" % (name, where))
+      t, f = ent
+   return t, fp.fingerprint(f)
+
+def encode(p):
+   """Return the binary encoding of proof p."""
+   buf = bytearray('p%d\0' % len(p.levels), 'ascii')
+   for name, recs in zip(p.path, p.levels):
+      buf += bytearray(name, 'utf-8')
+      buf += bytearray('\0%d\0' % len(recs), 'ascii')
+      buf += recs
+   return buf
+
+def _field(buf, i):
+   try:
+      j = buf.index(b'\0', i)
+   except ValueError:
+      raise ValueError("truncated proof")
+   return buf[i:j], j + 1
+
+def decode(buf):
+   """Return the proof encoded in the binary buffer buf."""
+   buf = bytearray(buf)
+   if buf[:1] != b'p':
+      raise ValueError("not a binary proof")
+   n, i = _field(buf, 1)
+   path = []
+   levels = []
+   for k in range(int(n.decode('ascii'))):
+      name, i = _field(buf, i)
+      sz, i = _field(buf, i)
+      sz = int(sz.decode('ascii'))
+      if i + sz > len(buf):
+         raise ValueError("truncated proof")
+      path.append(bytes(name).decode('utf-8'))
+      levels.append(buf[i:i + sz])
+      i += sz
+   if i != len(buf):
+      raise ValueError("trailing data after proof")
+   return proof(path, levels)
+
+def to_json(p):
+   """Return the JSON-serializable representation of proof p."""
+   levels = [[[t, n, fp.fingerprint(f).compact()] for n, t, f in parse_records(recs)]
+             for recs in p.levels]
+   return {'path': list(p.path), 'levels': levels}
+
+def from_json(obj):
+   """Return the proof represented by the JSON-decoded value obj."""
+   levels = []
+   for ents in obj['levels']:
+      d = {}
+      for t, n, f in ents:
+         d[n] = (str(t), fp.fingerprint(f).digest())
+      levels.append(fp.dict_records(d))
+   return proof(obj['path'], levels)
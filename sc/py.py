@@ -3,7 +3,7 @@
 from __future__ import print_function
 
 import sys
-from sc import fp
+from sc import fp, walk
 
 class pyrepr_visitor(object):
    """Convert an abstract object tree to a Python concrete object.
@@ -27,7 +27,7 @@ class pyrepr_visitor(object):
       self._value = bytearray()
 
    def visit_data(self, b):
-      assert isinstance(b, bytearray) or isinstance(b, bytes)
+      assert isinstance(b, bytearray) or isinstance(b, bytes) or isinstance(b, memoryview)
       self._cnt += len(b)
       self._value += b
 
@@ -39,20 +39,30 @@ class pyrepr_visitor(object):
 
    def visit_entry(self, name, t, obj):
 
-      fp.validate_name(name)
-      assert name not in self._value, "duplicate name %r" % name
-
       if t == 'l' and isinstance(obj, fp.fingerprint):
+         self._check_entry(name)
          self._value[name] = obj
 
       elif isinstance(obj, fp.fingerprintable):
-         v = pyrepr_visitor()
+         v = self.enter_entry(name, t)
          obj.visit(v)
-         self._value[name] = v.value()
+         self.leave_entry(name, t, v)
 
       else:
+         self._check_entry(name)
          raise TypeError("invalid object type: %r" % obj)
 
+   def _check_entry(self, name):
+      fp.validate_name(name)
+      assert name not in self._value, "duplicate name %r" % name
+
+   def enter_entry(self, name, t):
+      self._check_entry(name)
+      return pyrepr_visitor()
+
+   def leave_entry(self, name, t, v):
+      self._value[name] = v.value()
+
    def leave_dict(self):
       pass
 
@@ -69,6 +79,8 @@ interface.
 
    """
 
+   standalone = True
+
    def __init__(self, obj):
       self._obj = obj
 
@@ -94,6 +106,184 @@ interface.
          v.visit_data(buf)
          v.leave_file()
 
+class _stop(Exception):
+   pass
+
+class _kind_visitor(object):
+   """Visitor finding the type of an object without reading its data."""
+
+   def enter_file(self, sz):
+      self.t = 's'
+      self.sz = sz
+      raise _stop()
+
+   def enter_dict(self):
+      self.t = 't'
+      raise _stop()
+
+class _entries_visitor(object):
+   """Visitor collecting the entries of a dictionary without visiting them."""
+
+   def enter_file(self, sz):
+      raise TypeError("object is not a dictionary")
+
+   def enter_dict(self):
+      self.ents = {}
+
+   def visit_entry(self, name, t, obj):
+      fp.validate_name(name)
+      assert name not in self.ents, "duplicate name %r" % name
+      self.ents[name] = (t, obj)
+
+   def leave_dict(self):
+      pass
+
+class lazy_file(fp.fingerprintable):
+   """Lazy view of an object file.
+
+   The data is only read when the object is visited, or when
+   value() or write_to() are called.
+   """
+
+   def __init__(self, obj, sz = None):
+      self._obj = obj
+      self._sz = sz
+
+   def __len__(self):
+      if self._sz is None:
+         v = _kind_visitor()
+         try:
+            self._obj.visit(v)
+         except _stop:
+            pass
+         self._sz = v.sz
+      return self._sz
+
+   @property
+   def standalone(self):
+      return getattr(self._obj, 'standalone', False)
+
+   def visit(self, v):
+      """Visitor dispatch method, streaming the underlying object."""
+      self._obj.visit(v)
+
+   def value(self):
+      """Return the data of the file as a bytearray."""
+      return encode(self._obj)
+
+   def write_to(self, f):
+      """Write the data of the file to the stream f, as it is read."""
+      self._obj.visit(write_visitor(f))
+
+class lazy_dict(fp.fingerprintable):
+   """Lazy view of an object dictionary, with a read-only mapping interface.
+
+   The entries are listed when first accessed; dictionaries and files
+   in the entries are themselves returned as lazy views, created once,
+   and fingerprint references as fingerprint objects.
+   """
+
+   def __init__(self, obj):
+      self._obj = obj
+      self._ents = None
+      self._views = {}
+
+   def _entries(self):
+      if self._ents is None:
+         v = _entries_visitor()
+         self._obj.visit(v)
+         self._ents = v.ents
+      return self._ents
+
+   def __getitem__(self, name):
+      view = self._views.get(name)
+      if view is None:
+         t, obj = self._entries()[name]
+         if t == 'l':
+            view = obj
+         elif t == 't':
+            view = lazy_dict(obj)
+         else:
+            view = lazy_file(obj)
+         self._views[name] = view
+      return view
+
+   def __contains__(self, name):
+      return name in self._entries()
+
+   def __iter__(self):
+      return iter(self._entries())
+
+   def __len__(self):
+      return len(self._entries())
+
+   def keys(self):
+      return list(self._entries().keys())
+
+   def items(self):
+      return [(k, self[k]) for k in self._entries()]
+
+   def get(self, name, default = None):
+      if name in self:
+         return self[name]
+      return default
+
+   @property
+   def standalone(self):
+      return getattr(self._obj, 'standalone', False)
+
+   def visit(self, v):
+      """Visitor dispatch method, streaming the underlying object."""
+      self._obj.visit(v)
+
+   def value(self):
+      """Return the whole tree as Python objects (see help(encode))."""
+      return encode(self._obj)
+
+def lazy(obj):
+   """Return a lazy view of a fingerprintable object.
+
+   The result is a lazy_dict or a lazy_file. The object must support
+   being visited more than once, like fs.fs_wrap or store.store_wrap.
+   """
+   assert isinstance(obj, fp.fingerprintable)
+   v = _kind_visitor()
+   try:
+      obj.visit(v)
+   except _stop:
+      pass
+   if v.t == 't':
+      return lazy_dict(obj)
+   return lazy_file(obj, v.sz)
+
+class write_visitor(object):
+   """Write a single object file to a binary stream as its data arrives.
+
+   If transform is not None, it is applied to each piece of data
+   before it is written.
+   """
+
+   def __init__(self, dst, transform = None):
+      self._dst = dst
+      self._t = transform
+
+   def enter_file(self, sz):
+      self._sz = sz
+      self._cnt = 0
+
+   def visit_data(self, b):
+      assert isinstance(b, bytearray) or isinstance(b, bytes) or isinstance(b, memoryview)
+      self._cnt += len(b)
+      if self._t is not None:
+         b = self._t(b)
+      self._dst.write(b)
+
+   def leave_file(self):
+      assert self._sz == self._cnt
+
+   def enter_dict(self):
+      raise TypeError("only a file object can be written as a byte stream")
+
 def decode(obj):
     """Return a fingerprintable interface to the object given as argument."""
     return pyrepr_wrap(obj)
@@ -101,6 +291,4 @@ def decode(obj):
 def encode(obj):
     """Encode a fingerprintable object to a Python object tree."""
     assert isinstance(obj, fp.fingerprintable)
-    v = pyrepr_visitor()
-    obj.visit(v)
-    return v.value()
+    return walk.walk(obj, pyrepr_visitor()).value()
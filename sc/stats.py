@@ -0,0 +1,186 @@
+"""Instrumentation of the visits of abstract object trees.
+
+traced(obj, st) wraps a fingerprintable object so that the visits of
+obj and of all the objects it contains update the statistics st,
+whatever the visitor: the number of files, dictionaries and entries,
+the bytes of file data, the time spent in each phase, and the slowest
+files. Nothing is measured for objects that are not wrapped.
+
+The phases are:
+
+- walk: listing the entries of dictionaries;
+- read: producing the data of files;
+- hash or serialize (the phase given to stats): processing the events
+  in the visitor.
+
+The times are summed over the threads visiting objects, so they may
+exceed the elapsed time when fingerprinting in parallel.
+
+The system calls issued by an fs.fs_wrap object and its entries are
+counted when it is created with st.syscall as its syscalls argument.
+"""
+
+import heapq
+import threading
+import time
+from sc import fp, diff
+
+try:
+   _clock = time.perf_counter
+except AttributeError:
+   # python 2
+   _clock = time.time
+
+class stats(object):
+   """Statistics of visits of traced objects.
+
+   phase is the name of the time spent in the visitors, 'hash' or
+   'serialize'. The slowest files are kept, up to slowest of them. If
+   progress is not None, it is called with this object at most every
+   interval seconds while files and dictionaries are visited.
+   """
+
+   def __init__(self, phase = 'hash', slowest = 10, progress = None, interval = 1.0):
+      self.counters = {'bytes': 0, 'files': 0, 'dicts': 0, 'entries': 0}
+      self.timers = {'walk': 0., 'read': 0., phase: 0.}
+      self.syscalls = {}
+      self._phase = phase
+      self._nslow = slowest
+      self._slow = []
+      self._progress = progress
+      self._interval = interval
+      self._lock = threading.Lock()
+      self._start = _clock()
+      self._next = self._start + interval
+
+   def elapsed(self):
+      """Return the time elapsed since the statistics were created."""
+      return _clock() - self._start
+
+   def _add(self, p, path, total):
+      with self._lock:
+         c = self.counters
+         if p.entries is None:
+            c['files'] += 1
+            c['bytes'] += p.size
+            self.timers['read'] += total - p.inner
+            item = (total, path, p.size)
+            if len(self._slow) < self._nslow:
+               heapq.heappush(self._slow, item)
+            elif self._slow and item > self._slow[0]:
+               heapq.heapreplace(self._slow, item)
+         else:
+            c['dicts'] += 1
+            c['entries'] += p.entries
+            self.timers['walk'] += total - p.inner - p.nested
+         self.timers[self._phase] += p.inner
+         report = self._progress is not None and _clock() >= self._next
+         if report:
+            self._next = _clock() + self._interval
+      if report:
+         self._progress(self)
+
+   def syscall(self, name):
+      """Count a system call, see help(fs.fs_wrap)."""
+      with self._lock:
+         self.syscalls[name] = self.syscalls.get(name, 0) + 1
+
+   def slowest(self):
+      """Return the slowest files as (seconds, path, size) tuples, slowest first."""
+      with self._lock:
+         return sorted(self._slow, reverse=True)
+
+   def snapshot(self):
+      """Return the counters and the elapsed time as a dictionary."""
+      with self._lock:
+         res = dict(self.counters)
+      res['elapsed'] = self.elapsed()
+      return res
+
+   def report(self):
+      """Return all the statistics as a JSON-serializable dictionary."""
+      res = self.snapshot()
+      with self._lock:
+         res['syscalls'] = sum(self.syscalls.values())
+         return {'counters': res,
+                 'timers': dict(self.timers),
+                 'syscalls': dict(self.syscalls),
+                 'slowest': [{'path': diff.path_str(path, 's'), 'seconds': t, 'bytes': sz}
+                             for t, path, sz in sorted(self._slow, reverse=True)]}
+
+class _probe(object):
+   """Visitor forwarding the events of one object to another visitor.
+
+   It measures the time spent in the forwarded events, apart from
+   visit_entry, which may visit the entry itself.
+   """
+
+   def __init__(self, v, st, path):
+      self._v = v
+      self._st = st
+      self._path = path
+      self.size = 0
+      self.entries = None
+      self.inner = 0.
+      self.nested = 0.
+
+   def enter_file(self, sz):
+      t = _clock()
+      self._v.enter_file(sz)
+      self.inner += _clock() - t
+
+   def visit_data(self, b):
+      self.size += len(b)
+      t = _clock()
+      self._v.visit_data(b)
+      self.inner += _clock() - t
+
+   def leave_file(self):
+      t = _clock()
+      self._v.leave_file()
+      self.inner += _clock() - t
+
+   def enter_dict(self):
+      self.entries = 0
+      t = _clock()
+      self._v.enter_dict()
+      self.inner += _clock() - t
+
+   def visit_entry(self, name, t, obj):
+      self.entries += 1
+      if t != 'l' and isinstance(obj, fp.fingerprintable):
+         obj = traced(obj, self._st, self._path + (name,))
+      c = _clock()
+      self._v.visit_entry(name, t, obj)
+      self.nested += _clock() - c
+
+   def leave_dict(self):
+      t = _clock()
+      self._v.leave_dict()
+      self.inner += _clock() - t
+
+class traced(fp.fingerprintable):
+   """Fingerprintable object recording its visits in the statistics st.
+
+   The other attributes (e.g. cache_key) are those of obj.
+   """
+
+   def __init__(self, obj, st, path = ()):
+      self._obj = obj
+      self._st = st
+      self._path = path
+
+   def __getattr__(self, name):
+      if name.startswith('_'):
+         raise AttributeError(name)
+      return getattr(self._obj, name)
+
+   @property
+   def standalone(self):
+      return getattr(self._obj, 'standalone', False)
+
+   def visit(self, v):
+      p = _probe(v, self._st, self._path)
+      t = _clock()
+      self._obj.visit(p)
+      self._st._add(p, self._path, _clock() - t)
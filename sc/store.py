@@ -0,0 +1,306 @@
+"""Content-addressed storage of Structured Commons objects.
+
+A store is a directory containing each distinct object once, under
+the hexadecimal representation of its fingerprint:
+
+  PATH/objects/XX/YYYY...
+
+where XX are the first two hexadecimal digits. The content of each
+object file is the exact data that is hashed to compute its
+fingerprint (see fp.compute_visitor):
+
+- for an object file of N bytes, 's', N in decimal, a NUL byte,
+  then the N bytes of data;
+
+- for an object dictionary whose serialized entries take N bytes,
+  't', N in decimal, a NUL byte, then the entries as serialized by
+  fp.dict_records.
+
+Objects are stored after all their entries, so the presence of a
+dictionary implies the presence of its whole subtree (except for
+'l' references, which may point outside of the store).
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import os.path
+import tempfile
+from sc import fp, walk
+
+class obj_store(object):
+   """Content-addressed object store rooted at a directory.
+
+   If create is non-false, the directory is created if needed.
+   """
+
+   blocksize = 1024 * 1024
+
+   def __init__(self, path, create = False):
+      self._path = path
+      self._objects = os.path.join(path, 'objects')
+      self._tmp = os.path.join(path, 'tmp')
+      if create:
+         for d in [path, self._objects, self._tmp]:
+            if not os.path.isdir(d):
+               os.mkdir(d)
+      assert os.path.isdir(self._objects), "%r is not an object store" % path
+
+   def path(self, f):
+      """Return the path of the object with fingerprint f in the store."""
+      h = fp.fingerprint(f).hex(split=0)
+      return os.path.join(self._objects, h[:2], h[2:])
+
+   def has(self, f):
+      """Return True if the object with fingerprint f is in the store."""
+      return os.path.exists(self.path(f))
+
+   def get(self, f):
+      """Return the stored object with fingerprint f, as a fingerprintable.
+
+      This can be used to resolve 'l' references to objects present
+      in the store. A KeyError is raised if the object is not in the
+      store.
+      """
+      f = fp.fingerprint(f)
+      if not self.has(f):
+         raise KeyError("object %s not in store" % f.compact())
+      return store_wrap(self, f)
+
+   def records(self, f):
+      """Return the serialized entries of the stored dictionary with fingerprint f.
+
+      See fp.dict_records for the format. A KeyError is raised if the
+      object is not in the store or is not a dictionary.
+      """
+      f = fp.fingerprint(f)
+      if not self.has(f):
+         raise KeyError("object %s not in store" % f.compact())
+      with open(self.path(f), 'rb') as fo:
+         t, sz = _read_header(fo)
+         if t != 't':
+            raise KeyError("object %s is not a dictionary" % f.compact())
+         buf = bytearray(fo.read())
+      if len(buf) != sz:
+         raise ValueError("stored object %s is truncated" % f.compact())
+      return buf
+
+   def put(self, obj, cache = None, verbose = False):
+      """Store a fingerprintable object and return its fingerprint.
+
+      See help(store_visitor) for the meaning of cache.
+      """
+      assert isinstance(obj, fp.fingerprintable)
+      return walk.walk(obj, store_visitor(self, cache, verbose)).fingerprint()
+
+   def _create(self):
+      """Return a new temporary file in the store, open for writing."""
+      fd, tpath = tempfile.mkstemp(dir=self._tmp)
+      return os.fdopen(fd, 'wb'), tpath
+
+   def _commit(self, tpath, f):
+      """Move a temporary file to its place, unless already stored.
+
+      Returns True if the object was new.
+      """
+      opath = self.path(f)
+      if os.path.exists(opath):
+         os.unlink(tpath)
+         return False
+      d = os.path.dirname(opath)
+      if not os.path.isdir(d):
+         try:
+            os.mkdir(d)
+         except OSError:
+            # created concurrently
+            assert os.path.isdir(d)
+      os.rename(tpath, opath)
+      return True
+
+class store_visitor(object):
+   """Visitor to add an abstract object tree to an object store.
+
+   Each object is written to a temporary file while it is
+   fingerprinted, then moved to its place in the store unless an
+   identical object was already stored.
+
+   If cache is not None, it must be a ``cache.fp_cache`` of sha256
+   fingerprints, the only ones stored. The file objects providing a
+   ``cache_key`` method whose fingerprint is found in the cache and
+   which are already stored are then not read again.
+
+   store_visitor :: Fingerprintable a => a -> fingerprint
+   """
+
+   # files are received by visit_entry, to look them up in the cache
+   visit_files = True
+
+   def __init__(self, store, cache = None, verbose = False):
+      if cache is not None and cache.hash_name != 'sha256':
+         raise ValueError("stores only hold sha256 fingerprints")
+      self._store = store
+      self._cache = cache
+      self._v = verbose
+
+   def fingerprint(self):
+      """Return the fingerprint of the object stored by this visitor."""
+      return fp.fingerprint(self._fp)
+
+   def _report(self, what, new):
+      if self._v:
+         print("%s (%s), %s" % (what, fp.fingerprint(self._fp).compact(), new and "stored" or "present"), file=sys.stderr)
+
+   def enter_file(self, sz):
+      self._h = fp.compute_visitor()
+      self._h.enter_file(sz)
+      self._f, self._tpath = self._store._create()
+      self._f.write(bytearray('s%d\0' % sz, 'ascii'))
+
+   def visit_data(self, b):
+      assert isinstance(b, bytearray) or isinstance(b, bytes) or isinstance(b, memoryview)
+      self._h.visit_data(b)
+      self._f.write(b)
+
+   def leave_file(self):
+      self._f.close()
+      self._h.leave_file()
+      self._fp = self._h._fp
+      new = self._store._commit(self._tpath, self._fp)
+      self._report("file, sz %d" % self._h._sz, new)
+      del self._h, self._f
+
+   def enter_dict(self):
+      self._ents = {}
+
+   def visit_entry(self, name, t, obj):
+
+      fp.validate_name(name)
+      assert name not in self._ents, "duplicate name %r" % name
+
+      if t == 'l' and isinstance(obj, fp.fingerprint):
+         self._ents[name] = (t, obj.binary())
+
+      elif isinstance(obj, fp.fingerprintable):
+         key = None
+         if self._cache is not None and t == 's' and hasattr(obj, 'cache_key'):
+            key = obj.cache_key()
+            value = self._cache.lookup(key)
+            if value is not None and self._store.has(value):
+               self._ents[name] = (t, value)
+               return
+         v = store_visitor(self._store, self._cache, self._v)
+         obj.visit(v)
+         self._ents[name] = (t, v._fp)
+         if key is not None:
+            self._cache.store(key, v._fp)
+
+      else:
+         raise TypeError("invalid object type")
+
+   def enter_entry(self, name, t):
+      fp.validate_name(name)
+      assert name not in self._ents, "duplicate name %r" % name
+      return store_visitor(self._store, self._cache, self._v)
+
+   def leave_entry(self, name, t, v):
+      self._ents[name] = (t, v._fp)
+
+   def leave_dict(self):
+      buf = fp.dict_records(self._ents)
+      self._fp = fp.dict_digest(self._ents)
+      new = False
+      if not self._store.has(self._fp):
+         f, tpath = self._store._create()
+         with f:
+            f.write(bytearray('t%d\0' % len(buf), 'ascii'))
+            f.write(buf)
+         new = self._store._commit(tpath, self._fp)
+      self._report("dictionary", new)
+      del self._ents
+
+def _read_header(f):
+   """Read the type and size header of a stored object."""
+   h = bytearray()
+   while True:
+      c = f.read(1)
+      if len(c) == 0:
+         raise ValueError("truncated object header")
+      if c == b'\0':
+         break
+      h += c
+   return chr(h[0]), int(h[1:].decode('ascii'))
+
+def parse_records(buf):
+   """Parse serialized dictionary entries.
+
+   This is the inverse of fp.dict_records: it returns a list of
+   (name, t, fp) tuples in name order, where fp is a binary
+   fingerprint.
+   """
+   ents = []
+   i = 0
+   while i < len(buf):
+      t = chr(buf[i])
+      if buf[i + 1] != ord(':'):
+         raise ValueError("invalid dictionary record at offset %d" % i)
+      j = buf.index(b'\0', i + 2)
+      name = bytes(buf[i + 2:j]).decode('utf-8')
+      f = buf[j + 1:j + 33]
+      if len(f) != 32:
+         raise ValueError("truncated dictionary record at offset %d" % i)
+      ents.append((name, t, f))
+      i = j + 33
+   return ents
+
+class store_wrap(fp.fingerprintable):
+   """Wrapper for objects in a store that enable fingerprinting.
+
+   The object data is read from the store when visited; the entries
+   of a dictionary are themselves wrapped lazily, so a subtree is only
+   read if it is visited.
+   """
+
+   standalone = True
+
+   def __init__(self, store, f):
+      self._store = store
+      self._fp = fp.fingerprint(f)
+
+   def fingerprint(self):
+      """Return the fingerprint of the stored object."""
+      return self._fp
+
+   def visit(self, v):
+      """Visitor dispatch method.
+
+      See help(fp.fingerprintable.visit) for details.
+      """
+      with open(self._store.path(self._fp), 'rb') as f:
+         t, sz = _read_header(f)
+         if t == 's':
+            v.enter_file(sz)
+            buf = bytearray(self._store.blocksize)
+            view = memoryview(buf)
+            cnt = 0
+            while True:
+               n = f.readinto(buf)
+               if not n: break
+               cnt += n
+               v.visit_data(view[:n])
+            if cnt != sz:
+               raise ValueError("stored object %s is truncated" % self._fp.compact())
+            v.leave_file()
+            return
+         elif t != 't':
+            raise ValueError("invalid type %r for stored object %s" % (t, self._fp.compact()))
+         buf = bytearray(f.read())
+      if len(buf) != sz:
+         raise ValueError("stored object %s is truncated" % self._fp.compact())
+      v.enter_dict()
+      for name, t, f in parse_records(buf):
+         if t == 'l':
+            v.visit_entry(name, t, fp.fingerprint(f))
+         else:
+            v.visit_entry(name, t, store_wrap(self._store, f))
+      v.leave_dict()
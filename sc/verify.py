@@ -0,0 +1,180 @@
+"""Check objects against expected fingerprints.
+
+Computing the fingerprint of an object and comparing it with the
+expected one reads all its data, even when the object differs early
+on. When the dictionaries of the expected object are known, e.g. from
+an object store where it was published, the object is checked against
+them instead, one dictionary at a time, depth first (see sc.walk):
+
+- the entries of each dictionary are compared by name and type with
+  those expected as they are listed, and fingerprint references (and
+  file sizes, when known from a manifest) are compared, without
+  reading any file;
+
+- once all its entries are listed, the files of the dictionary are
+  fingerprinted, smallest first, in parallel.
+
+The check stops at the first difference found, and only holds the
+entries of the dictionaries along the current path. Without the
+expected dictionaries, only the fingerprint of the whole object can be
+compared.
+"""
+
+from __future__ import print_function
+
+import sys
+import multiprocessing.pool
+from sc import fp, walk, diff, par
+from sc.store import parse_records
+
+class _mismatch(Exception):
+   pass
+
+def _cost(obj):
+   # the size of a file, when it is known without reading it
+   if hasattr(obj, 'stat'):
+      return obj.stat().st_size
+   return 0
+
+def _check(item):
+   cost, path, t, obj, expected = item
+   return item, bytes(walk.walk(obj, fp.compute_visitor())._fp)
+
+class _check_visitor(object):
+   """Visitor comparing a dictionary with its expected entries.
+
+   recs are the serialized entries expected. Files are checked when
+   the dictionary is left, dictionaries by their own visitor, or
+   fingerprinted as a whole if their entries are not known. A
+   _mismatch is raised at the first difference.
+   """
+
+   visit_files = True
+
+   def __init__(self, c, path, recs):
+      self._c = c
+      self._path = path
+      self._recs = recs
+
+   def _fail(self, name, t, reason):
+      raise _mismatch(self._path + (name,), t, reason)
+
+   def enter_file(self, sz):
+      raise _mismatch(self._path, 't', "file instead of dictionary")
+
+   def enter_dict(self):
+      self._ents = {}
+      for name, t, f in parse_records(self._recs):
+         self._ents[name] = (t, bytes(f))
+      self._files = []
+      self._n = 0
+
+   def _expect(self, name, t):
+      # pop the expected fingerprint of entry name, of actual type t
+      if name not in self._ents:
+         self._fail(name, t, "unexpected entry")
+      et, f = self._ents.pop(name)
+      if et != t:
+         self._fail(name, et, "type differs")
+      self._n += 1
+      return f
+
+   def visit_entry(self, name, t, obj):
+      f = self._expect(name, t)
+      if t == 'l':
+         if obj.binary() != f:
+            self._fail(name, t, "reference differs")
+         return
+      cost = _cost(obj)
+      sizes = self._c.sizes
+      if sizes is not None and hasattr(obj, 'stat') and sizes.get(f, cost) != cost:
+         self._fail(name, t, "size differs")
+      self._files.append((cost, self._path + (name,), t, obj, f))
+
+   def enter_entry(self, name, t):
+      f = self._expect(name, t)
+      try:
+         recs = self._c.records(f)
+      except KeyError:
+         cv = fp.compute_visitor()
+      else:
+         cv = _check_visitor(self._c, self._path + (name,), recs)
+      self._cur = f
+      return cv
+
+   def leave_entry(self, name, t, cv):
+      if isinstance(cv, fp.compute_visitor) and bytes(cv._fp) != self._cur:
+         self._fail(name, t, "content differs")
+
+   def leave_dict(self):
+      c = self._c
+      if c.verbose:
+         print("dictionary %s: %d entries" % (diff.path_str(self._path, 't'), self._n), file=sys.stderr)
+      if self._ents:
+         name = min(self._ents)
+         self._fail(name, self._ents[name][0], "missing")
+      files = self._files
+      self._files = None
+      files.sort(key=lambda item: item[:2])
+      if c.pool is not None and len(files) > 1:
+         results = c.pool.imap_unordered(_check, files)
+      else:
+         results = (_check(item) for item in files)
+      for (cost, path, t, o, e), f in results:
+         if c.verbose:
+            print("%s: %s" % (diff.path_str(path, t), fp.fingerprint(f).compact()), file=sys.stderr)
+         if f != e:
+            raise _mismatch(path, t, "content differs")
+
+class _checker(object):
+   """State shared by the visitors of a check."""
+
+   def __init__(self, records, pool, sizes, verbose):
+      self.records = records
+      self.pool = pool
+      self.sizes = sizes
+      self.verbose = verbose
+
+def check(obj, expected, records = None, jobs = 1, verbose = False, sizes = None):
+   """Check that the fingerprint of obj is expected.
+
+   records is a function returning the serialized entries of an
+   expected dictionary given its binary fingerprint, and raising
+   KeyError for unknown dictionaries (e.g. the records method of a
+   store.obj_store); if None, or if the root is not known, the whole
+   fingerprint of obj is computed and compared.
+   If sizes is not None, it maps the binary fingerprints of expected
+   files to their sizes, which are checked before the files are read
+   (see manifest.load). Up to jobs objects are fingerprinted in
+   parallel.
+
+   Returns None if obj matches, otherwise a tuple (path, t, reason)
+   for the first difference found, where t is the expected type of the
+   entry at path.
+   """
+   assert isinstance(obj, fp.fingerprintable)
+   expected = fp.fingerprint(expected).digest()
+   recs = None
+   if records is not None:
+      try:
+         recs = records(expected)
+      except KeyError:
+         pass
+   if recs is None:
+      if par.compute(obj, jobs, verbose=verbose).digest() != expected:
+         return (), 't', "content differs"
+      return None
+
+   pool = None
+   if jobs > 1:
+      pool = multiprocessing.pool.ThreadPool(jobs)
+   c = _checker(records, pool, sizes, verbose)
+   try:
+      walk.walk(obj, _check_visitor(c, (), recs), sort=True)
+   except _mismatch as e:
+      return e.args
+   finally:
+      if pool is not None:
+         pool.terminate()
+         pool.join()
+   return None
@@ -0,0 +1,140 @@
+"""Iterative traversal of abstract object trees.
+
+A visitor normally visits the entries of a dictionary by calling
+obj.visit(child) from its visit_entry method, so that each level of
+nesting takes a few Python frames. walk() drives the same visitor
+protocol with an explicit stack instead, so that the depth of a tree
+is only limited by memory.
+
+For this, a visitor may split its visit_entry method in two hooks:
+
+- v.enter_entry(name, t) checks the entry and returns the visitor
+  for the object of type t ('s' or 't') named name;
+
+- v.leave_entry(name, t, child) is called with that visitor once the
+  object has been visited.
+
+Visitors without these hooks receive visit_entry as usual. Visitors
+with a true ``visit_files`` attribute use the hooks for dictionaries
+only, and receive visit_entry for files, e.g. to skip the files whose
+fingerprint is cached.
+
+The entries of a dictionary are collected while it is visited, then
+visited in turn. This requires that they remain valid after the visit
+of the dictionary returns, which its class indicates with a true
+``standalone`` attribute (e.g. fs.fs_wrap, but not js.stream_wrap).
+Other dictionaries are visited in place, one level of recursion each.
+
+Since the entries are collected first, they can also be visited in
+name order, see help(walk).
+"""
+
+from sc import fp
+
+class _collect(object):
+   """Forward the file events to a visitor, collect dictionary entries.
+
+   The leave_dict event is held back until all the collected entries
+   have been visited.
+   """
+
+   def reset(self, v):
+      self.v = v
+      self.ents = None
+
+   def enter_file(self, sz):
+      self.v.enter_file(sz)
+
+   def visit_data(self, b):
+      self.v.visit_data(b)
+
+   def leave_file(self):
+      self.v.leave_file()
+
+   def enter_dict(self):
+      self.v.enter_dict()
+      self.ents = []
+
+   def visit_entry(self, name, t, obj):
+      self.ents.append((name, t, obj))
+
+   def leave_dict(self):
+      pass
+
+def _splits(v, t, obj):
+   # True if the entry is to be visited with the hooks of v
+   if t == 'l' or not isinstance(obj, fp.fingerprintable) or not hasattr(v, 'enter_entry'):
+      return False
+   return t == 't' or not getattr(v, 'visit_files', False)
+
+class _inplace(object):
+   """Forward all events to a visitor, walking the entries as they come."""
+
+   def __init__(self, v):
+      self.v = v
+
+   def __getattr__(self, name):
+      return getattr(self.v, name)
+
+   def visit_entry(self, name, t, obj):
+      v = self.v
+      if not _splits(v, t, obj):
+         v.visit_entry(name, t, obj)
+      else:
+         cv = v.enter_entry(name, t)
+         walk(obj, cv)
+         v.leave_entry(name, t, cv)
+
+def _entries(ents, sort):
+   if sort:
+      ents.sort(key=lambda e: e[0])
+   return iter(ents)
+
+def walk(obj, v, sort = False):
+   """Visit a fingerprintable object with visitor v, using an explicit stack.
+
+   The events received by v are the same, in the same order, as with
+   obj.visit(v). If sort is non-false, the entries of standalone
+   dictionaries are visited in name order instead; the entries of
+   other dictionaries are visited in place, in their own order.
+   Returns v.
+   """
+   assert isinstance(obj, fp.fingerprintable)
+   if not obj.standalone:
+      obj.visit(_inplace(v))
+      return v
+
+   c = _collect()
+   c.reset(v)
+   obj.visit(c)
+   if c.ents is None:
+      return v
+
+   # each frame holds the visitor of a dictionary, the iterator over
+   # its entries and the name and type of the dictionary in its parent.
+   stack = [(v, _entries(c.ents, sort), None, None)]
+   while stack:
+      top = stack[-1]
+      pv = top[0]
+      for name, t, obj in top[1]:
+         if not _splits(pv, t, obj):
+            pv.visit_entry(name, t, obj)
+            continue
+         cv = pv.enter_entry(name, t)
+         if not obj.standalone:
+            walk(obj, cv)
+            pv.leave_entry(name, t, cv)
+            continue
+         c.reset(cv)
+         obj.visit(c)
+         if c.ents is None:
+            pv.leave_entry(name, t, cv)
+            continue
+         stack.append((cv, _entries(c.ents, sort), name, t))
+         break
+      else:
+         stack.pop()
+         pv.leave_dict()
+         if stack:
+            stack[-1][0].leave_entry(top[2], top[3], pv)
+   return v